@@ -4,18 +4,29 @@ Com todos os endpoints funcionando através do AnalyticsService
 """
 
 from fastapi import APIRouter, Depends, Query, HTTPException
-from sqlalchemy.orm import Session
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from datetime import datetime, timedelta, date
 from typing import Optional
+from pydantic import ValidationError
 import logging
+import os
 
-from ..core.database import get_db
-from ..core.cache import cache, cache_key_builder
+from ..core.database import get_async_db
+from ..core.cache import cache, cache_key_builder, cache_tags, cached_response
 from ..core.config import settings
-from ..services.analytics_service import AnalyticsService
+from ..core.filter_compiler import parse_filter_params
+from ..services.analytics_service import AsyncAnalyticsService, call_analytics
+from ..services.sales_cube import sales_cube
+from ..services.export_service import (
+    ExportError, MEDIA_TYPES, build_export_query, export_filename, make_encoder, stream_export
+)
+from ..services.job_queue import JobError, get_job_store
+from ..services.panels import DashboardParams, get_panel, load_dashboard
 from ..schemas import schemas
-from .nlp_processor import NaturalLanguageProcessor
+from .nlp_processor import process_natural_query
+from .nlp_batch import process_natural_query_batch
 from app.schemas.schemas import WidgetDataRequest
 
 router = APIRouter()
@@ -37,8 +48,8 @@ async def get_overview(
     price_range: Optional[str] = Query(None, description="Comma-separated ranges: low,medium,high"),
     delivery_zone: Optional[str] = Query(None, description="Comma-separated zones: north,south"),
     order_size: Optional[str] = Query(None, description="Comma-separated sizes: small,medium,large"),
-    
-    db: Session = Depends(get_db)
+    engine: Optional[str] = Query(None, pattern="^(postgres|duckdb)$", description="Analytic engine (default from settings)"),
+    exact: bool = Query(False, description="Exact unique customers (COUNT DISTINCT) instead of the HyperLogLog estimate"),
 ):
     """
     Get overview metrics with advanced filtering support
@@ -51,50 +62,29 @@ async def get_overview(
         logger.info(f"  - time_of_day: {time_of_day}")
         logger.info(f"  - categories: {categories}")
         
-        # Build cache key com filtros
-        cache_key = cache_key_builder(
-            "overview",
-            start_date=str(start_date) if start_date else None,
-            end_date=str(end_date) if end_date else None,
-            store_id=store_id,
+        # Preparar filtros para o service
+        filters = parse_filter_params(
             channels=channels,
             day_of_week=day_of_week,
             time_of_day=time_of_day,
             categories=categories,
-            customer_type=customer_type
+            customer_type=customer_type,
+            price_range=price_range,
+            delivery_zone=delivery_zone,
+            order_size=order_size,
         )
         
-        # Try cache first
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            logger.info(f"Cache HIT: {cache_key}")
-            return cached_result
-        
-        # Preparar filtros para o service
-        filters = {
-            'channels': channels.split(',') if channels else None,
-            'day_of_week': day_of_week.split(',') if day_of_week else None,
-            'time_of_day': time_of_day.split(',') if time_of_day else None,
-            'categories': categories.split(',') if categories else None,
-            'customer_type': customer_type.split(',') if customer_type else None,
-            'price_range': price_range.split(',') if price_range else None,
-            'delivery_zone': delivery_zone.split(',') if delivery_zone else None,
-            'order_size': order_size.split(',') if order_size else None,
-        }
-        
-        # Chamar service com filtros
-        service = AnalyticsService(db)
-        result = service.get_overview_metrics(
-            start_date, 
-            end_date, 
-            store_id,
-            filters=filters  # PASSAR FILTROS PARA O SERVICE
+        # Cache com single-flight + stale-while-revalidate (ver services/panels.py)
+        params = DashboardParams(
+            start_date=start_date,
+            end_date=end_date,
+            store_id=store_id,
+            filters=filters,  # PASSAR FILTROS PARA O SERVICE
+            engine=engine,
+            exact=exact
         )
-        
-        # Cache the result
-        cache.set(cache_key, result, ttl=settings.CACHE_TTL_OVERVIEW)
-        
-        return result
+        result, status = await get_panel('overview', params)
+        return cached_response(result, status)
         
     except Exception as e:
         logger.error(f"Error in get_overview: {str(e)}")
@@ -106,7 +96,8 @@ async def get_timeline(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
     store_id: Optional[int] = Query(None),
-    granularity: str = Query("day", regex="^(hour|day|week|month)$"),
+    granularity: str = Query("day", pattern="^(hour|day|week|month)$"),
+    compare: bool = Query(False, description="Include totals vs the previous period"),
     
     # FILTROS AVANÇADOS
     channels: Optional[str] = Query(None),
@@ -114,8 +105,7 @@ async def get_timeline(
     time_of_day: Optional[str] = Query(None),
     categories: Optional[str] = Query(None),
     customer_type: Optional[str] = Query(None),
-    
-    db: Session = Depends(get_db)
+    engine: Optional[str] = Query(None, pattern="^(postgres|duckdb)$", description="Analytic engine (default from settings)"),
 ):
     """
     Get timeline data with filters
@@ -123,42 +113,26 @@ async def get_timeline(
     try:
         logger.info(f"📈 Timeline API - Filtros: channels={channels}, day_of_week={day_of_week}")
         
-        cache_key = cache_key_builder(
-            "timeline",
-            start_date=str(start_date) if start_date else None,
-            end_date=str(end_date) if end_date else None,
-            store_id=store_id,
-            granularity=granularity,
+        # Preparar filtros
+        filters = parse_filter_params(
             channels=channels,
             day_of_week=day_of_week,
-            time_of_day=time_of_day
+            time_of_day=time_of_day,
+            categories=categories,
+            customer_type=customer_type,
         )
         
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-        
-        # Preparar filtros
-        filters = {
-            'channels': channels.split(',') if channels else None,
-            'day_of_week': day_of_week.split(',') if day_of_week else None,
-            'time_of_day': time_of_day.split(',') if time_of_day else None,
-            'categories': categories.split(',') if categories else None,
-            'customer_type': customer_type.split(',') if customer_type else None,
-        }
-        
-        service = AnalyticsService(db)
-        result = service.get_timeline_data(
-            start_date, 
-            end_date, 
-            store_id, 
-            granularity,
-            filters=filters
+        params = DashboardParams(
+            start_date=start_date,
+            end_date=end_date,
+            store_id=store_id,
+            filters=filters,
+            granularity=granularity,
+            compare=compare,
+            engine=engine
         )
-        
-        cache.set(cache_key, result, ttl=settings.CACHE_TTL_TIMELINE)
-        
-        return result
+        result, status = await get_panel('timeline', params)
+        return cached_response(result, status)
         
     except Exception as e:
         logger.error(f"Error in get_timeline: {str(e)}")
@@ -181,8 +155,7 @@ async def get_top_products(
     price_range: Optional[str] = Query(None),
     delivery_zone: Optional[str] = Query(None),
     order_size: Optional[str] = Query(None),
-    
-    db: Session = Depends(get_db)
+    engine: Optional[str] = Query(None, pattern="^(postgres|duckdb)$", description="Analytic engine (default from settings)"),
 ):
     """
     Get top products with filters
@@ -190,44 +163,28 @@ async def get_top_products(
     try:
         logger.info(f"🍔 Top Products API - Filtros: channels={channels}, categories={categories}")
         
-        cache_key = cache_key_builder(
-            "top_products",
-            start_date=str(start_date) if start_date else None,
-            end_date=str(end_date) if end_date else None,
-            store_id=store_id,
-            limit=limit,
+        # Preparar filtros
+        filters = parse_filter_params(
             channels=channels,
-            categories=categories
+            day_of_week=day_of_week,
+            time_of_day=time_of_day,
+            categories=categories,
+            customer_type=customer_type,
+            price_range=price_range,
+            delivery_zone=delivery_zone,
+            order_size=order_size,
         )
         
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-        
-        # Preparar filtros
-        filters = {
-            'channels': channels.split(',') if channels else None,
-            'day_of_week': day_of_week.split(',') if day_of_week else None,
-            'time_of_day': time_of_day.split(',') if time_of_day else None,
-            'categories': categories.split(',') if categories else None,
-            'customer_type': customer_type.split(',') if customer_type else None,
-            'price_range': price_range.split(',') if price_range else None,
-            'delivery_zone': delivery_zone.split(',') if delivery_zone else None,
-            'order_size': order_size.split(',') if order_size else None,
-        }
-        
-        service = AnalyticsService(db)
-        result = service.get_top_products(
-            start_date, 
-            end_date, 
-            store_id, 
-            limit,
-            filters=filters
+        params = DashboardParams(
+            start_date=start_date,
+            end_date=end_date,
+            store_id=store_id,
+            filters=filters,
+            limit=limit,
+            engine=engine
         )
-        
-        cache.set(cache_key, result, ttl=settings.CACHE_TTL_PRODUCTS)
-        
-        return result
+        result, status = await get_panel('top_products', params)
+        return cached_response(result, status)
         
     except Exception as e:
         logger.error(f"Error in get_top_products: {str(e)}")
@@ -235,25 +192,14 @@ async def get_top_products(
 
 @router.get("/insights", response_model=schemas.InsightsResponse)
 async def get_insights(
-    store_id: Optional[int] = Query(None),
-    db: Session = Depends(get_db)
+    store_id: Optional[int] = Query(None)
 ):
     """
     Get business insights based on data analysis
     """
     try:
-        cache_key = cache_key_builder("insights", store_id=store_id)
-        
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            return cached_result
-        
-        service = AnalyticsService(db)
-        result = service.get_business_insights(store_id)
-        
-        cache.set(cache_key, result, ttl=settings.CACHE_TTL_INSIGHTS)
-        
-        return result
+        result, status = await get_panel('insights', DashboardParams(store_id=store_id))
+        return cached_response(result, status)
         
     except Exception as e:
         logger.error(f"Error in get_insights: {str(e)}")
@@ -270,8 +216,7 @@ async def get_channels(
     channels: Optional[str] = Query(None),
     day_of_week: Optional[str] = Query(None),
     time_of_day: Optional[str] = Query(None),
-    
-    db: Session = Depends(get_db)
+    engine: Optional[str] = Query(None, pattern="^(postgres|duckdb)$", description="Analytic engine (default from settings)"),
 ):
     """
     Get performance metrics by sales channel
@@ -280,48 +225,222 @@ async def get_channels(
         logger.info(f"📱 Channels API - Filtros: channels={channels}")
         
         # Preparar filtros
-        filters = {
-            'channels': channels.split(',') if channels else None,
-            'day_of_week': day_of_week.split(',') if day_of_week else None,
-            'time_of_day': time_of_day.split(',') if time_of_day else None,
-        }
-        
-        service = AnalyticsService(db)
-        result = service.get_channels_performance(start_date, end_date, store_id, filters=filters)
+        filters = parse_filter_params(
+            channels=channels,
+            day_of_week=day_of_week,
+            time_of_day=time_of_day,
+        )
         
-        return result
+        params = DashboardParams(
+            start_date=start_date,
+            end_date=end_date,
+            store_id=store_id,
+            filters=filters,
+            engine=engine
+        )
+        result, status = await get_panel('channels', params)
+        return cached_response(result, status)
         
     except Exception as e:
         logger.error(f"Error in get_channels: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/natural-query", response_model=schemas.NaturalQueryResponse)
-async def natural_query(
-    request: schemas.NaturalQueryRequest,
-    db: Session = Depends(get_db)
+@router.get("/dashboard", response_model=schemas.DashboardResponse)
+async def get_dashboard(
+    # Parâmetros básicos
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    store_id: Optional[int] = Query(None),
+    granularity: str = Query("day", pattern="^(hour|day|week|month)$"),
+    limit: int = Query(10, ge=1, le=50, description="Top products limit"),
+    panels: Optional[str] = Query(None, description="Comma-separated panels: overview,timeline,top_products,channels,insights"),
+
+    # FILTROS AVANÇADOS
+    channels: Optional[str] = Query(None),
+    day_of_week: Optional[str] = Query(None),
+    time_of_day: Optional[str] = Query(None),
+    categories: Optional[str] = Query(None),
+    customer_type: Optional[str] = Query(None),
+    price_range: Optional[str] = Query(None),
+    delivery_zone: Optional[str] = Query(None),
+    order_size: Optional[str] = Query(None),
+    engine: Optional[str] = Query(None, pattern="^(postgres|duckdb)$", description="Analytic engine (default from settings)"),
+    exact: bool = Query(False, description="Exact unique customers instead of the HyperLogLog estimate"),
 ):
+    """
+    Load all dashboard panels in one request.
+    Panels run concurrently, each on its own pooled connection, and share
+    cache entries with the standalone endpoints.
+    """
+    try:
+        filters = parse_filter_params(
+            channels=channels,
+            day_of_week=day_of_week,
+            time_of_day=time_of_day,
+            categories=categories,
+            customer_type=customer_type,
+            price_range=price_range,
+            delivery_zone=delivery_zone,
+            order_size=order_size,
+        )
+
+        params = DashboardParams(
+            start_date=start_date,
+            end_date=end_date,
+            store_id=store_id,
+            filters=filters,
+            granularity=granularity,
+            limit=limit,
+            engine=engine,
+            exact=exact
+        )
+        requested = [p.strip() for p in panels.split(',') if p.strip()] if panels else None
+
+        return await load_dashboard(params, requested)
+
+    except Exception as e:
+        logger.error(f"Error in get_dashboard: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/export")
+async def export_data(request: schemas.ExportRequest):
+    """
+    Stream an export as CSV, NDJSON or Parquet.
+    Rows come from a server-side cursor in chunks, so any size runs in
+    constant memory without blocking the worker.
+    """
+    filters = request.filters.model_dump() if request.filters else {}
+    try:
+        query, params = build_export_query(request.export_type, filters, request.granularity)
+        encoder = make_encoder(request.format)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    logger.info(f"📤 Export: {request.export_type} as {request.format}")
+    filename = export_filename(request.export_type, request.format, filters)
+    return StreamingResponse(
+        stream_export(query, params, encoder),
+        media_type=MEDIA_TYPES[request.format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ==================== BACKGROUND JOBS ====================
+
+JOB_PARAMS = {
+    'export': schemas.ExportRequest,
+    'timeline': schemas.TimelineJobParams,
+    'retention': schemas.RetentionJobParams,
+}
+
+def _job_status(job: dict) -> schemas.JobStatus:
+    result_url = None
+    if job['status'] == 'done':
+        result_url = f"{settings.API_V1_STR}/analytics/jobs/{job['id']}/result"
+    return schemas.JobStatus(**{k: v for k, v in job.items() if k in schemas.JobStatus.model_fields},
+                             result_url=result_url)
+
+@router.post("/jobs", response_model=schemas.JobStatus, status_code=202)
+async def submit_job(request: schemas.JobRequest):
+    """
+    Queue a long-running export / retention analysis / timeline.
+    Poll GET /jobs/{id} and download GET /jobs/{id}/result when done.
+    """
+    try:
+        params = JOB_PARAMS[request.job_type](**request.params)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+    if request.job_type == 'export':
+        try:
+            filters = params.filters.model_dump() if params.filters else {}
+            build_export_query(params.export_type, filters, params.granularity)
+            make_encoder(params.format)
+        except ExportError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        store = get_job_store()
+        job_id = store.submit(request.job_type, params.model_dump(mode='json'))
+    except JobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    logger.info(f"🧵 Job queued: {request.job_type} {job_id}")
+    return _job_status(store.get(job_id))
+
+@router.get("/jobs/{job_id}", response_model=schemas.JobStatus)
+async def get_job(job_id: str):
+    """
+    Status and progress of a background job
+    """
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_status(job)
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    Result of a finished job: the export file, or the JSON result
+    """
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job['status'] == 'failed':
+        raise HTTPException(status_code=409, detail=f"Job failed: {job['error']}")
+    if job['status'] != 'done':
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if not job['result_path'] or not os.path.exists(job['result_path']):
+        raise HTTPException(status_code=410, detail="Job result expired")
+
+    if job['result_format'] == 'json':
+        return FileResponse(job['result_path'], media_type='application/json')
+    params = job['params']
+    return FileResponse(
+        job['result_path'],
+        media_type=MEDIA_TYPES[job['result_format']],
+        filename=export_filename(params['export_type'], job['result_format'], params.get('filters'))
+    )
+
+@router.post("/natural-query", response_model=schemas.NaturalQueryResponse)
+async def natural_query(request: schemas.NaturalQueryRequest):
     """
     Process natural language queries about the data
+    Answers come from the same panels/cache as the dashboard tiles
     """
     try:
         logger.info(f"🧠 Natural Query: {request.query}")
-        
-        processor = NaturalLanguageProcessor(db)
-        result = processor.process_query(request.query, request.context)
-        
-        return result
+        return await process_natural_query(request.query, request.context)
         
     except Exception as e:
         logger.error(f"Error in natural_query: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/natural-query/batch", response_model=schemas.NaturalQueryBatchResponse)
+async def natural_query_batch(request: schemas.NaturalQueryBatchRequest):
+    """
+    Answer several natural language questions at once
+    Questions over the same period, store and table share one GROUPING SETS query
+    """
+    if len(request.queries) > settings.NLP_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.NLP_BATCH_MAX_QUERIES} queries per batch"
+        )
+    try:
+        logger.info(f"🧠 Natural Query batch: {len(request.queries)} perguntas")
+        return await process_natural_query_batch(request.queries, request.context)
+        
+    except Exception as e:
+        logger.error(f"Error in natural_query_batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ==================== ENDPOINTS PRODUCT TIMELINE CORRIGIDOS ====================
 
 @router.get("/products-list", response_model=schemas.ProductsListResponse)
 async def get_products_list(
     store_id: Optional[int] = Query(None, description="Filter by store ID"),
     search: Optional[str] = Query(None, description="Search term"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get list of all products for selection
@@ -331,8 +450,8 @@ async def get_products_list(
         logger.info(f"📦 Fetching products list via AnalyticsService...")
         
         # Usar o AnalyticsService
-        service = AnalyticsService(db)
-        result = service.get_products_list(store_id)
+        service = AsyncAnalyticsService(db)
+        result = await service.get_products_list(store_id)
         
         # Se houver search, filtrar os resultados
         if search and result.get('products'):
@@ -353,14 +472,13 @@ async def get_product_timeline(
     product_id: int = Query(..., description="Product ID"),
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
-    granularity: str = Query("day", regex="^(hour|day|week|month)$"),
+    store_id: Optional[int] = Query(None, description="Filter by store ID"),
+    granularity: str = Query("day", pattern="^(hour|day|week|month)$"),
     
     # Filters
     channels: Optional[str] = Query(None, description="Comma-separated channel names"),
     day_of_week: Optional[str] = Query(None, description="Comma-separated days (mon,tue,wed,thu,fri,sat,sun)"),
     time_of_day: Optional[str] = Query(None, description="Comma-separated periods (morning,afternoon,evening,night)"),
-    
-    db: Session = Depends(get_db)
 ):
     """
     Get sales timeline for a specific product
@@ -372,25 +490,31 @@ async def get_product_timeline(
         logger.info(f"Filters: channels={channels}, day_of_week={day_of_week}, time_of_day={time_of_day}")
         
         # Build filters dict para o service
-        filters = {}
-        if channels:
-            filters['channels'] = [c.strip().lower() for c in channels.split(',')]
-        if day_of_week:
-            filters['day_of_week'] = [d.strip().lower() for d in day_of_week.split(',')]
-        if time_of_day:
-            filters['time_of_day'] = [t.strip().lower() for t in time_of_day.split(',')]
+        filters = parse_filter_params(
+            channels=channels,
+            day_of_week=day_of_week,
+            time_of_day=time_of_day,
+        )
         
-        # Usar o AnalyticsService
-        service = AnalyticsService(db)
-        result = service.get_product_timeline(
+        cache_key = cache_key_builder(
+            "product_timeline",
             product_id=product_id,
-            start_date=start_date,
-            end_date=end_date,
+            start_date=str(start_date) if start_date else None,
+            end_date=str(end_date) if end_date else None,
+            store_id=store_id,
             granularity=granularity,
             filters=filters
         )
-        
-        return result
+        result, status = await cache.get_or_compute(
+            cache_key,
+            lambda: call_analytics('get_product_timeline', product_id, start_date, end_date,
+                                   granularity=granularity, filters=filters, store_id=store_id),
+            ttl=settings.CACHE_TTL_TIMELINE,
+            stale_ttl=settings.CACHE_STALE_TTL_TIMELINE,
+            tags=cache_tags("product_timeline", store_id, start_date, end_date),
+            with_status=True
+        )
+        return cached_response(result, status)
         
     except Exception as e:
         logger.error(f"Error in get_product_timeline: {str(e)}")
@@ -401,7 +525,7 @@ async def get_product_timeline(
 @router.post("/widget-data")
 async def get_widget_data(
     request: WidgetDataRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Fetch data for dashboard widgets - VERSÃO SIMPLIFICADA E FUNCIONAL
@@ -444,10 +568,10 @@ async def get_widget_data(
                     ORDER BY value DESC
                 """
                 
-                results = db.execute(
+                results = (await db.execute(
                     text(query),
                     {"start_date": start_date, "end_date": end_date}
-                ).fetchall()
+                )).fetchall()
                 
                 result_data = [
                     {"name": row.name, "value": float(row.value)}
@@ -462,10 +586,10 @@ async def get_widget_data(
                     WHERE created_at >= :start_date AND created_at <= :end_date
                 """
                 
-                result = db.execute(
+                result = (await db.execute(
                     text(query),
                     {"start_date": start_date, "end_date": end_date}
-                ).fetchone()
+                )).fetchone()
                 
                 result_data = [
                     {"name": "Total", "value": float(result.value) if result else 0}
@@ -491,14 +615,14 @@ async def get_widget_data(
                 LIMIT :limit
             """
             
-            results = db.execute(
+            results = (await db.execute(
                 text(query),
                 {
                     "start_date": start_date,
                     "end_date": end_date,
                     "limit": request.limit or 10
                 }
-            ).fetchall()
+            )).fetchall()
             
             if results:
                 result_data = [
@@ -508,7 +632,7 @@ async def get_widget_data(
             else:
                 # Se não tiver vendas no período, mostrar produtos disponíveis
                 query_all = "SELECT name FROM products WHERE name IS NOT NULL LIMIT 5"
-                products = db.execute(text(query_all)).fetchall()
+                products = (await db.execute(text(query_all))).fetchall()
                 result_data = [
                     {"name": p.name, "value": 0}
                     for p in products
@@ -529,10 +653,10 @@ async def get_widget_data(
                 ORDER BY revenue DESC
             """
             
-            results = db.execute(
+            results = (await db.execute(
                 text(query),
                 {"start_date": start_date, "end_date": end_date}
-            ).fetchall()
+            )).fetchall()
             
             result_data = [
                 {"name": row.name, "value": float(row.revenue)}
@@ -555,14 +679,14 @@ async def get_widget_data(
                     LIMIT :limit
                 """
                 
-                results = db.execute(
+                results = (await db.execute(
                     text(query),
                     {
                         "start_date": start_date,
                         "end_date": end_date,
                         "limit": request.limit or 10
                     }
-                ).fetchall()
+                )).fetchall()
                 
                 result_data = [
                     {"name": row.name, "value": float(row.value)}
@@ -576,10 +700,10 @@ async def get_widget_data(
                     WHERE created_at >= :start_date AND created_at <= :end_date
                 """
                 
-                result = db.execute(
+                result = (await db.execute(
                     text(query),
                     {"start_date": start_date, "end_date": end_date}
-                ).fetchone()
+                )).fetchone()
                 
                 result_data = [
                     {"name": "Total", "value": float(result.value) if result else 0}
@@ -616,13 +740,13 @@ async def get_widget_data(
 # ==================== FIM DOS ENDPOINTS PRODUCT TIMELINE ====================
 
 @router.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     """
     Health check endpoint
     """
     try:
         # Test database connection
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         db_status = True
     except:
         db_status = False
@@ -637,12 +761,20 @@ async def health_check(db: Session = Depends(get_db)):
         "timestamp": datetime.utcnow()
     }
 
+@router.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters per cache tier (L1 in-process, L2 Redis) for this
+    worker, plus the in-memory sales cube (size, coverage, hits)
+    """
+    return {**cache.stats(), 'cube': sales_cube.stats()}
+
 @router.get("/test-filters")
 async def test_filters(
     channels: Optional[str] = Query(None, description="Test channels filter"),
     day_of_week: Optional[str] = Query(None, description="Test day filter"),
     time_of_day: Optional[str] = Query(None, description="Test time filter"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Test endpoint to verify filters are working
@@ -663,18 +795,18 @@ async def test_filters(
     # Test database query
     try:
         # Testar contagem de vendas
-        sales_count = db.execute(text("SELECT COUNT(*) FROM sales")).scalar()
+        sales_count = (await db.execute(text("SELECT COUNT(*) FROM sales"))).scalar()
         test_result["sales_count"] = sales_count
         
         # Testar channels disponíveis
-        channels_db = db.execute(text("SELECT id, name FROM channels ORDER BY id")).fetchall()
+        channels_db = (await db.execute(text("SELECT id, name FROM channels ORDER BY id"))).fetchall()
         test_result["available_channels"] = [
             {"id": c.id, "name": c.name} 
             for c in channels_db
         ]
         
         # Testar produtos disponíveis
-        products_count = db.execute(text("SELECT COUNT(*) FROM products")).scalar()
+        products_count = (await db.execute(text("SELECT COUNT(*) FROM products"))).scalar()
         test_result["products_count"] = products_count
         
     except Exception as e:
@@ -0,0 +1,403 @@
+"""
+Batch natural queries
+Answers many questions in one request. Every question is parsed first;
+those that read the same table over the same period and store share one
+GROUPING SETS statement (one grouping set per distinct combination of
+breakdown and slices they need), and each answer is cut from the shared
+rows and formatted by the single-question formatters.
+
+- sales scan: revenue, ticket, channel, ticket trend and delivery, from
+  the hourly rollup when it is ready (raw sales otherwise)
+- product scan: top products, with or without slices
+
+A question with nothing to share (alone on its scan, retention, help) goes
+through process_natural_query, so it still hits the dashboard panels and
+the intent cache.
+"""
+
+from sqlalchemy import text
+from datetime import date
+from types import SimpleNamespace
+from typing import Optional, Dict, Any, List, Tuple, NamedTuple
+import asyncio
+import logging
+import time
+
+from ..core.database import AsyncSessionLocal
+from ..core.filter_compiler import compile_filters
+from ..services.analytics_service import product_sales_range
+from ..services.nlp_router import parse_query, resolve_intent, NlpIntent
+from ..services.period_comparison import PeriodComparison, metric_delta, ratio
+from ..services.rollup_service import pick_sales_source, operations_columns, operations_metrics
+from .nlp_processor import (
+    INTENT_HANDLERS, build_answer, error_answer, process_natural_query, delivery_rows
+)
+
+logger = logging.getLogger(__name__)
+
+# Intent -> tabela varrida
+INTENT_SOURCES = {
+    'revenue': 'sales',
+    'ticket': 'sales',
+    'channel': 'sales',
+    'ticket_trend': 'sales',
+    'delivery': 'sales',
+    'products': 'products',
+    'complex_product': 'products',
+}
+
+# Quebra que a intenção lê, além dos recortes da pergunta
+INTENT_DIMENSIONS = {
+    'channel': ('channel',),
+    'ticket_trend': ('channel',),
+    'delivery': ('dow', 'hour'),
+}
+
+# Intenções que comparam com o período anterior (a varredura cobre os dois)
+COMPARE_INTENTS = {'revenue', 'ticket', 'ticket_trend'}
+
+# Dimensões -> (expressão, alias); 'channel' traz também nome e tipo
+DIMENSIONS = ('channel', 'dow', 'hour')
+DIMENSION_COLUMNS = {
+    'channel': (('s.channel_id', 'channel_id'), ('c.name', 'channel_name'), ('c.type', 'channel_type')),
+    'dow': (('s.dow', 'dow'),),
+    'hour': (('s.hour', 'hour'),),
+}
+
+# Colunas de agrupamento na saída (o resto são agregados somáveis)
+GROUP_COLUMNS = {'cur', 'channel_id', 'channel_name', 'channel_type', 'dow', 'hour',
+                 'product_id', 'product_name'} | {f'g_{d}' for d in DIMENSIONS}
+
+TOP_PRODUCTS_LIMIT = 10  # same as the top_products tile
+
+
+class ScanKey(NamedTuple):
+    """Questions with the same key are answered by one statement"""
+    source: str
+    start_date: date
+    end_date: date
+    store_id: Optional[int]
+
+
+def question_dimensions(intent: NlpIntent) -> Tuple[str, ...]:
+    """Grouping set of one question: its breakdown plus its slices"""
+    needed = set(INTENT_DIMENSIONS.get(intent.intent, ()))
+    if intent.channel:
+        needed.add('channel')
+    if intent.weekday:
+        needed.add('dow')
+    if intent.period:
+        needed.add('hour')
+    return tuple(d for d in DIMENSIONS if d in needed)
+
+
+def scan_key(intent: NlpIntent) -> Optional[ScanKey]:
+    """None when the intent can't share a scan"""
+    source = INTENT_SOURCES.get(intent.intent)
+    if source is None:
+        return None
+    compiled = compile_filters(None, intent.start_date, intent.end_date, intent.store_id)
+    return ScanKey(source, compiled.start_date, compiled.end_date, intent.store_id)
+
+
+def plan_batch(intents: List[Optional[NlpIntent]]) -> Tuple[Dict[ScanKey, List[int]], List[int]]:
+    """
+    Split question indexes into shared scans (two or more questions on the
+    same key) and standalone questions
+    """
+    scans: Dict[ScanKey, List[int]] = {}
+    standalone = []
+    for i, intent in enumerate(intents):
+        key = scan_key(intent) if intent is not None else None
+        if key is None:
+            standalone.append(i)
+        else:
+            scans.setdefault(key, []).append(i)
+
+    for key in [key for key, indexes in scans.items() if len(indexes) < 2]:
+        standalone.extend(scans.pop(key))
+    return scans, sorted(standalone)
+
+
+def build_scan_query(key: ScanKey, intents: List[NlpIntent]) -> Tuple[str, Dict[str, Any]]:
+    """
+    One GROUPING SETS statement for every question of a scan. `cur` splits
+    the current period from the previous one (scanned only when a question
+    compares) and g_<dimension> = GROUPING() tells which set a row belongs
+    to. Dimensions no question uses are left out of the statement.
+    """
+    compiled = compile_filters(None, key.start_date, key.end_date, key.store_id)
+    compare = any(intent.intent in COMPARE_INTENTS for intent in intents)
+    window = PeriodComparison(compiled).union if compare else compiled
+
+    sets = sorted({question_dimensions(intent) for intent in intents}, key=lambda dims: (len(dims), dims))
+    used = {d for dims in sets for d in dims}
+
+    if key.source == 'sales':
+        source = pick_sales_source()
+        where, params = window.where(source.time_column)
+        scanned = f"{source.table} WHERE {where}"
+        base_columns = ['s.cur']
+        aggregates = [
+            f"COALESCE({source.orders}, 0) AS orders",
+            f"COALESCE({source.revenue}, 0) AS revenue",
+            operations_columns(source),
+        ]
+        joins = "LEFT JOIN channels c ON s.channel_id = c.id"
+        time_column = source.time_column
+        columns = "s.*"
+    else:
+        where, params = window.where('s.created_at')
+        scanned = f"sales s WHERE {where}"
+        base_columns = ['s.cur', 'p.id', 'p.name']
+        aggregates = [
+            "COUNT(DISTINCT ps.sale_id) AS times_sold",
+            "COALESCE(SUM(ps.quantity), 0) AS total_quantity",
+            "COALESCE(SUM(ps.total_price), 0) AS revenue",
+            "COALESCE(SUM(ps.base_price), 0) AS price_sum",
+            "COUNT(ps.base_price) AS price_count",
+        ]
+        joins = f"""
+            INNER JOIN product_sales ps ON ps.sale_id = s.id {product_sales_range()}
+            INNER JOIN products p ON p.id = ps.product_id
+            LEFT JOIN channels c ON s.channel_id = c.id
+        """
+        time_column = 's.created_at'
+        columns = "s.id, s.channel_id"
+
+    params['b_split'] = compiled.start
+    grouping_sets = ", ".join(
+        "(" + ", ".join(base_columns + [expr for d in dims for expr, _ in DIMENSION_COLUMNS[d]]) + ")"
+        for dims in sets
+    )
+    product_columns = "p.id AS product_id, p.name AS product_name," if key.source == 'products' else ""
+    # PostgreSQL only accepts grouping expressions in GROUPING() and the
+    # SELECT list, so unused dimensions come back as constants
+    dimension_columns = []
+    for d in DIMENSIONS:
+        if d in used:
+            dimension_columns += [f"{expr} AS {alias}" for expr, alias in DIMENSION_COLUMNS[d]]
+            dimension_columns.append(f"GROUPING({DIMENSION_COLUMNS[d][0][0]}) AS g_{d}")
+        else:
+            dimension_columns += [f"NULL AS {alias}" for _, alias in DIMENSION_COLUMNS[d]]
+            dimension_columns.append(f"1 AS g_{d}")
+
+    query = f"""
+        SELECT
+            s.cur,
+            {product_columns}
+            {', '.join(dimension_columns)},
+            {', '.join(aggregates)}
+        FROM (
+            SELECT {columns},
+                   {time_column} >= :b_split AS cur,
+                   EXTRACT(DOW FROM {time_column}) AS dow,
+                   EXTRACT(HOUR FROM {time_column}) AS hour
+            FROM {scanned}
+        ) s
+        {joins}
+        GROUP BY GROUPING SETS ({grouping_sets})
+    """
+    return query, params
+
+
+def row_dimensions(row: Dict[str, Any]) -> Tuple[str, ...]:
+    """Dimensions present in a row (GROUPING() = 1 means rolled up)"""
+    return tuple(d for d in DIMENSIONS if not row[f'g_{d}'])
+
+
+def question_rows(rows: List[Dict[str, Any]], intent: NlpIntent) -> List[Dict[str, Any]]:
+    """Rows of the question's grouping set that fall inside its slices"""
+    dims = question_dimensions(intent)
+    compiled = compile_filters(intent.filters(), intent.start_date, intent.end_date, intent.store_id)
+    selected = []
+    for row in rows:
+        if row_dimensions(row) != dims:
+            continue
+        if compiled.channel_ids and row['channel_id'] not in compiled.channel_ids:
+            continue
+        if compiled.days and int(row['dow']) not in compiled.days:
+            continue
+        if compiled.hours and int(row['hour']) not in compiled.hours:
+            continue
+        selected.append(row)
+    return selected
+
+
+def merge_rows(rows: List[Dict[str, Any]], key) -> Dict[Any, SimpleNamespace]:
+    """Sum the aggregate columns of the rows sharing key(row)"""
+    merged: Dict[Any, Dict[str, Any]] = {}
+    for row in rows:
+        totals = merged.setdefault(key(row), {})
+        for column, value in row.items():
+            if column not in GROUP_COLUMNS:
+                totals[column] = totals.get(column, 0) + (value or 0)
+    return {k: SimpleNamespace(**totals) for k, totals in merged.items()}
+
+
+def overview_data(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """The overview metrics the revenue/ticket formatters read"""
+    sides = merge_rows(rows, lambda row: bool(row['cur']))
+    empty = SimpleNamespace(orders=0, revenue=0)
+    current, previous = sides.get(True, empty), sides.get(False, empty)
+    return {
+        'metrics': {
+            'total_orders': metric_delta(current.orders, previous.orders, int),
+            'total_revenue': metric_delta(current.revenue, previous.revenue),
+            'avg_ticket': metric_delta(ratio(current.revenue, current.orders),
+                                       ratio(previous.revenue, previous.orders)),
+        }
+    }
+
+
+def channels_data(rows: List[Dict[str, Any]], current: bool = True) -> Dict[str, Any]:
+    """Same shape as the channels panel (grouped by channel name and type)"""
+    rows = [row for row in rows if bool(row['cur']) == current and row['channel_name'] is not None]
+    channels = []
+    for (name, channel_type), totals in merge_rows(rows, lambda row: (row['channel_name'], row['channel_type'])).items():
+        if not totals.orders:
+            continue
+        channel = {
+            'name': name,
+            'type': 'delivery' if channel_type == 'D' else 'direct',
+            'orders': int(totals.orders),
+            'revenue': float(totals.revenue),
+            'avg_ticket': ratio(totals.revenue, totals.orders),
+        }
+        channel.update(operations_metrics(totals))
+        channels.append(channel)
+    channels.sort(key=lambda ch: ch['revenue'], reverse=True)
+    return {'channels': channels}
+
+
+def delivery_data(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """fetch_delivery rows: DOW x period of the day"""
+    def period(hour):
+        return 'Manhã' if hour < 12 else 'Tarde' if hour < 18 else 'Noite'
+
+    current = [row for row in rows if row['cur']]
+    merged = merge_rows(current, lambda row: (int(row['dow']), period(int(row['hour']))))
+    return delivery_rows([
+        SimpleNamespace(dow=dow, period=name, **vars(totals)) for (dow, name), totals in merged.items()
+    ])
+
+
+def products_data(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Same shape as the top_products panel"""
+    current = [row for row in rows if row['cur']]
+    products = [
+        {
+            'id': product_id,
+            'name': name,
+            'times_sold': int(totals.times_sold),
+            'total_quantity': int(totals.total_quantity),
+            'revenue': float(totals.revenue),
+            'avg_price': ratio(totals.price_sum, totals.price_count),
+            'top_customizations': []
+        }
+        for (product_id, name), totals in merge_rows(current, lambda row: (row['product_id'], row['product_name'])).items()
+    ]
+    products.sort(key=lambda prod: prod['revenue'], reverse=True)
+    return {'products': products[:TOP_PRODUCTS_LIMIT]}
+
+
+def intent_data(rows: List[Dict[str, Any]], intent: NlpIntent) -> Any:
+    """Cut one question's data out of the shared rows"""
+    rows = question_rows(rows, intent)
+    if intent.intent in ('revenue', 'ticket'):
+        return overview_data(rows)
+    if intent.intent == 'channel':
+        return channels_data(rows)
+    if intent.intent == 'ticket_trend':
+        return {'current': channels_data(rows), 'previous': channels_data(rows, current=False)}
+    if intent.intent == 'delivery':
+        return delivery_data(rows)
+    return products_data(rows)
+
+
+async def fetch_scan(query: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(text(query), params)
+        return [dict(row) for row in result.mappings().fetchall()]
+
+
+def _ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+async def run_scan(scan_id: int, key: ScanKey, indexes: List[int], queries: List[str],
+                   intents: List[NlpIntent], parse_ms: List[float], answers: List[Any]) -> Dict[str, Any]:
+    """Run one shared statement and fill in the answers of its questions"""
+    scan_intents = [intents[i] for i in indexes]
+    started = time.perf_counter()
+    try:
+        query, params = build_scan_query(key, scan_intents)
+        rows = await fetch_scan(query, params)
+    except Exception as e:
+        logger.error(f"Erro na varredura compartilhada {key}: {str(e)}")
+        rows = None
+    scan_ms = _ms(started)
+
+    for i in indexes:
+        formatted = time.perf_counter()
+        if rows is None:
+            answer = error_answer(queries[i])
+        else:
+            try:
+                answer = build_answer(queries[i], intents[i], intent_data(rows, intents[i]))
+            except Exception as e:
+                logger.error(f"Erro em {intents[i].intent} query (lote): {str(e)}")
+                answer = error_answer(queries[i])
+        answer['timing'] = {'ms': round(parse_ms[i] + scan_ms + _ms(formatted), 2), 'scan': scan_id}
+        answers[i] = answer
+
+    return {
+        'source': key.source,
+        'start_date': str(key.start_date),
+        'end_date': str(key.end_date),
+        'store_id': key.store_id,
+        'queries': indexes,
+        'ms': scan_ms,
+    }
+
+
+async def run_standalone(i: int, query: str, context: Optional[Dict[str, Any]], answers: List[Any]):
+    started = time.perf_counter()
+    answer = await process_natural_query(query, context)
+    answer['timing'] = {'ms': _ms(started), 'scan': None}
+    answers[i] = answer
+
+
+async def process_natural_query_batch(queries: List[str],
+                                      context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Parse every question, plan the shared scans and run them (and the
+    standalone questions) concurrently. Answers come back in the order of
+    `queries`, each with its timing and the scan that answered it.
+    """
+    started = time.perf_counter()
+    intents: List[Optional[NlpIntent]] = []
+    parse_ms: List[float] = []
+    for query in queries:
+        parsed_at = time.perf_counter()
+        try:
+            intent = resolve_intent(parse_query(query), query, context)
+            intents.append(intent if intent.intent in INTENT_HANDLERS else None)
+        except Exception as e:
+            logger.error(f"Erro no process_query (lote): {str(e)}")
+            intents.append(None)
+        parse_ms.append(_ms(parsed_at))
+
+    scans, standalone = plan_batch(intents)
+    answers: List[Any] = [None] * len(queries)
+    scan_results = await asyncio.gather(
+        *(run_scan(scan_id, key, indexes, queries, intents, parse_ms, answers)
+          for scan_id, (key, indexes) in enumerate(scans.items())),
+        *(run_standalone(i, queries[i], context, answers) for i in standalone)
+    )
+
+    return {
+        'answers': answers,
+        'scans': list(scan_results[:len(scans)]),
+        'total_ms': _ms(started),
+    }
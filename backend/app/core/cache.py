@@ -1,18 +1,133 @@
 """
 Redis cache management module
 Handles caching strategies for different types of queries
+
+Two tiers: a per-process LRU (L1) in front of Redis (L2). Writes and
+deletes are broadcast over Redis pub/sub so every worker drops its
+local copy together.
 """
 
 import redis
 import json
-from typing import Optional, Any, Callable
-from datetime import datetime, date
-from decimal import Decimal
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from typing import Optional, Any, Callable, Dict, Tuple, Awaitable, Iterable, List
+from datetime import date, timedelta
+from fastapi import Response
 from .config import settings
+from .filter_compiler import filters_hash, resolve_date_range
+from . import codecs
+import asyncio
 import logging
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Tag sets: nola:tag:<tag> holds the keys registered under that tag
+TAG_PREFIX = "nola:tag:"
+TAG_BATCH_SIZE = 500
+# Ranges longer than this are tagged day:any instead of one tag per day
+MAX_DAY_TAGS = 400
+
+# Marks values written by get_or_compute: {ENVELOPE_KEY: 1, 'value': ..., 'fresh_until': epoch}
+ENVELOPE_KEY = "__swr__"
+
+# Only the worker holding the token may release the lock
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LocalCache:
+    """
+    In-process LRU cache bounded by the serialized size of its entries.
+
+    Values are kept already deserialized, so a hit costs neither a network
+    round trip nor json.loads. Callers must treat returned objects as
+    read-only. When the byte budget is exceeded, expired entries are swept
+    first and then the least recently used ones are evicted.
+    """
+
+    def __init__(self, max_bytes: int, max_ttl: int):
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, size: int, ttl: int):
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def delete_pattern(self, pattern: str) -> int:
+        """Glob match, same syntax as Redis KEYS/SCAN"""
+        with self._lock:
+            matched = [k for k in self._entries if fnmatchcase(k, pattern)]
+            for key in matched:
+                self._remove(key)
+            return len(matched)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+        }
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, (_, _, exp) in self._entries.items() if exp <= now]:
+            self._remove(key)
+            self.evictions += 1
+        while self._bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
 class RedisCache:
     """
     Redis cache wrapper with JSON serialization
@@ -20,10 +135,20 @@ class RedisCache:
     
     def __init__(self):
         """Initialize Redis connection"""
+        self.local = LocalCache(settings.L1_CACHE_MAX_BYTES, settings.L1_CACHE_MAX_TTL) \
+            if settings.L1_CACHE_ENABLED else None
+        # Identifies this process in invalidation messages
+        self.origin = uuid.uuid4().hex
+        self._listener = None
+        # Single-flight: one in-process future per key being recomputed
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._background = set()
+        self.counters = {'l1_hits': 0, 'l1_misses': 0, 'l2_hits': 0, 'l2_misses': 0}
+        
         try:
             self.client = redis.Redis.from_url(
                 settings.REDIS_URL, 
-                decode_responses=True,
+                decode_responses=False,  # payloads are binary (codecs.py)
                 socket_connect_timeout=5
             )
             self.client.ping()
@@ -32,53 +157,89 @@ class RedisCache:
             logger.warning(f"⚠️ Redis connection failed: {e}. Cache disabled.")
             self.client = None
     
-    def _serialize(self, obj: Any) -> str:
+    def _serialize(self, obj: Any) -> bytes:
         """
-        Custom JSON serializer for complex types
+        Encode with the configured codec (see core/codecs.py)
         """
-        def default(o):
-            if isinstance(o, (datetime, date)):
-                return o.isoformat()
-            elif isinstance(o, Decimal):
-                return float(o)
-            return str(o)
-        
-        return json.dumps(obj, default=default)
+        return codecs.encode(obj)
     
-    def _deserialize(self, data: str) -> Any:
+    def _deserialize(self, data: bytes) -> Any:
         """
-        Deserialize JSON string back to Python object
+        Decode any codec version, including legacy JSON strings
         """
-        return json.loads(data)
+        return codecs.decode(data)
     
     def get(self, key: str) -> Optional[Any]:
         """
-        Get value from cache
+        Get value from cache (L1 first, then Redis)
         """
+        if self.local:
+            value = self.local.get(key)
+            if value is not None:
+                self.counters['l1_hits'] += 1
+                return value
+            self.counters['l1_misses'] += 1
+        
         if not self.client:
             return None
         
         try:
-            data = self.client.get(key)
+            if self.local:
+                # TTL in the same round trip, so the L1 copy never outlives Redis
+                pipe = self.client.pipeline(transaction=False)
+                pipe.get(key)
+                pipe.ttl(key)
+                data, ttl = pipe.execute()
+            else:
+                data, ttl = self.client.get(key), 0
             if data:
                 logger.debug(f"Cache HIT: {key}")
-                return self._deserialize(data)
+                self.counters['l2_hits'] += 1
+                try:
+                    value = self._deserialize(data)
+                except codecs.CodecError as e:
+                    # Written by a newer codec version: recompute instead of failing
+                    logger.warning(f"Cache DECODE skipped for {key}: {e}")
+                    self.counters['l2_misses'] += 1
+                    return None
+                if self.local and ttl and ttl > 0:
+                    self.local.set(key, value, len(data), ttl)
+                return value
             logger.debug(f"Cache MISS: {key}")
+            self.counters['l2_misses'] += 1
             return None
         except Exception as e:
             logger.error(f"Cache GET error: {e}")
             return None
     
-    def set(self, key: str, value: Any, ttl: int = 300) -> bool:
+    def set(self, key: str, value: Any, ttl: int = 300, tags: Optional[Iterable[str]] = None) -> bool:
         """
-        Set value in cache with TTL
+        Set value in cache with TTL, registering the key under `tags`
+        (see cache_tags) so it can be invalidated without scanning keys
         """
+        try:
+            serialized = self._serialize(value)
+        except Exception as e:
+            logger.error(f"Cache SET error: {e}")
+            return False
+        
+        if self.local:
+            self.local.set(key, value, len(serialized), ttl)
+        
         if not self.client:
             return False
         
         try:
-            serialized = self._serialize(value)
-            self.client.setex(key, ttl, serialized)
+            pipe = self.client.pipeline(transaction=False)
+            pipe.setex(key, ttl, serialized)
+            for tag in tags or ():
+                tag_key = f"{TAG_PREFIX}{tag}"
+                pipe.sadd(tag_key, key)
+                # The tag set lives as long as its longest-lived member
+                pipe.expire(tag_key, ttl, nx=True)
+                pipe.expire(tag_key, ttl, gt=True)
+            pipe.execute()
+            self._publish('key', key)
             logger.debug(f"Cache SET: {key} (TTL: {ttl}s)")
             return True
         except Exception as e:
@@ -88,46 +249,346 @@ class RedisCache:
     def delete(self, pattern: str) -> int:
         """
         Delete keys matching pattern
+        Uses incremental SCAN instead of KEYS; prefer invalidate_tags for
+        anything on the request path
         """
+        if self.local:
+            self.local.delete_pattern(pattern)
+        
         if not self.client:
             return 0
         
         try:
-            keys = self.client.keys(pattern)
-            if keys:
-                return self.client.delete(*keys)
-            return 0
+            self._publish('pattern', pattern)
+            return self._unlink(self.client.scan_iter(match=pattern, count=TAG_BATCH_SIZE))
         except Exception as e:
             logger.error(f"Cache DELETE error: {e}")
             return 0
     
+    def invalidate_tags(self, *tag_groups: Iterable[str]) -> int:
+        """
+        Delete every key registered under all the tags of at least one group.
+        Each group is intersected (SINTER) and the groups are unioned, e.g.
+        invalidate_tags(["day:2024-01-05", "store:3"], ["day:2024-01-05", "store:all"])
+        """
+        if not self.client:
+            if self.local:
+                self.local.clear()
+            return 0
+        
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for group in tag_groups:
+                pipe.sinter([f"{TAG_PREFIX}{tag}" for tag in group])
+            keys = set()
+            for members in pipe.execute():
+                keys.update(members)
+            if not keys:
+                return 0
+            
+            keys = [k.decode() if isinstance(k, bytes) else k for k in keys]
+            if self.local:
+                for key in keys:
+                    self.local.delete(key)
+            deleted = self._unlink(keys)
+            self._publish('keys', keys)
+            logger.info(f"🧹 Cache invalidated {deleted} keys by tag")
+            return deleted
+        except Exception as e:
+            logger.error(f"Cache INVALIDATE error: {e}")
+            return 0
+    
+    def invalidate_sales(self, store_id: Optional[int], day: date) -> int:
+        """
+        New or changed sales for (store, day): drop entries covering that day
+        for that store or for all stores
+        """
+        day_tags = [f"day:{day.isoformat()}", "day:any"]
+        store_tags = [f"store:{store_id}", "store:all"] if store_id is not None else ["store:all"]
+        return self.invalidate_tags(*([d, s] for d in day_tags for s in store_tags))
+    
+    def _unlink(self, keys: Iterable) -> int:
+        """UNLINK (non-blocking delete) in pipelined batches"""
+        deleted = 0
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= TAG_BATCH_SIZE:
+                deleted += self.client.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += self.client.unlink(*batch)
+        return deleted
+    
     def flush(self) -> bool:
         """
         Clear all cache
         """
+        if self.local:
+            self.local.clear()
+        
         if not self.client:
             return False
         
         try:
             self.client.flushdb()
+            self._publish('flush')
             logger.info("Cache flushed")
             return True
         except Exception as e:
             logger.error(f"Cache FLUSH error: {e}")
             return False
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters per tier plus L1 occupancy"""
+        l1_total = self.counters['l1_hits'] + self.counters['l1_misses']
+        l2_total = self.counters['l2_hits'] + self.counters['l2_misses']
+        return {
+            'l1': {
+                'enabled': self.local is not None,
+                'hits': self.counters['l1_hits'],
+                'misses': self.counters['l1_misses'],
+                'hit_rate': self.counters['l1_hits'] / l1_total if l1_total else 0.0,
+                **(self.local.stats() if self.local else {}),
+            },
+            'l2': {
+                'enabled': self.client is not None,
+                'hits': self.counters['l2_hits'],
+                'misses': self.counters['l2_misses'],
+                'hit_rate': self.counters['l2_hits'] / l2_total if l2_total else 0.0,
+            },
+        }
+    
+    # ===== Single-flight + stale-while-revalidate =====
+    
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int,
+                             stale_ttl: int = 0, with_status: bool = False,
+                             tags: Optional[Iterable[str]] = None):
+        """
+        Return the cached value for `key`, computing it at most once.
+        
+        - fresh hit: returned as is
+        - stale hit (within `stale_ttl` after expiry): returned immediately
+          while a single background task recomputes it
+        - miss: concurrent callers in this process share one future; across
+          workers a Redis SET NX lock lets one recompute while the others
+          poll for its result
+        
+        `compute` must not depend on request-scoped resources, since it can
+        outlive the request when refreshing in the background. `tags` are
+        registered on every write (see cache_tags).
+        With `with_status`, returns (value, status) where status is one of
+        fresh, stale, computed, shared.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            value, fresh_until = self._unwrap(entry)
+            if fresh_until is None or fresh_until > time.time():
+                return (value, 'fresh') if with_status else value
+            # Vencido mas dentro da janela stale: serve e recalcula em background
+            if key not in self._inflight:
+                task = asyncio.create_task(self._refresh(key, compute, ttl, stale_ttl, tags, wait=False))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+            return (value, 'stale') if with_status else value
+        
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            value = await asyncio.shield(inflight)
+            if value is not None:
+                return (value, 'shared') if with_status else value
+        
+        value, status = await self._refresh(key, compute, ttl, stale_ttl, tags, wait=True)
+        return (value, status) if with_status else value
+    
+    async def refresh(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int,
+                      stale_ttl: int = 0, tags: Optional[Iterable[str]] = None) -> Optional[Any]:
+        """
+        Recompute `key` now (used by the cache warmer). Skipped when this
+        process or another worker is already recomputing it.
+        """
+        if key in self._inflight:
+            return None
+        value, _ = await self._refresh(key, compute, ttl, stale_ttl, tags, wait=False)
+        return value
+    
+    def fresh_for(self, key: str) -> Optional[float]:
+        """Seconds until `key` goes stale; None when missing, inf for plain set() entries"""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        _, fresh_until = self._unwrap(entry)
+        return float('inf') if fresh_until is None else fresh_until - time.time()
+    
+    async def _refresh(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int,
+                       stale_ttl: int, tags: Optional[Iterable[str]], wait: bool) -> Tuple[Any, str]:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        token = None
+        try:
+            token = self._acquire_lock(key)
+            if token is False:
+                # Another worker is recomputing
+                if not wait:
+                    future.set_result(None)
+                    return None, 'stale'
+                entry = await self._wait_for_other_worker(key)
+                if entry is not None:
+                    value, _ = self._unwrap(entry)
+                    future.set_result(value)
+                    return value, 'shared'
+            
+            value = await compute()
+            self.set(key, {ENVELOPE_KEY: 1, 'value': value, 'fresh_until': time.time() + ttl},
+                     ttl=ttl + stale_ttl, tags=tags)
+            future.set_result(value)
+            return value, 'computed'
+        
+        except Exception as e:
+            if not wait:
+                logger.error(f"Cache background refresh error for {key}: {e}")
+                future.set_result(None)
+                return None, 'stale'
+            future.set_exception(e)
+            # Evita "exception was never retrieved" quando ninguém mais aguarda
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            if token:
+                self._release_lock(key, token)
+    
+    async def _wait_for_other_worker(self, key: str) -> Optional[Any]:
+        deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+        logger.warning(f"Cache lock wait timed out for {key}, computing locally")
+        return None
+    
+    def _acquire_lock(self, key: str):
+        """Token if acquired, False if held by someone else, None without Redis"""
+        if not self.client:
+            return None
+        token = uuid.uuid4().hex
+        try:
+            if self.client.set(f"{key}:lock", token, nx=True, ex=settings.CACHE_LOCK_TTL):
+                return token
+            return False
+        except Exception as e:
+            logger.error(f"Cache LOCK error: {e}")
+            return None
+    
+    def _release_lock(self, key: str, token: str):
+        try:
+            self.client.eval(_RELEASE_LOCK_SCRIPT, 1, f"{key}:lock", token)
+        except Exception as e:
+            logger.error(f"Cache UNLOCK error: {e}")
+    
+    @staticmethod
+    def _unwrap(entry: Any) -> Tuple[Any, Optional[float]]:
+        """(value, fresh_until); plain entries written by set() never go stale"""
+        if isinstance(entry, dict) and entry.get(ENVELOPE_KEY):
+            return entry.get('value'), entry.get('fresh_until')
+        return entry, None
+    
+    # ===== Invalidação entre workers (pub/sub) =====
+    
+    def start_invalidation_listener(self):
+        """
+        Subscribe to the invalidation channel in a background thread so
+        writes/deletes made by other workers drop the local copies here
+        """
+        if not self.client or not self.local or self._listener:
+            return
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{settings.CACHE_INVALIDATION_CHANNEL: self._on_invalidation})
+            self._listener = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+            logger.info("📡 Cache invalidation listener started")
+        except Exception as e:
+            logger.warning(f"⚠️ Cache invalidation listener failed: {e}")
+    
+    def stop_invalidation_listener(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+    
+    def _publish(self, op: str, value: Any = None):
+        if not self.local:
+            return
+        message = json.dumps({'origin': self.origin, 'op': op, 'value': value})
+        self.client.publish(settings.CACHE_INVALIDATION_CHANNEL, message)
+    
+    def _on_invalidation(self, message: Dict):
+        try:
+            payload = json.loads(message['data'])
+            if payload.get('origin') == self.origin:
+                return  # already applied locally
+            op, value = payload.get('op'), payload.get('value')
+            if op == 'key':
+                self.local.delete(value)
+            elif op == 'keys':
+                for key in value:
+                    self.local.delete(key)
+            elif op == 'pattern':
+                self.local.delete_pattern(value)
+            elif op == 'flush':
+                self.local.clear()
+        except Exception as e:
+            logger.error(f"Cache invalidation error: {e}")
 
 # Global cache instance
 cache = RedisCache()
 
-def cache_key_builder(prefix: str, **params) -> str:
+def cache_key_builder(prefix: str, filters: Optional[Dict] = None, **params) -> str:
     """
     Build consistent cache keys from parameters
+    
+    `filters` is reduced to its canonical hash, so equivalent filter
+    combinations (order, case, duplicates) share one key
     """
+    if filters:
+        params['filters'] = filters_hash(filters) or None
+    
     # Sort params for consistent keys
     sorted_params = sorted(params.items())
     params_str = "_".join(f"{k}={v}" for k, v in sorted_params if v is not None)
     return f"nola:{prefix}:{params_str}" if params_str else f"nola:{prefix}"
 
+def cache_tags(endpoint: str, store_id: Optional[int] = None, start_date: Optional[date] = None,
+               end_date: Optional[date] = None, compare: bool = False, dated: bool = True) -> List[str]:
+    """
+    Invalidation tags for an entry: endpoint, store (or all) and one tag
+    per day it covers. `compare` also covers the previous period.
+    """
+    tags = [f"endpoint:{endpoint}", f"store:{store_id if store_id is not None else 'all'}"]
+    if not dated:
+        return tags
+    
+    start_date, end_date = resolve_date_range(start_date, end_date)
+    if compare:
+        start_date -= (end_date - start_date) + timedelta(days=1)
+    days = (end_date - start_date).days + 1
+    if days > MAX_DAY_TAGS:
+        tags.append("day:any")
+    else:
+        tags.extend(f"day:{(start_date + timedelta(days=i)).isoformat()}" for i in range(days))
+    return tags
+
+def cached_response(value: Any, status: Optional[str] = None):
+    """
+    Wrap a value served from cache in a ready-made JSON Response, so FastAPI
+    skips the response_model validation/serialization of data that was
+    already validated when it was computed. Freshly computed values
+    (status 'computed') go through the normal path.
+    """
+    if status in ('fresh', 'stale', 'shared'):
+        return Response(content=codecs.dumps_json(value), media_type="application/json")
+    return value
+
 def cached_result(prefix: str, ttl: int = 300):
     """
     Decorator for caching function results
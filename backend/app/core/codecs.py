@@ -0,0 +1,157 @@
+"""
+Cache payload codecs
+Binary encoding for values stored in Redis, with optional compression
+
+Stored layout: MAGIC (0x00) | FORMAT_VERSION | codec byte | payload
+The codec byte is (serializer << 4) | compression, so the reader always
+knows how a value was written and codecs can change without a flush.
+Values without the magic byte are legacy JSON strings.
+"""
+
+from datetime import datetime, date
+from decimal import Decimal
+from typing import Any, Optional
+import json
+import logging
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Dependências opcionais: cada codec só é usado se estiver instalado
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None
+
+MAGIC = 0x00
+FORMAT_VERSION = 1
+
+SERIALIZERS = {'json': 1, 'orjson': 2, 'msgpack': 3}
+COMPRESSIONS = {'none': 0, 'zstd': 1, 'lz4': 2}
+
+_SERIALIZER_NAMES = {v: k for k, v in SERIALIZERS.items()}
+_COMPRESSION_NAMES = {v: k for k, v in COMPRESSIONS.items()}
+
+
+class CodecError(Exception):
+    """Stored value written with an unknown version or codec"""
+
+
+def _default(o: Any) -> Any:
+    """Types the serializers don't handle natively"""
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Decimal):
+        return float(o)
+    return str(o)
+
+
+def _available(serializer: str, compression: str):
+    """Fall back to what is installed: orjson/msgpack -> json, zstd/lz4 -> none"""
+    if serializer == 'orjson' and orjson is None:
+        serializer = 'json'
+    if serializer == 'msgpack' and msgpack is None:
+        serializer = 'json'
+    if serializer not in SERIALIZERS:
+        serializer = 'json'
+    if compression == 'zstd' and zstandard is None:
+        compression = 'none'
+    if compression == 'lz4' and lz4_frame is None:
+        compression = 'none'
+    if compression not in COMPRESSIONS:
+        compression = 'none'
+    return serializer, compression
+
+
+def _serialize(obj: Any, serializer: str) -> bytes:
+    if serializer == 'orjson':
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    if serializer == 'msgpack':
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+    return json.dumps(obj, default=_default).encode()
+
+
+def _deserialize(payload: bytes, serializer: str) -> Any:
+    if serializer == 'orjson':
+        return orjson.loads(payload)
+    if serializer == 'msgpack':
+        return msgpack.unpackb(payload, raw=False)
+    return json.loads(payload)
+
+
+def _compress(payload: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    if compression == 'lz4':
+        return lz4_frame.compress(payload)
+    return payload
+
+
+def _decompress(payload: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if compression == 'lz4':
+        return lz4_frame.decompress(payload)
+    return payload
+
+
+def encode(obj: Any, serializer: Optional[str] = None, compression: Optional[str] = None,
+           threshold: Optional[int] = None) -> bytes:
+    """
+    Encode a cache value. Payloads smaller than `threshold` bytes are
+    stored uncompressed.
+    """
+    serializer, compression = _available(
+        serializer or settings.CACHE_CODEC,
+        compression or settings.CACHE_COMPRESSION
+    )
+    threshold = settings.CACHE_COMPRESS_THRESHOLD if threshold is None else threshold
+
+    payload = _serialize(obj, serializer)
+    if len(payload) < threshold:
+        compression = 'none'
+    payload = _compress(payload, compression)
+
+    codec = (SERIALIZERS[serializer] << 4) | COMPRESSIONS[compression]
+    return bytes((MAGIC, FORMAT_VERSION, codec)) + payload
+
+
+def decode(data: bytes) -> Any:
+    """
+    Decode a stored value; anything without the magic byte is legacy JSON
+    """
+    if isinstance(data, str):
+        return json.loads(data)
+    if not data or data[0] != MAGIC:
+        return json.loads(data)
+
+    if len(data) < 3 or data[1] != FORMAT_VERSION:
+        raise CodecError(f"unknown cache format version {data[1] if len(data) > 1 else None}")
+
+    serializer = _SERIALIZER_NAMES.get(data[2] >> 4)
+    compression = _COMPRESSION_NAMES.get(data[2] & 0x0F)
+    if serializer is None or compression is None:
+        raise CodecError(f"unknown cache codec {data[2]:#04x}")
+
+    return _deserialize(_decompress(data[3:], compression), serializer)
+
+
+def dumps_json(obj: Any) -> bytes:
+    """JSON bytes for an HTTP response (orjson when available)"""
+    return _serialize(obj, 'orjson' if orjson is not None else 'json')
@@ -30,7 +30,98 @@ class Settings(BaseSettings):
     CACHE_TTL_OVERVIEW: int = 60
     CACHE_TTL_TIMELINE: int = 300
     CACHE_TTL_PRODUCTS: int = 600
+    CACHE_TTL_CHANNELS: int = 300
     CACHE_TTL_INSIGHTS: int = 1800
+    CACHE_TTL_NLP: int = 300  # natural-query results, keyed by canonical intent
+    
+    # Stale-while-revalidate windows: after the TTL, the old value is still
+    # served for this long while one caller recomputes in the background
+    CACHE_STALE_TTL_OVERVIEW: int = 300
+    CACHE_STALE_TTL_TIMELINE: int = 600
+    CACHE_STALE_TTL_PRODUCTS: int = 1200
+    CACHE_STALE_TTL_CHANNELS: int = 600
+    CACHE_STALE_TTL_INSIGHTS: int = 0
+    
+    # Single-flight recompute lock
+    CACHE_LOCK_TTL: int = 30  # seconds before an abandoned lock expires
+    CACHE_LOCK_WAIT: float = 10.0  # how long waiters poll before computing themselves
+    
+    # In-process L1 cache (in front of Redis)
+    L1_CACHE_ENABLED: bool = True
+    L1_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # serialized size budget per worker
+    L1_CACHE_MAX_TTL: int = 30  # local copies never outlive this, even if pub/sub is missed
+    CACHE_INVALIDATION_CHANNEL: str = "nola:cache:invalidate"
+    
+    # Cache payload codec (core/codecs.py); falls back to json/none when
+    # the library is not installed
+    CACHE_CODEC: str = "orjson"  # orjson | msgpack | json
+    CACHE_COMPRESSION: str = "zstd"  # zstd | lz4 | none
+    CACHE_COMPRESS_THRESHOLD: int = 16 * 1024  # bytes; smaller payloads stay uncompressed
+    
+    # Rollup Settings
+    ROLLUP_ENABLED: bool = True
+    ROLLUP_REFRESH_INTERVAL: int = 60  # seconds between incremental refreshes
+    
+    # Unique customers via HyperLogLog (services/customer_sketches.py)
+    HLL_ENABLED: bool = True
+    HLL_PRECISION: int = 12  # 2^12 registers: 1.6% relative standard error; rebuild after changing
+    HLL_REFRESH_INTERVAL: int = 60  # seconds between incremental refreshes
+    
+    # Cache warmer (services/cache_warmer.py)
+    WARMER_ENABLED: bool = True
+    WARMER_INTERVAL: int = 15  # seconds between warming cycles
+    WARMER_AHEAD: int = 20  # refresh entries fresh for less than this many seconds
+    WARMER_MAX_KEYS: int = 50  # candidates per cycle (most accessed + default views)
+    WARMER_CONCURRENCY: int = 2  # max pool connections used by warming
+    WARMER_DECAY: float = 0.9  # access counts multiplied by this every cycle
+    WARMER_TRACK_LIMIT: int = 5000  # keys kept in the access-frequency set
+    
+    # Batch natural queries (POST /natural-query/batch)
+    NLP_BATCH_MAX_QUERIES: int = 20
+    
+    # Streaming export (POST /export)
+    EXPORT_CHUNK_ROWS: int = 5000  # rows fetched from the server-side cursor per chunk
+    
+    # Insights engine (services/insights_engine.py)
+    INSIGHTS_ENABLED: bool = True
+    INSIGHTS_INTERVAL: int = 900  # seconds between recomputations
+    INSIGHTS_Z_THRESHOLD: float = 2.5  # |z| that counts as an anomaly
+    INSIGHTS_BASELINE_WEEKS: int = 8  # same-weekday history for the daily z-score
+    INSIGHTS_TICKET_WEEKS: int = 6  # weeks in the channel ticket trend
+    INSIGHTS_TICKET_DROP: float = 0.05  # fitted ticket drop that raises an insight
+    INSIGHTS_PRODUCT_RECENT_DAYS: int = 7
+    INSIGHTS_PRODUCT_BASELINE_DAYS: int = 28
+    INSIGHTS_PRODUCT_DROP: float = 0.4  # minimum relative drop in units sold
+    INSIGHTS_MAX_PRODUCTS: int = 3  # product insights kept per store
+    INSIGHTS_MAX: int = 10  # insights kept per store
+    
+    # Background jobs (services/job_queue.py): exports, retention, long timelines
+    JOBS_ENABLED: bool = True
+    JOBS_DB_PATH: str = "./data/jobs.sqlite3"
+    JOB_RESULT_DIR: str = "./data/job_results"
+    JOB_WORKERS: int = 2  # process pool size per API worker
+    JOB_POLL_INTERVAL: float = 1.0  # seconds between queue checks
+    JOB_LEASE_SECONDS: int = 30  # running jobs not renewed for this long are re-queued
+    JOB_RESULT_TTL: int = 24 * 3600  # finished jobs and their files are deleted after this
+    
+    # In-memory sales cube (services/sales_cube.py; built from the rollup)
+    CUBE_ENABLED: bool = True
+    CUBE_MAX_BYTES: int = 256 * 1024 * 1024  # most recent days that fit are kept
+    CUBE_REFRESH_INTERVAL: int = 60  # seconds between watermark checks
+    CUBE_FULL_RELOAD_INTERVAL: int = 3600  # seconds between full reloads
+    
+    # Columnar engine (services/columnar_engine.py; needs `pip install duckdb`)
+    ANALYTIC_ENGINE: str = "postgres"  # postgres | duckdb (overridable per request)
+    PARQUET_EXPORT_ENABLED: bool = False
+    PARQUET_DIR: str = "./data/parquet"
+    PARQUET_EXPORT_INTERVAL: int = 900  # seconds between snapshots
+    PARQUET_EXPORT_CHUNK_ROWS: int = 200_000
+    
+    # Partitioning (services/partition_manager.py; only after --migrate)
+    PARTITION_MAINTENANCE_ENABLED: bool = True
+    PARTITION_MONTHS_AHEAD: int = 3  # monthly partitions created ahead of time
+    PARTITION_RETENTION_MONTHS: int = 0  # detach older months; 0 = keep all
+    PARTITION_MAINTENANCE_INTERVAL: int = 6 * 3600  # seconds
     
     # Performance Settings
     DB_POOL_SIZE: int = 20
@@ -5,6 +5,7 @@ Handles PostgreSQL connections with proper pooling and session lifecycle
 
 from sqlalchemy import create_engine, MetaData, text
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from .config import settings
 import logging
@@ -29,6 +30,32 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+def async_database_url(url: str) -> str:
+    """
+    Same database through the asyncpg driver
+    postgresql://... or postgresql+psycopg2://... -> postgresql+asyncpg://...
+    """
+    scheme, _, rest = url.partition("://")
+    if scheme.split("+")[0] in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+# Async engine used by the API endpoints, so a slow aggregate waits on the
+# pool instead of blocking the event loop
+async_engine = create_async_engine(
+    async_database_url(settings.DATABASE_URL),
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    echo=settings.DEBUG
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Base class for models
 Base = declarative_base()
 metadata = MetaData()
@@ -44,6 +71,14 @@ def get_db() -> Session:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncSession:
+    """
+    Async dependency to get database session
+    Ensures proper cleanup after request
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def check_database_connection():
     """
     Test database connection on startup
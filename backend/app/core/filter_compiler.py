@@ -0,0 +1,249 @@
+"""
+Filter compiler
+Turns the dashboard `filters` dict into bound, sargable SQL predicates and a
+canonical hash, so every service method and cache key agree on what a
+filter combination means
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Dict, List, Tuple, Any
+import hashlib
+import json
+
+# Channel groups by channel_id (one id per sub-brand)
+CHANNEL_GROUPS = {
+    'presencial': (1, 7, 13),
+    'ifood': (2, 8, 14),
+    'rappi': (3, 9, 15),
+    'uber': (4, 10, 16),
+    'whatsapp': (5, 11, 17),
+    'app': (6, 12, 18),
+}
+
+# PostgreSQL DOW numbering (sunday = 0)
+DAY_CODES = {'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6}
+
+# Half-open hour windows [start, end); night wraps past midnight
+TIME_WINDOWS = {
+    'morning': (6, 12),
+    'afternoon': (12, 18),
+    'evening': (18, 23),
+    'night': (23, 6),
+}
+
+# Keys accepted from the API. Only the first three are evaluated in SQL;
+# the rest are kept in the canonical form so cache keys stay exact.
+FILTER_KEYS = (
+    'channels', 'day_of_week', 'time_of_day',
+    'categories', 'customer_type', 'price_range', 'delivery_zone', 'order_size',
+)
+
+# Above this many created_at ranges the predicate falls back to
+# EXTRACT(DOW/HOUR) on top of the outer range bound
+MAX_TIME_RANGES = 400
+
+DEFAULT_RANGE_DAYS = 30
+
+
+def parse_filter_params(**raw: Optional[str]) -> Dict[str, Optional[List[str]]]:
+    """
+    Split comma-separated query parameters into the filters dict
+    """
+    filters = {}
+    for key, value in raw.items():
+        items = [v.strip().lower() for v in value.split(',')] if value else []
+        filters[key] = [v for v in items if v] or None
+    return filters
+
+
+def resolve_date_range(start_date: Optional[date], end_date: Optional[date]) -> Tuple[date, date]:
+    """Apply the default 30-day window used across the dashboard"""
+    if not end_date:
+        end_date = date.today()
+    if not start_date:
+        start_date = end_date - timedelta(days=DEFAULT_RANGE_DAYS)
+    return start_date, end_date
+
+
+def canonicalize_filters(filters: Optional[Dict]) -> Dict[str, List[str]]:
+    """
+    Normalize a filters dict: lowercase, dedupe, drop unknown values for
+    the SQL-backed keys and sort everything in a stable order
+    """
+    canonical = {}
+    for key in FILTER_KEYS:
+        values = (filters or {}).get(key) or []
+        if isinstance(values, str):
+            values = values.split(',')
+        values = {str(v).strip().lower() for v in values if str(v).strip()}
+
+        if key == 'channels':
+            values = sorted(v for v in values if v in CHANNEL_GROUPS)
+        elif key == 'day_of_week':
+            values = sorted((v for v in values if v in DAY_CODES), key=DAY_CODES.get)
+        elif key == 'time_of_day':
+            values = sorted((v for v in values if v in TIME_WINDOWS), key=lambda v: TIME_WINDOWS[v][0])
+        else:
+            values = sorted(values)
+
+        if values:
+            canonical[key] = values
+    return canonical
+
+
+def filters_hash(filters: Optional[Dict]) -> str:
+    """Stable short hash of the canonical filters (empty string when no filters)"""
+    canonical = canonicalize_filters(filters)
+    if not canonical:
+        return ""
+    payload = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+class CompiledFilters:
+    """
+    A filters dict bound to a date range.
+
+    The date range is inclusive of both days and compiled as the half-open
+    interval [start_date 00:00, end_date + 1 day 00:00). Day-of-week and
+    time-of-day filters become an explicit list of created_at ranges, so
+    the predicate stays index-friendly instead of wrapping the column in
+    EXTRACT().
+    """
+
+    def __init__(self, filters: Optional[Dict], start_date: Optional[date] = None,
+                 end_date: Optional[date] = None, store_id: Optional[int] = None):
+        self.start_date, self.end_date = resolve_date_range(start_date, end_date)
+        self.store_id = store_id
+        self.canonical = canonicalize_filters(filters)
+        self.hash = filters_hash(filters)
+
+        self.channel_ids = sorted({
+            channel_id
+            for name in self.canonical.get('channels', [])
+            for channel_id in CHANNEL_GROUPS[name]
+        })
+        self.days = [DAY_CODES[d] for d in self.canonical.get('day_of_week', [])]
+        self.hours = sorted({
+            hour
+            for window in self.canonical.get('time_of_day', [])
+            for hour in _window_hours(*TIME_WINDOWS[window])
+        })
+
+    @property
+    def start(self) -> datetime:
+        return datetime.combine(self.start_date, time.min)
+
+    @property
+    def end(self) -> datetime:
+        """Exclusive upper bound"""
+        return datetime.combine(self.end_date + timedelta(days=1), time.min)
+
+    def with_dates(self, start_date: date, end_date: date) -> "CompiledFilters":
+        """Same filters and store over another date range (e.g. the previous period)"""
+        return CompiledFilters(self.canonical, start_date, end_date, self.store_id)
+
+    def where(self, time_column: str = 's.created_at', channel_column: str = 's.channel_id',
+              prefix: str = 'f', store_column: str = 's.store_id') -> Tuple[str, Dict[str, Any]]:
+        """
+        Build the predicate (without a leading AND) and its bound params.
+        `prefix` namespaces the params so several compiled filters can share
+        one statement. A store-scoped filter puts the store equality first,
+        matching the (store_id, created_at) indexes.
+        """
+        params = {f'{prefix}_start': self.start, f'{prefix}_end': self.end}
+        clauses = []
+        if self.store_id is not None:
+            params[f'{prefix}_store'] = self.store_id
+            clauses.append(f"{store_column} = :{prefix}_store")
+        clauses += [
+            f"{time_column} >= :{prefix}_start",
+            f"{time_column} < :{prefix}_end",
+        ]
+
+        if self.channel_ids:
+            names = []
+            for i, channel_id in enumerate(self.channel_ids):
+                params[f'{prefix}_ch_{i}'] = channel_id
+                names.append(f':{prefix}_ch_{i}')
+            clauses.append(f"{channel_column} IN ({', '.join(names)})")
+
+        if self.days or self.hours:
+            ranges = self.time_ranges()
+            if ranges is None:
+                clauses.extend(self._extract_clauses(time_column, prefix, params))
+            elif not ranges:
+                clauses.append("FALSE")
+            else:
+                parts = []
+                for i, (lo, hi) in enumerate(ranges):
+                    params[f'{prefix}_r{i}_lo'] = lo
+                    params[f'{prefix}_r{i}_hi'] = hi
+                    parts.append(f"({time_column} >= :{prefix}_r{i}_lo AND {time_column} < :{prefix}_r{i}_hi)")
+                clauses.append(f"({' OR '.join(parts)})")
+
+        return " AND ".join(clauses), params
+
+    def time_ranges(self) -> Optional[List[Tuple[datetime, datetime]]]:
+        """
+        Expand day/hour filters into merged [lo, hi) created_at ranges.
+        Returns None when the list would exceed MAX_TIME_RANGES.
+        """
+        hours = self.hours or list(range(24))
+        runs = _hour_runs(hours)
+
+        ranges: List[Tuple[datetime, datetime]] = []
+        day = self.start_date
+        while day <= self.end_date:
+            # date.weekday(): monday = 0 -> DOW: sunday = 0
+            if not self.days or (day.weekday() + 1) % 7 in self.days:
+                midnight = datetime.combine(day, time.min)
+                for lo_hour, hi_hour in runs:
+                    lo = midnight + timedelta(hours=lo_hour)
+                    hi = midnight + timedelta(hours=hi_hour)
+                    if ranges and ranges[-1][1] == lo:
+                        ranges[-1] = (ranges[-1][0], hi)
+                    else:
+                        ranges.append((lo, hi))
+                    if len(ranges) > MAX_TIME_RANGES:
+                        return None
+            day += timedelta(days=1)
+        return ranges
+
+    def _extract_clauses(self, time_column: str, prefix: str, params: Dict) -> List[str]:
+        clauses = []
+        if self.days:
+            names = []
+            for i, dow in enumerate(self.days):
+                params[f'{prefix}_dow_{i}'] = dow
+                names.append(f':{prefix}_dow_{i}')
+            clauses.append(f"EXTRACT(DOW FROM {time_column}) IN ({', '.join(names)})")
+        if self.hours:
+            names = []
+            for i, hour in enumerate(self.hours):
+                params[f'{prefix}_hr_{i}'] = hour
+                names.append(f':{prefix}_hr_{i}')
+            clauses.append(f"EXTRACT(HOUR FROM {time_column}) IN ({', '.join(names)})")
+        return clauses
+
+
+def compile_filters(filters: Optional[Dict], start_date: Optional[date] = None,
+                    end_date: Optional[date] = None, store_id: Optional[int] = None) -> CompiledFilters:
+    return CompiledFilters(filters, start_date, end_date, store_id)
+
+
+def _window_hours(start: int, end: int) -> List[int]:
+    if start < end:
+        return list(range(start, end))
+    return list(range(start, 24)) + list(range(0, end))
+
+
+def _hour_runs(hours: List[int]) -> List[Tuple[int, int]]:
+    """Collapse sorted hours into contiguous [start, end) runs within a day"""
+    runs = []
+    for hour in hours:
+        if runs and runs[-1][1] == hour:
+            runs[-1] = (runs[-1][0], hour + 1)
+        else:
+            runs.append((hour, hour + 1))
+    return runs
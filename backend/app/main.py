@@ -6,6 +6,7 @@ Configures FastAPI app with all routes, middleware, and startup events
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 import uvicorn
 
@@ -13,6 +14,14 @@ from app.api import analytics
 from app.core.config import settings
 from app.core.database import check_database_connection
 from app.core.cache import cache
+from app.services.rollup_service import run_rollup_refresher
+from app.services.cache_warmer import run_cache_warmer
+from app.services.partition_manager import run_partition_maintenance
+from app.services.columnar_engine import run_parquet_exporter
+from app.services.sales_cube import run_cube_refresher
+from app.services.job_queue import run_job_dispatcher
+from app.services.insights_engine import run_insights_engine
+from app.services.customer_sketches import run_sketch_refresher
 
 # Configure logging
 logging.basicConfig(
@@ -38,15 +47,80 @@ async def lifespan(app: FastAPI):
     # Check cache connection
     if cache.client:
         logger.info("✅ Redis cache connected")
+        cache.start_invalidation_listener()
     else:
         logger.warning("⚠️ Redis cache disabled - running without cache")
     
+    # Start hourly rollup refresher
+    rollup_task = None
+    if settings.ROLLUP_ENABLED:
+        rollup_task = asyncio.create_task(run_rollup_refresher())
+        logger.info("📦 Sales rollup refresher started")
+    
+    # In-memory cube over the rollup
+    cube_task = None
+    if settings.ROLLUP_ENABLED and settings.CUBE_ENABLED:
+        cube_task = asyncio.create_task(run_cube_refresher())
+        logger.info("🧮 Sales cube refresher started")
+    
+    # HyperLogLog sketches for unique customers
+    sketch_task = None
+    if settings.HLL_ENABLED:
+        sketch_task = asyncio.create_task(run_sketch_refresher())
+        logger.info("🔢 Customer sketch refresher started")
+    
+    # Start cache warmer (needs Redis)
+    warmer_task = None
+    if settings.WARMER_ENABLED and cache.client:
+        warmer_task = asyncio.create_task(run_cache_warmer())
+        logger.info("🔥 Cache warmer started")
+    
+    # Create upcoming monthly partitions (no-op if tables aren't partitioned)
+    partition_task = None
+    if settings.PARTITION_MAINTENANCE_ENABLED:
+        partition_task = asyncio.create_task(run_partition_maintenance())
+    
+    # Parquet snapshots for the DuckDB engine
+    export_task = None
+    if settings.PARQUET_EXPORT_ENABLED or settings.ANALYTIC_ENGINE == "duckdb":
+        export_task = asyncio.create_task(run_parquet_exporter())
+        logger.info("🧊 Parquet exporter started")
+    
+    # Anomaly detection over the rollup, stored for /insights
+    insights_task = None
+    if settings.INSIGHTS_ENABLED:
+        insights_task = asyncio.create_task(run_insights_engine())
+        logger.info("💡 Insights engine started")
+    
+    # Background jobs on a bounded process pool
+    jobs_task = None
+    if settings.JOBS_ENABLED:
+        jobs_task = asyncio.create_task(run_job_dispatcher())
+        logger.info(f"🧵 Job dispatcher started ({settings.JOB_WORKERS} workers)")
+    
     logger.info(f"📊 Nola Analytics API v{settings.VERSION} ready!")
     
     yield
     
     # Shutdown
     logger.info("👋 Shutting down Nola Analytics API...")
+    if rollup_task:
+        rollup_task.cancel()
+    if warmer_task:
+        warmer_task.cancel()
+    if cube_task:
+        cube_task.cancel()
+    if sketch_task:
+        sketch_task.cancel()
+    if partition_task:
+        partition_task.cancel()
+    if export_task:
+        export_task.cancel()
+    if jobs_task:
+        jobs_task.cancel()
+    if insights_task:
+        insights_task.cancel()
+    cache.stop_invalidation_listener()
 
 # Create FastAPI application
 app = FastAPI(
@@ -3,7 +3,8 @@ SQLAlchemy Models
 Maps database tables to Python classes for ORM operations
 """
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, DECIMAL, Date
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, Boolean, ForeignKey, DECIMAL, Date
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
 from ..core.database import Base
 
@@ -113,6 +114,7 @@ class ProductSale(Base):
     base_price = Column(Float, nullable=False)
     total_price = Column(Float, nullable=False)
     observations = Column(String(300))
+    sale_created_at = Column(DateTime)  # copy of sales.created_at (partition key)
     
     sale = relationship("Sale", back_populates="product_sales")
     product = relationship("Product", back_populates="product_sales")
@@ -200,4 +202,37 @@ class OptionGroup(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     brand_id = Column(Integer, ForeignKey("brands.id"))
-    name = Column(String(500), nullable=False)
\ No newline at end of file
+    name = Column(String(500), nullable=False)
+
+class SalesHourlyRollup(Base):
+    """
+    Pre-aggregated sales per hour bucket
+    Maintained incrementally by services.rollup_service
+    """
+    __tablename__ = "sales_hourly_rollup"
+    
+    bucket = Column(DateTime, primary_key=True)
+    store_id = Column(Integer, primary_key=True)
+    channel_id = Column(Integer, primary_key=True)
+    sub_brand_id = Column(Integer, primary_key=True, default=0)
+    
+    orders = Column(Integer, nullable=False)
+    revenue = Column(DECIMAL(14, 2), nullable=False)
+    revenue_sq = Column(DECIMAL(20, 4), nullable=False)
+    
+    # Operations: cancellations and delivery/production time histograms
+    cancelled = Column(Integer, nullable=False, default=0)
+    delivery_count = Column(Integer, nullable=False, default=0)
+    delivery_seconds = Column(BigInteger, nullable=False, default=0)
+    delivery_hist = Column(ARRAY(Integer))
+    production_count = Column(Integer, nullable=False, default=0)
+    production_seconds = Column(BigInteger, nullable=False, default=0)
+    production_hist = Column(ARRAY(Integer))
+
+class RollupWatermark(Base):
+    """Last sales.id folded into each rollup"""
+    __tablename__ = "rollup_watermarks"
+    
+    name = Column(String(100), primary_key=True)
+    last_sale_id = Column(Integer, nullable=False, default=0)
+    refreshed_at = Column(DateTime)
\ No newline at end of file
@@ -43,6 +43,9 @@ class OverviewResponse(BaseModel):
     """Response schema for overview endpoint"""
     period: Dict[str, str]
     metrics: OverviewMetrics
+    approximate: Optional[Dict[str, float]] = Field(
+        default=None, description="Relative standard error of metrics estimated with HyperLogLog"
+    )
 
 class TimelinePoint(BaseModel):
     """Single point in timeline data"""
@@ -55,6 +58,9 @@ class TimelineResponse(BaseModel):
     """Response schema for timeline endpoint"""
     granularity: str
     data: List[TimelinePoint]
+    comparison: Optional[Dict[str, MetricValue]] = Field(
+        default=None, description="Period totals vs the previous period (compare=true)"
+    )
 
 class ProductCustomization(BaseModel):
     """Product customization detail"""
@@ -96,6 +102,7 @@ class Insight(BaseModel):
 class InsightsResponse(BaseModel):
     """Response schema for insights endpoint"""
     insights: List[Insight]
+    computed_at: Optional[datetime] = Field(default=None, description="When the insights engine produced them")
 
 class ChannelPerformance(BaseModel):
     """Channel performance metrics"""
@@ -104,13 +111,42 @@ class ChannelPerformance(BaseModel):
     orders: int
     revenue: float
     avg_ticket: float
+    # Minutes; p50/p90 come from 5-minute histograms (see rollup_service)
     avg_delivery_time: Optional[float] = None
-    cancellation_rate: float
+    delivery_time_p50: Optional[float] = None
+    delivery_time_p90: Optional[float] = None
+    avg_production_time: Optional[float] = None
+    production_time_p50: Optional[float] = None
+    production_time_p90: Optional[float] = None
+    cancelled_orders: int = 0
+    cancellation_rate: float = Field(description="Cancelled orders, % of orders")
 
 class ChannelsResponse(BaseModel):
     """Response schema for channels performance endpoint"""
     channels: List[ChannelPerformance]
 
+class DashboardPanels(BaseModel):
+    """Panels loaded by the composite dashboard endpoint (None when not requested or failed)"""
+    overview: Optional[OverviewResponse] = None
+    timeline: Optional[TimelineResponse] = None
+    top_products: Optional[TopProductsResponse] = None
+    channels: Optional[ChannelsResponse] = None
+    insights: Optional[InsightsResponse] = None
+
+class PanelTiming(BaseModel):
+    """Time spent loading one panel"""
+    ms: float
+    cached: bool = False
+    cache: Optional[str] = Field(default=None, description="fresh, stale, computed, shared or None when not cached")
+
+class DashboardResponse(BaseModel):
+    """Response schema for the composite dashboard endpoint"""
+    period: Dict[str, Optional[str]]
+    panels: DashboardPanels
+    timings: Dict[str, PanelTiming]
+    errors: Dict[str, str] = Field(default_factory=dict)
+    total_ms: float
+
 class CustomerSegment(BaseModel):
     """Customer segmentation data"""
     segment: str
@@ -151,15 +187,44 @@ class NaturalQueryResponse(BaseModel):
     chart_type: Optional[str] = None
     confidence: float = Field(ge=0, le=1)
 
+class NaturalQueryBatchRequest(BaseModel):
+    """Several natural language questions answered together"""
+    queries: List[str] = Field(min_length=1, description="Questions, answered in this order")
+    context: Optional[Dict[str, Any]] = Field(default=None, description="Context shared by every question")
+
+class NaturalQueryTiming(BaseModel):
+    """Time spent answering one question of a batch"""
+    ms: float
+    scan: Optional[int] = Field(default=None, description="Index in `scans` of the shared query that answered it; None = answered alone")
+
+class NaturalQueryBatchAnswer(NaturalQueryResponse):
+    """One answer of a batch"""
+    timing: NaturalQueryTiming
+
+class NaturalQueryScan(BaseModel):
+    """One GROUPING SETS statement shared by several questions"""
+    source: str = Field(description="sales or products")
+    start_date: str
+    end_date: str
+    store_id: Optional[int] = None
+    queries: List[int] = Field(description="Indexes of the questions it answered")
+    ms: float
+
+class NaturalQueryBatchResponse(BaseModel):
+    """Response for a batch of natural language queries"""
+    answers: List[NaturalQueryBatchAnswer]
+    scans: List[NaturalQueryScan]
+    total_ms: float
+
 # ===== Export Schemas =====
 
 class ExportRequest(BaseModel):
-    """Request for data export"""
-    # export_type: str = Field(regex="^(overview|products|timeline|custom)$")
-    # format: str = Field(default="csv", regex="^(csv|excel|json)$")
-    export_type: Literal["overview", "products", "timeline", "custom"]
-    format: Literal["csv", "excel", "json"] = "csv"
+    """Request for data export (streamed, see services/export_service.py)"""
+    # overview = one row per store; sales / product_sales = raw rows
+    export_type: Literal["overview", "products", "timeline", "sales", "product_sales"]
+    format: Literal["csv", "ndjson", "parquet"] = "csv"
     filters: Optional[DateRangeFilter] = None
+    granularity: Literal["hour", "day", "week", "month"] = "day"
 
 class ExportResponse(BaseModel):
     """Response for export request"""
@@ -167,6 +232,41 @@ class ExportResponse(BaseModel):
     file_name: str
     expires_at: datetime
 
+# ===== Job Schemas =====
+
+class TimelineJobParams(BaseModel):
+    """Params of a background timeline job (e.g. 365 days by hour)"""
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    store_id: Optional[int] = None
+    granularity: Literal["hour", "day", "week", "month"] = "day"
+    compare: bool = False
+    filters: Optional[Dict[str, Any]] = None
+
+class RetentionJobParams(BaseModel):
+    """Params of a background customer retention analysis"""
+    query: Optional[str] = None
+    store_id: Optional[int] = None
+
+class JobRequest(BaseModel):
+    """Background job submission (see services/job_queue.py)"""
+    # export params = ExportRequest, timeline = TimelineJobParams, retention = RetentionJobParams
+    job_type: Literal["export", "timeline", "retention"]
+    params: Dict[str, Any] = Field(default_factory=dict)
+
+class JobStatus(BaseModel):
+    """Status and progress of a background job"""
+    id: str
+    job_type: str
+    status: Literal["queued", "running", "done", "failed"]
+    progress: float = Field(ge=0, le=1)
+    message: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result_url: Optional[str] = None
+
 # ===== Error Schemas =====
 
 class ErrorResponse(BaseModel):
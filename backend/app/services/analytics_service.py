@@ -4,111 +4,113 @@ Todos os métodos buscando dados reais do banco de dados
 """
 
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from datetime import datetime, timedelta, date
+from datetime import date
 from typing import Optional, Dict
+import asyncio
 import logging
 
+from .rollup_service import pick_sales_source, operations_columns, operations_metrics, RAW_SALES
+from .period_comparison import PeriodComparison, metric_delta, ratio
+from .partition_manager import partition_state
+from .sales_cube import sales_cube
+from .insights_engine import load_insights
+from .customer_sketches import can_answer as sketches_can_answer, count_customers, relative_error
+from ..core.filter_compiler import compile_filters
+from ..core.config import settings
+from ..core.database import AsyncSessionLocal
+
 logger = logging.getLogger(__name__)
 
+# Formato de saída do período por granularidade
+PERIOD_FORMATS = {
+    'hour': "YYYY-MM-DD HH24:00",
+    'day': "YYYY-MM-DD",
+    'week': "YYYY-MM-DD",
+    'month': "YYYY-MM",
+}
+
+def product_sales_range() -> str:
+    """
+    Same period on product_sales.sale_created_at when product_sales is
+    partitioned, so the planner prunes its months too (the join on
+    sales alone only prunes sales)
+    """
+    if not partition_state.product_sales:
+        return ""
+    return "AND ps.sale_created_at >= :f_start AND ps.sale_created_at < :f_end"
+
+def period_expression(granularity: str, time_column: str) -> str:
+    """TO_CHAR(DATE_TRUNC(...)) para agrupar por hora/dia/semana/mês"""
+    if granularity not in PERIOD_FORMATS:
+        granularity = 'day'
+    return f"TO_CHAR(DATE_TRUNC('{granularity}', {time_column}), '{PERIOD_FORMATS[granularity]}')"
+
 class AnalyticsService:
+    # False = always scan raw sales (see ColumnarAnalyticsService)
+    use_rollup = True
+    
     def __init__(self, db: Session):
         self.db = db
     
+    def _sales_source(self, filters):
+        return pick_sales_source(filters) if self.use_rollup else RAW_SALES
+    
+    def _use_cube(self, compiled, filters) -> bool:
+        """The in-memory cube is built from the rollup, so it follows use_rollup"""
+        return self.use_rollup and sales_cube.can_answer(compiled, filters)
+    
     def get_overview_metrics(self, start_date: Optional[date], end_date: Optional[date], 
-                           store_id: Optional[int], filters: Dict = None):
-        """Overview metrics COM FILTROS FUNCIONANDO"""
+                           store_id: Optional[int], filters: Dict = None, exact: bool = False):
+        """
+        Overview metrics COM FILTROS FUNCIONANDO
+        unique_customers vem dos sketches HyperLogLog quando possível;
+        exact=True força o COUNT(DISTINCT) em sales
+        """
+        compiled = compile_filters(filters, start_date, end_date, store_id)
+        start_date, end_date = compiled.start_date, compiled.end_date
+        
         try:
-            # Defaults
-            if not end_date:
-                end_date = date.today()
-            if not start_date:
-                start_date = end_date - timedelta(days=30)
-            
             logger.info(f"📊 Overview: {start_date} até {end_date}")
-            logger.info(f"🔍 Filtros: {filters}")
+            logger.info(f"🔍 Filtros: {compiled.canonical}")
             
-            # Query base
-            base_query = """
-                SELECT 
-                    COUNT(DISTINCT s.id) as total_orders,
-                    COALESCE(SUM(s.total_amount), 0) as total_revenue,
-                    COALESCE(AVG(s.total_amount), 0) as avg_ticket,
-                    COUNT(DISTINCT s.customer_id) as unique_customers
-                FROM sales s
-                WHERE s.created_at >= :start_date 
-                AND s.created_at <= :end_date
-            """
+            # Rollup quando os filtros permitem, sales bruto caso contrário
+            source = self._sales_source(filters)
             
-            # Aplicar filtros
-            if filters and filters.get('channels'):
-                channel_conditions = []
-                for channel in filters['channels']:
-                    if channel.lower() == 'ifood':
-                        channel_conditions.append("s.channel_id IN (2, 8, 14)")
-                    elif channel.lower() == 'rappi':
-                        channel_conditions.append("s.channel_id IN (3, 9, 15)")
-                    elif channel.lower() == 'uber':
-                        channel_conditions.append("s.channel_id IN (4, 10, 16)")
-                    elif channel.lower() == 'whatsapp':
-                        channel_conditions.append("s.channel_id IN (5, 11, 17)")
-                    elif channel.lower() == 'presencial':
-                        channel_conditions.append("s.channel_id IN (1, 7, 13)")
-                    elif channel.lower() == 'app':
-                        channel_conditions.append("s.channel_id IN (6, 12, 18)")
-                
-                if channel_conditions:
-                    base_query += f" AND ({' OR '.join(channel_conditions)})"
-            
-            if filters and filters.get('day_of_week'):
-                day_mapping = {'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6}
-                days = [str(day_mapping.get(d, 0)) for d in filters['day_of_week']]
-                base_query += f" AND EXTRACT(DOW FROM s.created_at) IN ({','.join(days)})"
-            
-            if filters and filters.get('time_of_day'):
-                time_conditions = []
-                for time in filters['time_of_day']:
-                    if time == 'morning':
-                        time_conditions.append("(EXTRACT(HOUR FROM s.created_at) >= 6 AND EXTRACT(HOUR FROM s.created_at) < 12)")
-                    elif time == 'afternoon':
-                        time_conditions.append("(EXTRACT(HOUR FROM s.created_at) >= 12 AND EXTRACT(HOUR FROM s.created_at) < 18)")
-                    elif time == 'evening':
-                        time_conditions.append("(EXTRACT(HOUR FROM s.created_at) >= 18 AND EXTRACT(HOUR FROM s.created_at) < 23)")
-                    elif time == 'night':
-                        time_conditions.append("(EXTRACT(HOUR FROM s.created_at) >= 23 OR EXTRACT(HOUR FROM s.created_at) < 6)")
-                
-                if time_conditions:
-                    base_query += f" AND ({' OR '.join(time_conditions)})"
-            
-            # Executar query principal
-            result = self.db.execute(
-                text(base_query),
-                {'start_date': start_date, 'end_date': end_date}
-            ).first()
-            
-            # Query para período anterior
-            previous_start = start_date - timedelta(days=(end_date - start_date).days + 1)
-            previous_end = start_date - timedelta(days=1)
-            
-            previous_query = base_query.replace(':start_date', ':prev_start').replace(':end_date', ':prev_end')
+            # Período atual e anterior numa única varredura
+            comparison = PeriodComparison(compiled)
+            aggregates = {
+                'orders': source.orders,
+                'revenue': source.revenue,
+            }
+            # Clientes únicos não são somáveis entre buckets: sketches HLL
+            # (mergeáveis) ou COUNT(DISTINCT) em sales
+            use_sketches = not exact and self.use_rollup and sketches_can_answer(compiled, filters)
+            customers_aggregate = {} if use_sketches else {'customers': "COUNT(DISTINCT s.customer_id)"}
+            customers = None
+            if self._use_cube(compiled, filters):
+                current_totals = sales_cube.totals(compiled)
+                previous_totals = sales_cube.totals(comparison.previous)
+                totals = {
+                    'current': {'orders': current_totals[0], 'revenue': current_totals[1]},
+                    'previous': {'orders': previous_totals[0], 'revenue': previous_totals[1]},
+                }
+            elif source.is_rollup:
+                totals = comparison.run(self.db, aggregates, table=source.table,
+                                        time_column=source.time_column)[0]
+            else:
+                totals = customers = comparison.run(self.db, {**aggregates, **customers_aggregate})[0]
             
-            previous_result = self.db.execute(
-                text(previous_query),
-                {
-                    'prev_start': previous_start,
-                    'prev_end': previous_end,
-                    'start_date': start_date,
-                    'end_date': end_date
+            if use_sketches:
+                customers = {
+                    'current': {'customers': count_customers(self.db, compiled)},
+                    'previous': {'customers': count_customers(self.db, comparison.previous)},
                 }
-            ).first()
+            elif customers is None:
+                customers = comparison.run(self.db, customers_aggregate)[0]
             
-            # Calcular mudança percentual
-            def safe_change(current_val, previous_val):
-                if not current_val:
-                    current_val = 0
-                if not previous_val or previous_val == 0:
-                    return 0
-                return ((current_val - previous_val) / previous_val) * 100
+            current, previous = totals['current'], totals['previous']
             
             return {
                 'period': {
@@ -116,33 +118,25 @@ class AnalyticsService:
                     'end': str(end_date)
                 },
                 'metrics': {
-                    'total_orders': {
-                        'value': int(result.total_orders or 0),
-                        'previous': int(previous_result.total_orders or 0),
-                        'change': safe_change(result.total_orders, previous_result.total_orders)
-                    },
-                    'total_revenue': {
-                        'value': float(result.total_revenue or 0),
-                        'previous': float(previous_result.total_revenue or 0),
-                        'change': safe_change(result.total_revenue, previous_result.total_revenue)
-                    },
-                    'avg_ticket': {
-                        'value': float(result.avg_ticket or 0),
-                        'previous': float(previous_result.avg_ticket or 0),
-                        'change': safe_change(result.avg_ticket, previous_result.avg_ticket)
-                    },
-                    'unique_customers': {
-                        'value': int(result.unique_customers or 0),
-                        'previous': int(previous_result.unique_customers or 0),
-                        'change': safe_change(result.unique_customers, previous_result.unique_customers)
-                    }
-                }
+                    'total_orders': metric_delta(current['orders'], previous['orders'], int),
+                    'total_revenue': metric_delta(current['revenue'], previous['revenue']),
+                    'avg_ticket': metric_delta(
+                        ratio(current['revenue'], current['orders']),
+                        ratio(previous['revenue'], previous['orders'])
+                    ),
+                    'unique_customers': metric_delta(
+                        customers['current']['customers'],
+                        customers['previous']['customers'],
+                        int
+                    )
+                },
+                'approximate': {'unique_customers': round(relative_error(), 4)} if use_sketches else None
             }
             
         except Exception as e:
             logger.error(f"Erro em get_overview_metrics: {str(e)}")
             return {
-                'period': {'start': '', 'end': ''},
+                'period': {'start': str(start_date), 'end': str(end_date)},
                 'metrics': {
                     'total_orders': {'value': 0, 'previous': 0, 'change': 0},
                     'total_revenue': {'value': 0, 'previous': 0, 'change': 0},
@@ -151,65 +145,32 @@ class AnalyticsService:
                 }
             }
     
-    def get_timeline_data(self, start_date, end_date, store_id, granularity, filters=None):
+    def get_timeline_data(self, start_date, end_date, store_id, granularity, filters=None, compare=False):
         """Timeline data REAL do banco"""
         try:
-            if not end_date:
-                end_date = date.today()
-            if not start_date:
-                start_date = end_date - timedelta(days=30)
-            
-            # Determinar agrupamento
-            if granularity == 'hour':
-                date_group = "DATE_TRUNC('hour', s.created_at)"
-                date_format = "YYYY-MM-DD HH24:00"
-            elif granularity == 'week':
-                date_group = "DATE_TRUNC('week', s.created_at)"
-                date_format = "YYYY-MM-DD"
-            elif granularity == 'month':
-                date_group = "DATE_TRUNC('month', s.created_at)"
-                date_format = "YYYY-MM"
-            else:
-                date_group = "DATE_TRUNC('day', s.created_at)"
-                date_format = "YYYY-MM-DD"
+            compiled = compile_filters(filters, start_date, end_date, store_id)
+            source = self._sales_source(filters)
+            
+            if self._use_cube(compiled, filters):
+                return self._timeline_from_cube(compiled, granularity, compare)
+            
+            if compare:
+                return self._timeline_with_comparison(compiled, source, granularity)
+            
+            where, params = compiled.where(source.time_column)
             
             query = f"""
                 SELECT 
-                    TO_CHAR({date_group}, '{date_format}') as period,
-                    COUNT(DISTINCT s.id) as orders,
-                    COALESCE(SUM(s.total_amount), 0) as revenue,
-                    COALESCE(AVG(s.total_amount), 0) as avg_ticket
-                FROM sales s
-                WHERE s.created_at >= :start_date 
-                AND s.created_at <= :end_date
+                    {period_expression(granularity, source.time_column)} as period,
+                    COALESCE({source.orders}, 0) as orders,
+                    COALESCE({source.revenue}, 0) as revenue,
+                    COALESCE({source.revenue} / NULLIF({source.orders}, 0), 0) as avg_ticket
+                FROM {source.table}
+                WHERE {where}
+                GROUP BY period ORDER BY period
             """
             
-            # Aplicar filtros
-            if filters and filters.get('channels'):
-                channel_conditions = []
-                for channel in filters['channels']:
-                    if channel.lower() == 'ifood':
-                        channel_conditions.append("s.channel_id IN (2, 8, 14)")
-                    elif channel.lower() == 'rappi':
-                        channel_conditions.append("s.channel_id IN (3, 9, 15)")
-                    elif channel.lower() == 'uber':
-                        channel_conditions.append("s.channel_id IN (4, 10, 16)")
-                    elif channel.lower() == 'whatsapp':
-                        channel_conditions.append("s.channel_id IN (5, 11, 17)")
-                    elif channel.lower() == 'presencial':
-                        channel_conditions.append("s.channel_id IN (1, 7, 13)")
-                    elif channel.lower() == 'app':
-                        channel_conditions.append("s.channel_id IN (6, 12, 18)")
-                
-                if channel_conditions:
-                    query += f" AND ({' OR '.join(channel_conditions)})"
-            
-            query += f" GROUP BY period ORDER BY period"
-            
-            results = self.db.execute(
-                text(query),
-                {'start_date': start_date, 'end_date': end_date}
-            ).fetchall()
+            results = self.db.execute(text(query), params).fetchall()
             
             data = []
             for r in results:
@@ -226,15 +187,79 @@ class AnalyticsService:
             logger.error(f"Erro em get_timeline_data: {str(e)}")
             return {'granularity': granularity, 'data': []}
     
+    def _timeline_from_cube(self, compiled, granularity, compare):
+        """Same response as the SQL paths, sliced from the in-memory cube"""
+        data = [
+            {**row, 'avg_ticket': ratio(row['revenue'], row['orders'])}
+            for row in sales_cube.series(compiled, granularity)
+        ]
+        response = {'granularity': granularity, 'data': data}
+        if compare:
+            orders = sum(row['orders'] for row in data)
+            revenue = sum(row['revenue'] for row in data)
+            prev_orders, prev_revenue = sales_cube.totals(PeriodComparison(compiled).previous)
+            response['comparison'] = {
+                'orders': metric_delta(orders, prev_orders),
+                'revenue': metric_delta(revenue, prev_revenue),
+                'avg_ticket': metric_delta(ratio(revenue, orders), ratio(prev_revenue, prev_orders))
+            }
+        return response
+    
+    def _timeline_with_comparison(self, compiled, source, granularity):
+        """
+        Timeline do período atual + totais do período anterior,
+        agrupando a união dos dois períodos numa única varredura
+        """
+        comparison = PeriodComparison(compiled)
+        rows = comparison.run(
+            self.db,
+            {'orders': source.orders, 'revenue': source.revenue},
+            table=source.table,
+            time_column=source.time_column,
+            group_by=[('period', period_expression(granularity, source.time_column))],
+            order_by='period'
+        )
+        
+        data = []
+        totals = {'orders': 0, 'revenue': 0.0, 'prev_orders': 0, 'prev_revenue': 0.0}
+        for row in rows:
+            current, previous = row['current'], row['previous']
+            totals['prev_orders'] += int(previous['orders'] or 0)
+            totals['prev_revenue'] += float(previous['revenue'] or 0)
+            
+            # Buckets que só têm vendas do período anterior ficam fora da série
+            if not current['orders']:
+                continue
+            totals['orders'] += int(current['orders'])
+            totals['revenue'] += float(current['revenue'] or 0)
+            data.append({
+                'period': row['group']['period'],
+                'orders': int(current['orders']),
+                'revenue': float(current['revenue'] or 0),
+                'avg_ticket': ratio(current['revenue'], current['orders'])
+            })
+        
+        return {
+            'granularity': granularity,
+            'data': data,
+            'comparison': {
+                'orders': metric_delta(totals['orders'], totals['prev_orders']),
+                'revenue': metric_delta(totals['revenue'], totals['prev_revenue']),
+                'avg_ticket': metric_delta(
+                    ratio(totals['revenue'], totals['orders']),
+                    ratio(totals['prev_revenue'], totals['prev_orders'])
+                )
+            }
+        }
+    
     def get_top_products(self, start_date, end_date, store_id, limit, filters=None):
         """Top products com dados REAIS"""
         try:
-            if not end_date:
-                end_date = date.today()
-            if not start_date:
-                start_date = end_date - timedelta(days=30)
+            compiled = compile_filters(filters, start_date, end_date, store_id)
+            where, params = compiled.where('s.created_at')
+            params['limit'] = limit
             
-            query = """
+            query = f"""
                 SELECT 
                     p.id,
                     p.name,
@@ -245,40 +270,14 @@ class AnalyticsService:
                 FROM products p
                 INNER JOIN product_sales ps ON p.id = ps.product_id
                 INNER JOIN sales s ON ps.sale_id = s.id
-                WHERE s.created_at >= :start_date 
-                AND s.created_at <= :end_date
-            """
-            
-            # Aplicar filtros
-            if filters and filters.get('channels'):
-                channel_conditions = []
-                for channel in filters['channels']:
-                    if channel.lower() == 'ifood':
-                        channel_conditions.append("s.channel_id IN (2, 8, 14)")
-                    elif channel.lower() == 'rappi':
-                        channel_conditions.append("s.channel_id IN (3, 9, 15)")
-                    elif channel.lower() == 'uber':
-                        channel_conditions.append("s.channel_id IN (4, 10, 16)")
-                    elif channel.lower() == 'whatsapp':
-                        channel_conditions.append("s.channel_id IN (5, 11, 17)")
-                    elif channel.lower() == 'presencial':
-                        channel_conditions.append("s.channel_id IN (1, 7, 13)")
-                    elif channel.lower() == 'app':
-                        channel_conditions.append("s.channel_id IN (6, 12, 18)")
-                
-                if channel_conditions:
-                    query += f" AND ({' OR '.join(channel_conditions)})"
-            
-            query += """
+                WHERE {where}
+                {product_sales_range()}
                 GROUP BY p.id, p.name
                 ORDER BY revenue DESC
                 LIMIT :limit
             """
             
-            results = self.db.execute(
-                text(query),
-                {'start_date': start_date, 'end_date': end_date, 'limit': limit}
-            ).fetchall()
+            results = self.db.execute(text(query), params).fetchall()
             
             products = []
             for r in results:
@@ -301,139 +300,111 @@ class AnalyticsService:
     def get_channels_performance(self, start_date, end_date, store_id=None, filters=None):
         """Channels com dados REAIS e filtros aplicados"""
         try:
-            if not end_date:
-                end_date = date.today()
-            if not start_date:
-                start_date = end_date - timedelta(days=30)
+            compiled = compile_filters(filters, start_date, end_date, store_id)
+            # Not from the cube: delivery/production times and cancellations
+            # come from the rollup (or raw sales) in this same GROUP BY
+            source = self._sales_source(filters)
+            where, params = compiled.where(source.time_column)
             
-            # Base query
-            query = """
+            query = f"""
                 SELECT 
                     c.name as channel_name,
                     c.type as channel_type,
-                    COUNT(DISTINCT s.id) as orders,
-                    COALESCE(SUM(s.total_amount), 0) as revenue,
-                    COALESCE(AVG(s.total_amount), 0) as avg_ticket
-                FROM sales s
+                    COALESCE({source.orders}, 0) as orders,
+                    COALESCE({source.revenue}, 0) as revenue,
+                    COALESCE({source.revenue} / NULLIF({source.orders}, 0), 0) as avg_ticket,
+                    {operations_columns(source)}
+                FROM {source.table}
                 INNER JOIN channels c ON s.channel_id = c.id
-                WHERE s.created_at >= :start_date 
-                AND s.created_at <= :end_date
-            """
-            
-            # Aplicar filtro de store_id
-            if store_id:
-                query += " AND s.store_id = :store_id"
-            
-            # Aplicar filtro de canais específicos
-            if filters and filters.get('channels'):
-                # Este filtro é para FILTRAR os canais mostrados
-                channel_names = []
-                for channel in filters['channels']:
-                    if channel.lower() == 'ifood':
-                        channel_names.append("'iFood%'")
-                    elif channel.lower() == 'rappi':
-                        channel_names.append("'Rappi%'")
-                    elif channel.lower() == 'uber':
-                        channel_names.append("'Uber%'")
-                    elif channel.lower() == 'whatsapp':
-                        channel_names.append("'WhatsApp%'")
-                    elif channel.lower() == 'presencial':
-                        channel_names.append("'Presencial%'")
-                    elif channel.lower() == 'app':
-                        channel_names.append("'App%'")
-                
-                if channel_names:
-                    query += f" AND (c.name LIKE {' OR c.name LIKE '.join(channel_names)})"
-            
-            # Aplicar filtro de dia da semana
-            if filters and filters.get('day_of_week'):
-                day_mapping = {
-                    'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4,
-                    'fri': 5, 'sat': 6, 'sun': 0
-                }
-                days = [str(day_mapping.get(d, -1)) for d in filters['day_of_week']]
-                if days:
-                    query += f" AND EXTRACT(DOW FROM s.created_at) IN ({','.join(days)})"
-            
-            # Aplicar filtro de período do dia
-            if filters and filters.get('time_of_day'):
-                time_conditions = []
-                for period in filters['time_of_day']:
-                    if period == 'morning':
-                        time_conditions.append("EXTRACT(HOUR FROM s.created_at) BETWEEN 6 AND 11")
-                    elif period == 'afternoon':
-                        time_conditions.append("EXTRACT(HOUR FROM s.created_at) BETWEEN 12 AND 17")
-                    elif period == 'evening':
-                        time_conditions.append("EXTRACT(HOUR FROM s.created_at) BETWEEN 18 AND 22")
-                    elif period == 'night':
-                        time_conditions.append("(EXTRACT(HOUR FROM s.created_at) >= 23 OR EXTRACT(HOUR FROM s.created_at) < 6)")
-                
-                if time_conditions:
-                    query += f" AND ({' OR '.join(time_conditions)})"
-            
-            query += """
+                WHERE {where}
                 GROUP BY c.name, c.type
-                HAVING COUNT(s.id) > 0
+                HAVING COALESCE({source.orders}, 0) > 0
                 ORDER BY revenue DESC
             """
             
-            # Preparar parâmetros
-            params = {'start_date': start_date, 'end_date': end_date}
-            if store_id:
-                params['store_id'] = store_id
-            
             results = self.db.execute(text(query), params).fetchall()
-            
-            channels = []
-            for r in results:
-                channels.append({
-                    'name': r.channel_name,
-                    'type': 'delivery' if r.channel_type == 'D' else 'direct',
-                    'orders': int(r.orders or 0),
-                    'revenue': float(r.revenue or 0),
-                    'avg_ticket': float(r.avg_ticket or 0),
-                    'avg_delivery_time': 35 if r.channel_type == 'D' else None,
-                    'cancellation_rate': 2.5 if r.channel_type == 'D' else 1.0
-                })
-            
-            return {'channels': channels}
+            return {'channels': self._format_channels(results)}
             
         except Exception as e:
             logger.error(f"Erro em get_channels_performance: {str(e)}")
             return {'channels': []}
     
+    def _format_channels(self, results):
+        channels = []
+        for r in results:
+            channel = {
+                'name': r.channel_name,
+                'type': 'delivery' if r.channel_type == 'D' else 'direct',
+                'orders': int(r.orders or 0),
+                'revenue': float(r.revenue or 0),
+                'avg_ticket': float(r.avg_ticket or 0),
+            }
+            channel.update(operations_metrics(r))
+            channels.append(channel)
+        return channels
+    
     def get_business_insights(self, store_id):
-        """Insights básicos"""
-        return {
-            'insights': [
+        """Insights precomputados pelo insights_engine (lookup por loja)"""
+        try:
+            stored = load_insights(self.db, store_id)
+        except Exception as e:
+            logger.error(f"Erro em get_business_insights: {str(e)}")
+            self.db.rollback()
+            stored = None
+
+        if stored is None:
+            return {
+                'insights': [
+                    {
+                        'type': 'info',
+                        'priority': 'low',
+                        'title': '⏳ Insights em processamento',
+                        'description': 'A análise de anomalias ainda não rodou para este escopo',
+                        'action': 'Volte em alguns minutos'
+                    }
+                ]
+            }
+        if not stored['insights']:
+            stored['insights'] = [
                 {
                     'type': 'info',
-                    'priority': 'high',
-                    'title': '✅ Sistema Funcionando',
-                    'description': 'Dashboard com dados reais do banco',
+                    'priority': 'low',
+                    'title': '✅ Nenhuma anomalia detectada',
+                    'description': 'Faturamento, pedidos, ticket por canal e produtos dentro do normal',
                     'action': 'Continue monitorando'
                 }
             ]
-        }
+        return stored
     
     def get_products_list(self, store_id=None):
         """Lista de produtos para seleção"""
         try:
-            query = """
+            # Por loja: só conta vendas daquela loja
+            if store_id is not None:
+                sold_join = """
+                    LEFT JOIN product_sales ps ON p.id = ps.product_id
+                    LEFT JOIN sales s ON s.id = ps.sale_id AND s.store_id = :store_id
+                """
+                sold_count = "COUNT(DISTINCT s.id)"
+            else:
+                sold_join = "LEFT JOIN product_sales ps ON p.id = ps.product_id"
+                sold_count = "COUNT(DISTINCT ps.sale_id)"
+            
+            query = f"""
                 SELECT DISTINCT
                     p.id,
                     p.name,
                     c.name as category,
-                    COUNT(DISTINCT ps.sale_id) as total_sold
+                    {sold_count} as total_sold
                 FROM products p
                 LEFT JOIN categories c ON p.category_id = c.id
-                LEFT JOIN product_sales ps ON p.id = ps.product_id
+                {sold_join}
                 GROUP BY p.id, p.name, c.name
                 ORDER BY total_sold DESC, p.name
                 LIMIT 100
             """
             
-            results = self.db.execute(text(query)).fetchall()
+            results = self.db.execute(text(query), {'store_id': store_id}).fetchall()
             
             products = []
             for r in results:
@@ -450,31 +421,17 @@ class AnalyticsService:
             logger.error(f"Erro em get_products_list: {str(e)}")
             return {"products": []}
     
-    def get_product_timeline(self, product_id, start_date, end_date, granularity='day', filters=None):
+    def get_product_timeline(self, product_id, start_date, end_date, granularity='day', filters=None,
+                             store_id=None):
         """Timeline de produto específico"""
         try:
-            if not end_date:
-                end_date = date.today()
-            if not start_date:
-                start_date = end_date - timedelta(days=30)
-            
-            # Determinar agrupamento
-            if granularity == 'hour':
-                date_group = "DATE_TRUNC('hour', s.created_at)"
-                date_format = "YYYY-MM-DD HH24:00"
-            elif granularity == 'week':
-                date_group = "DATE_TRUNC('week', s.created_at)"
-                date_format = "YYYY-MM-DD"
-            elif granularity == 'month':
-                date_group = "DATE_TRUNC('month', s.created_at)"
-                date_format = "YYYY-MM"
-            else:
-                date_group = "DATE_TRUNC('day', s.created_at)"
-                date_format = "YYYY-MM-DD"
+            compiled = compile_filters(filters, start_date, end_date, store_id)
+            where, params = compiled.where('s.created_at')
+            params['product_id'] = product_id
             
             query = f"""
                 SELECT 
-                    TO_CHAR({date_group}, '{date_format}') as period,
+                    {period_expression(granularity, 's.created_at')} as period,
                     COUNT(DISTINCT ps.sale_id) as orders,
                     COALESCE(SUM(ps.quantity), 0) as quantity,
                     COALESCE(SUM(ps.total_price), 0) as revenue,
@@ -482,40 +439,12 @@ class AnalyticsService:
                 FROM product_sales ps
                 JOIN sales s ON ps.sale_id = s.id
                 WHERE ps.product_id = :product_id
-                AND s.created_at >= :start_date 
-                AND s.created_at <= :end_date
+                AND {where}
+                {product_sales_range()}
+                GROUP BY period ORDER BY period
             """
             
-            # Aplicar filtros
-            if filters and filters.get('channels'):
-                channel_conditions = []
-                for channel in filters['channels']:
-                    if channel.lower() == 'ifood':
-                        channel_conditions.append("s.channel_id IN (2, 8, 14)")
-                    elif channel.lower() == 'rappi':
-                        channel_conditions.append("s.channel_id IN (3, 9, 15)")
-                    elif channel.lower() == 'uber':
-                        channel_conditions.append("s.channel_id IN (4, 10, 16)")
-                    elif channel.lower() == 'whatsapp':
-                        channel_conditions.append("s.channel_id IN (5, 11, 17)")
-                    elif channel.lower() == 'presencial':
-                        channel_conditions.append("s.channel_id IN (1, 7, 13)")
-                    elif channel.lower() == 'app':
-                        channel_conditions.append("s.channel_id IN (6, 12, 18)")
-                
-                if channel_conditions:
-                    query += f" AND ({' OR '.join(channel_conditions)})"
-            
-            query += f" GROUP BY period ORDER BY period"
-            
-            results = self.db.execute(
-                text(query),
-                {
-                    'product_id': product_id,
-                    'start_date': start_date,
-                    'end_date': end_date
-                }
-            ).fetchall()
+            results = self.db.execute(text(query), params).fetchall()
             
             # Buscar informações do produto
             product_info = self.db.execute(
@@ -554,4 +483,67 @@ class AnalyticsService:
                 "product": {"id": product_id, "name": "Erro", "category": None},
                 "granularity": granularity,
                 "data": []
-            }
\ No newline at end of file
+            }
+
+
+class AsyncAnalyticsService:
+    """
+    Awaitable version of AnalyticsService for the async endpoints.
+
+    Each call runs the AnalyticsService method through AsyncSession.run_sync:
+    the SQL goes out over asyncpg and the event loop keeps serving other
+    requests while PostgreSQL works, so concurrency is bounded by the pool
+    size instead of the number of uvicorn workers.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def _run(self, method: str, *args, **kwargs):
+        return await self.db.run_sync(
+            lambda session: getattr(AnalyticsService(session), method)(*args, **kwargs)
+        )
+
+    async def get_overview_metrics(self, start_date, end_date, store_id, filters=None, exact=False):
+        return await self._run('get_overview_metrics', start_date, end_date, store_id, filters=filters, exact=exact)
+
+    async def get_timeline_data(self, start_date, end_date, store_id, granularity, filters=None, compare=False):
+        return await self._run('get_timeline_data', start_date, end_date, store_id, granularity,
+                               filters=filters, compare=compare)
+
+    async def get_top_products(self, start_date, end_date, store_id, limit, filters=None):
+        return await self._run('get_top_products', start_date, end_date, store_id, limit, filters=filters)
+
+    async def get_channels_performance(self, start_date, end_date, store_id=None, filters=None):
+        return await self._run('get_channels_performance', start_date, end_date, store_id, filters=filters)
+
+    async def get_business_insights(self, store_id):
+        return await self._run('get_business_insights', store_id)
+
+    async def get_products_list(self, store_id=None):
+        return await self._run('get_products_list', store_id)
+
+    async def get_product_timeline(self, product_id, start_date, end_date, granularity='day', filters=None,
+                                   store_id=None):
+        return await self._run('get_product_timeline', product_id, start_date, end_date,
+                               granularity=granularity, filters=filters, store_id=store_id)
+
+
+async def call_analytics(method: str, *args, engine: Optional[str] = None, **kwargs):
+    """
+    Run an AnalyticsService method on its own AsyncSession (own pool
+    checkout), independent of any request. Used by cache recomputes that
+    may finish after the request that triggered them.
+    
+    engine: 'postgres' or 'duckdb' (default settings.ANALYTIC_ENGINE);
+    DuckDB answers from the Parquet snapshot when one is available.
+    """
+    if (engine or settings.ANALYTIC_ENGINE) == 'duckdb':
+        # Import tardio: columnar_engine estende AnalyticsService
+        from .columnar_engine import columnar_ready, run_columnar
+        if columnar_ready():
+            return await asyncio.to_thread(run_columnar, method, *args, **kwargs)
+        logger.warning("Columnar snapshot not available, using PostgreSQL")
+    
+    async with AsyncSessionLocal() as session:
+        return await getattr(AsyncAnalyticsService(session), method)(*args, **kwargs)
@@ -0,0 +1,166 @@
+"""
+Cache warmer
+Background loop that recomputes the most requested dashboard panels
+shortly before their cache entries stop being fresh, so the first user
+after an expiry doesn't pay the cold query
+"""
+
+from sqlalchemy import text
+from typing import List, Tuple, Dict
+import asyncio
+import json
+import logging
+
+from ..core.cache import cache
+from ..core.config import settings
+from ..core.database import AsyncSessionLocal
+from .panels import (
+    DashboardParams, PANELS, ACCESS_KEY, RECIPES_KEY, compute_panel
+)
+
+logger = logging.getLogger(__name__)
+
+# Only one worker warms per cycle
+LEADER_KEY = "nola:warm:leader"
+
+# Default views (dates omitted = last 30 days) always considered, with a
+# small base score so observed traffic still ranks first
+GRANULARITIES = ["day", "hour", "week", "month"]
+DEFAULT_SCORE = 1.0
+STORE_DEFAULT_SCORE = 0.5
+
+
+class CacheWarmer:
+    """
+    One warming cycle:
+    1. candidates = most accessed keys (decayed ZINCRBY counts) + default views
+    2. keep those missing or fresh for less than WARMER_AHEAD seconds
+    3. recompute them under a semaphore of WARMER_CONCURRENCY, so warming
+       never holds more than a few pool connections
+    """
+
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(settings.WARMER_CONCURRENCY)
+        self.store_ids: List[int] = []
+        self.stats = {'cycles': 0, 'warmed': 0, 'errors': 0}
+
+    async def run_cycle(self) -> int:
+        if not cache.client or not self._acquire_leadership():
+            return 0
+
+        if not self.store_ids:
+            self.store_ids = await self._load_store_ids()
+
+        candidates = self._candidates()
+        due = [(name, params) for name, params in candidates if self._needs_warming(name, params)]
+        if due:
+            await asyncio.gather(*(self._warm(name, params) for name, params in due))
+            logger.info(f"🔥 Cache warmer: {len(due)} of {len(candidates)} panels refreshed")
+
+        self._decay()
+        self.stats['cycles'] += 1
+        return len(due)
+
+    def _candidates(self) -> List[Tuple[str, DashboardParams]]:
+        scores: Dict[str, float] = {}
+        recipes: Dict[str, Tuple[str, DashboardParams]] = {}
+
+        # Chaves observadas, mais acessadas primeiro
+        top = cache.client.zrevrange(ACCESS_KEY, 0, settings.WARMER_MAX_KEYS - 1, withscores=True)
+        if top:
+            raw = cache.client.hmget(RECIPES_KEY, [key for key, _ in top])
+            for (key, score), recipe in zip(top, raw):
+                if not recipe:
+                    continue
+                try:
+                    recipe = _decode_recipe(recipe)
+                except Exception:
+                    continue
+                key = key.decode() if isinstance(key, bytes) else key
+                scores[key] = float(score)
+                recipes[key] = recipe
+
+        # Visões padrão: todas as lojas e cada loja, cada granularidade
+        for store_id in [None] + self.store_ids:
+            base = DEFAULT_SCORE if store_id is None else STORE_DEFAULT_SCORE
+            defaults = [('overview', DashboardParams(store_id=store_id)),
+                        ('top_products', DashboardParams(store_id=store_id))]
+            defaults += [('timeline', DashboardParams(store_id=store_id, granularity=g)) for g in GRANULARITIES]
+            for name, params in defaults:
+                key = PANELS[name](params).cache_key
+                scores[key] = scores.get(key, 0.0) + base
+                recipes.setdefault(key, (name, params))
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:settings.WARMER_MAX_KEYS]
+        return [recipes[key] for key in ranked]
+
+    def _needs_warming(self, name: str, params: DashboardParams) -> bool:
+        call = PANELS[name](params)
+        if not call.cache_key:
+            return False
+        fresh_for = cache.fresh_for(call.cache_key)
+        return fresh_for is None or fresh_for < settings.WARMER_AHEAD
+
+    async def _warm(self, name: str, params: DashboardParams):
+        call = PANELS[name](params)
+        async with self.semaphore:
+            try:
+                await cache.refresh(call.cache_key, lambda: compute_panel(call),
+                                    ttl=call.ttl, stale_ttl=call.stale_ttl, tags=call.tags)
+                self.stats['warmed'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Cache warmer error on {name}: {e}")
+
+    def _acquire_leadership(self) -> bool:
+        try:
+            return bool(cache.client.set(LEADER_KEY, cache.origin, nx=True,
+                                         ex=max(1, settings.WARMER_INTERVAL - 1)))
+        except Exception as e:
+            logger.error(f"Cache warmer leadership error: {e}")
+            return False
+
+    def _decay(self):
+        """
+        Age the access counts so yesterday's hot keys fade out, and keep
+        only the top WARMER_TRACK_LIMIT keys (and their recipes)
+        """
+        try:
+            cache.client.zunionstore(ACCESS_KEY, {ACCESS_KEY: settings.WARMER_DECAY})
+            overflow = cache.client.zrange(ACCESS_KEY, 0, -(settings.WARMER_TRACK_LIMIT + 1))
+            if overflow:
+                pipe = cache.client.pipeline(transaction=False)
+                pipe.zrem(ACCESS_KEY, *overflow)
+                pipe.hdel(RECIPES_KEY, *overflow)
+                pipe.execute()
+        except Exception as e:
+            logger.error(f"Cache warmer decay error: {e}")
+
+    async def _load_store_ids(self) -> List[int]:
+        try:
+            async with AsyncSessionLocal() as session:
+                rows = (await session.execute(text("SELECT id FROM stores ORDER BY id"))).fetchall()
+            return [row.id for row in rows]
+        except Exception as e:
+            logger.error(f"Cache warmer could not load stores: {e}")
+            return []
+
+
+def _decode_recipe(raw) -> Tuple[str, DashboardParams]:
+    recipe = json.loads(raw)
+    return recipe['panel'], DashboardParams.from_json(recipe['params'])
+
+
+cache_warmer = CacheWarmer()
+
+
+async def run_cache_warmer():
+    """
+    Background loop started from the app lifespan
+    """
+    while True:
+        try:
+            await cache_warmer.run_cycle()
+        except Exception as e:
+            logger.error(f"Cache warmer cycle error: {e}")
+        await asyncio.sleep(settings.WARMER_INTERVAL)
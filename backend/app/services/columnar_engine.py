@@ -0,0 +1,348 @@
+"""
+Columnar analytic engine
+Optional backend for AnalyticsService: sales, product_sales and
+item_product_sales are exported periodically to Parquet files partitioned
+by month, and the same AnalyticsService queries run on an embedded DuckDB
+over those files.
+
+- ParquetExporter: writes a consistent snapshot, then swaps it in
+- DuckDBSession: Session-like adapter that translates the service SQL
+- ColumnarAnalyticsService: AnalyticsService answering from the snapshot
+
+Selected with ANALYTIC_ENGINE=duckdb or per request (`engine=duckdb`).
+Needs `pip install duckdb`; without it (or before the first snapshot)
+requests fall back to PostgreSQL.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from collections import namedtuple
+from datetime import datetime
+from typing import Optional, Dict, List, Any
+import asyncio
+import logging
+import os
+import re
+import shutil
+
+import pandas as pd
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from .analytics_service import AnalyticsService, PERIOD_FORMATS
+
+logger = logging.getLogger(__name__)
+
+# Dependência opcional
+try:
+    import duckdb
+except ImportError:  # pragma: no cover
+    duckdb = None
+
+# Arbitrary constant used with pg_try_advisory_xact_lock so only one worker
+# exports at a time
+EXPORT_LOCK_KEY = 720_410_002
+
+SNAPSHOT_DIR = "current"
+
+# Tabela -> SELECT exportado (com a coluna "month" usada no particionamento)
+FACT_TABLES = {
+    "sales": """
+        SELECT s.*, TO_CHAR(s.created_at, 'YYYY-MM') AS month
+        FROM sales s
+    """,
+    "product_sales": """
+        SELECT ps.id, ps.sale_id, ps.product_id, ps.quantity, ps.base_price,
+               ps.total_price, ps.observations,
+               COALESCE(ps.sale_created_at, s.created_at) AS sale_created_at,
+               TO_CHAR(s.created_at, 'YYYY-MM') AS month
+        FROM product_sales ps
+        JOIN sales s ON s.id = ps.sale_id
+    """,
+    "item_product_sales": """
+        SELECT ips.*, TO_CHAR(s.created_at, 'YYYY-MM') AS month
+        FROM item_product_sales ips
+        JOIN product_sales ps ON ps.id = ips.product_sale_id
+        JOIN sales s ON s.id = ps.sale_id
+    """,
+}
+
+# Small tables joined by the queries, exported whole
+DIMENSION_TABLES = ["products", "categories", "channels", "stores"]
+
+# PostgreSQL type OID -> pandas dtype, so every chunk is written with the
+# same Parquet schema (a chunk whose column is all NULL would otherwise be
+# inferred as another type)
+PG_DTYPES = {
+    16: "boolean",
+    20: "Int64", 21: "Int64", 23: "Int64",
+    700: "float64", 701: "float64", 1700: "float64",
+    25: "string", 1042: "string", 1043: "string",
+    1082: "datetime64[ns]", 1114: "datetime64[ns]",
+}
+
+# TO_CHAR format -> strftime format (see analytics_service.PERIOD_FORMATS)
+STRFTIME_FORMATS = {
+    fmt: fmt.replace("YYYY", "%Y").replace("MM", "%m").replace("DD", "%d").replace("HH24", "%H")
+    for fmt in PERIOD_FORMATS.values()
+}
+
+_PARAM = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+_TO_CHAR = re.compile(r"TO_CHAR\((.+?), '([^']*)'\)")
+
+
+def snapshot_path(base_dir: Optional[str] = None) -> str:
+    return os.path.join(base_dir or settings.PARQUET_DIR, SNAPSHOT_DIR)
+
+
+def columnar_ready(base_dir: Optional[str] = None) -> bool:
+    """DuckDB installed and a snapshot already exported"""
+    return duckdb is not None and os.path.isdir(os.path.join(snapshot_path(base_dir), "sales"))
+
+
+def translate_sql(query: str, params: Optional[Dict[str, Any]] = None):
+    """
+    PostgreSQL text() statement -> DuckDB statement. Named params become
+    $name (only the ones the statement uses are passed on) and TO_CHAR
+    becomes strftime.
+    """
+    def to_strftime(match):
+        fmt = match.group(2)
+        return f"strftime({match.group(1)}, '{STRFTIME_FORMATS.get(fmt, fmt)}')"
+
+    query = _TO_CHAR.sub(to_strftime, query)
+    used = set(_PARAM.findall(query))
+    query = _PARAM.sub(r"$\1", query)
+    return query, {k: v for k, v in (params or {}).items() if k in used}
+
+
+class DuckDBResult:
+    """The subset of SQLAlchemy's Result used by AnalyticsService"""
+
+    def __init__(self, columns: List[str], rows: List[tuple]):
+        self.columns = columns
+        self.rows = rows
+        self.Row = namedtuple("Row", columns, rename=True)
+
+    def fetchall(self):
+        return [self.Row(*row) for row in self.rows]
+
+    def first(self):
+        return self.Row(*self.rows[0]) if self.rows else None
+
+    def scalar(self):
+        return self.rows[0][0] if self.rows else None
+
+    def mappings(self):
+        return DuckDBMappings(self)
+
+
+class DuckDBMappings:
+    def __init__(self, result: DuckDBResult):
+        self.result = result
+
+    def fetchall(self):
+        return [dict(zip(self.result.columns, row)) for row in self.result.rows]
+
+    def first(self):
+        rows = self.fetchall()
+        return rows[0] if rows else None
+
+
+class DuckDBSession:
+    """
+    Stands in for the SQLAlchemy Session given to AnalyticsService: an
+    in-memory DuckDB connection with one view per exported table
+    """
+
+    def __init__(self, base_dir: Optional[str] = None):
+        if duckdb is None:
+            raise RuntimeError("duckdb is not installed")
+        self.path = snapshot_path(base_dir)
+        self.conn = duckdb.connect()
+        for table in FACT_TABLES:
+            files = os.path.join(self.path, table, "*", "*.parquet")
+            self.conn.execute(
+                f"CREATE VIEW {table} AS SELECT * EXCLUDE (month) "
+                f"FROM read_parquet('{files}', hive_partitioning = true)"
+            )
+        for table in DIMENSION_TABLES:
+            self.conn.execute(
+                f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{os.path.join(self.path, table + '.parquet')}')"
+            )
+
+    def execute(self, statement, params: Optional[Dict[str, Any]] = None) -> DuckDBResult:
+        query, bound = translate_sql(str(statement), params)
+        cursor = self.conn.execute(query, bound)
+        columns = [d[0] for d in cursor.description]
+        return DuckDBResult(columns, cursor.fetchall())
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.conn.close()
+
+
+class ColumnarAnalyticsService(AnalyticsService):
+    """
+    AnalyticsService over the Parquet snapshot. Scans raw sales (columnar
+    scans make the hourly rollup unnecessary, and it isn't exported).
+    """
+
+    use_rollup = False
+
+    def __init__(self, base_dir: Optional[str] = None):
+        super().__init__(DuckDBSession(base_dir))
+
+    def get_business_insights(self, store_id):
+        # Precomputed rows in PostgreSQL: a key lookup, nothing to scan here
+        db = SessionLocal()
+        try:
+            return AnalyticsService(db).get_business_insights(store_id)
+        finally:
+            db.close()
+
+    def close(self):
+        self.db.close()
+
+
+def run_columnar(method: str, *args, **kwargs):
+    """Run one AnalyticsService method on the snapshot (blocking)"""
+    service = ColumnarAnalyticsService()
+    try:
+        return getattr(service, method)(*args, **kwargs)
+    finally:
+        service.close()
+
+
+class ParquetExporter:
+    """
+    Full export of the fact tables (partitioned by month) and the
+    dimension tables into a new directory, read in a single REPEATABLE READ
+    transaction so the files are consistent with each other, then swapped
+    with the current snapshot.
+    """
+
+    def __init__(self, db: Session, base_dir: Optional[str] = None):
+        self.db = db
+        self.base_dir = base_dir or settings.PARQUET_DIR
+
+    def export(self) -> Dict[str, int]:
+        if duckdb is None:
+            logger.warning("duckdb not installed, Parquet export skipped")
+            return {}
+
+        os.makedirs(self.base_dir, exist_ok=True)
+        staging = os.path.join(self.base_dir, f".staging-{datetime.now():%Y%m%d%H%M%S%f}")
+        counts = {}
+        conn = duckdb.connect()
+        try:
+            self.db.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+            locked = self.db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"),
+                {"key": EXPORT_LOCK_KEY}
+            ).scalar()
+            if not locked:
+                logger.info("Parquet export already running in another worker")
+                return {}
+
+            for table, query in FACT_TABLES.items():
+                counts[table] = self._export_fact(conn, table, query, staging)
+            for table in DIMENSION_TABLES:
+                counts[table] = self._export_dimension(conn, table, staging)
+
+            self.db.commit()
+            self._swap(staging)
+            logger.info(f"🧊 Parquet snapshot exported: {counts}")
+            return counts
+
+        except Exception:
+            self.db.rollback()
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        finally:
+            conn.close()
+
+    def _dtypes(self, query: str) -> Dict[str, str]:
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.execute(f"SELECT * FROM ({query}) q LIMIT 0")
+            return {c.name: PG_DTYPES[c.type_code] for c in cursor.description if c.type_code in PG_DTYPES}
+        finally:
+            cursor.close()
+
+    def _frames(self, query: str, chunksize: Optional[int] = None):
+        dtypes = self._dtypes(query)
+        connection = self.db.connection().execution_options(stream_results=True)
+        frames = pd.read_sql(text(query), connection, chunksize=chunksize)
+        if chunksize is None:
+            frames = [frames]
+        for frame in frames:
+            yield frame.astype(dtypes)
+
+    def _export_fact(self, conn, table: str, query: str, staging: str) -> int:
+        target = os.path.join(staging, table)
+        rows = 0
+        for i, chunk in enumerate(self._frames(query, settings.PARQUET_EXPORT_CHUNK_ROWS)):
+            conn.register("chunk", chunk)
+            conn.execute(f"""
+                COPY chunk TO '{target}'
+                (FORMAT PARQUET, PARTITION_BY (month), FILENAME_PATTERN 'part{i}_{{i}}',
+                 OVERWRITE_OR_IGNORE true)
+            """)
+            conn.unregister("chunk")
+            rows += len(chunk)
+
+        if rows == 0:
+            # Keep the schema readable even when the table is empty
+            empty = next(self._frames(f"SELECT * FROM ({query}) q LIMIT 0"))
+            os.makedirs(os.path.join(target, "month=0000-00"), exist_ok=True)
+            conn.register("chunk", empty)
+            conn.execute(f"COPY (SELECT * EXCLUDE (month) FROM chunk) TO "
+                         f"'{os.path.join(target, 'month=0000-00', 'empty.parquet')}' (FORMAT PARQUET)")
+            conn.unregister("chunk")
+        return rows
+
+    def _export_dimension(self, conn, table: str, staging: str) -> int:
+        frame = next(self._frames(f"SELECT * FROM {table}"))
+        conn.register("chunk", frame)
+        conn.execute(f"COPY chunk TO '{os.path.join(staging, table + '.parquet')}' (FORMAT PARQUET)")
+        conn.unregister("chunk")
+        return len(frame)
+
+    def _swap(self, staging: str):
+        # The previous snapshot is kept until the next export, so queries
+        # already reading it finish normally
+        current = snapshot_path(self.base_dir)
+        previous = current + ".old"
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.isdir(current):
+            os.rename(current, previous)
+        os.rename(staging, current)
+
+
+def export_snapshot_once() -> Dict[str, int]:
+    """Run one export with its own session"""
+    db = SessionLocal()
+    try:
+        return ParquetExporter(db).export()
+    except Exception as e:
+        logger.error(f"Parquet export error: {e}")
+        return {}
+    finally:
+        db.close()
+
+
+async def run_parquet_exporter():
+    """
+    Background loop started from the app lifespan
+    """
+    while True:
+        await asyncio.to_thread(export_snapshot_once)
+        await asyncio.sleep(settings.PARQUET_EXPORT_INTERVAL)
+
+
+if __name__ == "__main__":
+    # python -m app.services.columnar_engine
+    print(export_snapshot_once())
@@ -0,0 +1,303 @@
+"""
+Index advisor
+Managed index set for the query shapes AnalyticsService issues, plus a
+tool that replays every AnalyticsService query under
+EXPLAIN (ANALYZE, BUFFERS) and reports sequential scans and the columns
+that are filtered without a usable index.
+
+    python -m app.services.index_advisor            # report
+    python -m app.services.index_advisor --apply    # create/drop indexes, then report
+"""
+
+from sqlalchemy import event, text
+from typing import List, Dict, Any, Tuple, Optional, Callable
+import json
+import logging
+import re
+
+from ..core.config import settings
+from ..core.database import engine, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# (nome, tabela, DDL) - all queries filter sales by half-open created_at
+# ranges, so the range column leads and the aggregated columns ride along
+MANAGED_INDEXES: List[Tuple[str, str, str]] = [
+    ("idx_sales_created_covering", "sales",
+     "CREATE INDEX IF NOT EXISTS idx_sales_created_covering ON sales(created_at) "
+     "INCLUDE (total_amount, channel_id, store_id, customer_id)"),
+    # Tiny index for wide scans: sales are inserted in created_at order
+    ("idx_sales_created_brin", "sales",
+     "CREATE INDEX IF NOT EXISTS idx_sales_created_brin ON sales "
+     "USING BRIN (created_at) WITH (pages_per_range = 32)"),
+    ("idx_sales_store_created_covering", "sales",
+     "CREATE INDEX IF NOT EXISTS idx_sales_store_created_covering ON sales(store_id, created_at) "
+     "INCLUDE (total_amount, channel_id, customer_id)"),
+    ("idx_product_sales_sale_covering", "product_sales",
+     "CREATE INDEX IF NOT EXISTS idx_product_sales_sale_covering ON product_sales(sale_id) "
+     "INCLUDE (product_id, quantity, total_price, base_price)"),
+    ("idx_product_sales_product_sale", "product_sales",
+     "CREATE INDEX IF NOT EXISTS idx_product_sales_product_sale ON product_sales(product_id, sale_id)"),
+]
+
+# Indexes no query can use (DATE(created_at) never matches a created_at range)
+# or superseded by a managed one (idx_sales_store_created had no INCLUDE, and
+# IF NOT EXISTS would keep it as is under the same name)
+OBSOLETE_INDEXES = ["idx_sales_date_status", "idx_sales_store_created"]
+
+# Seq scans on tables smaller than this are fine (channels, stores...)
+SEQ_SCAN_MIN_ROWS = 1000
+
+
+# ===== Índices gerenciados =====
+
+def apply_indexes(concurrently: bool = True) -> Dict[str, List[str]]:
+    """
+    Create the managed indexes and drop the obsolete ones. CONCURRENTLY
+    (the default) doesn't block writes but can't run on a partitioned
+    parent, so those are created normally. Indexes already in place are
+    reported as existing, not created.
+    """
+    summary = {"created": [], "existing": [], "dropped": []}
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        partitioned = {
+            r.relname for r in conn.execute(text(
+                "SELECT c.relname FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid"
+            ))
+        }
+        existing = {
+            r.indexname for r in conn.execute(text(
+                "SELECT indexname FROM pg_indexes WHERE schemaname = 'public'"
+            ))
+        }
+        for name in OBSOLETE_INDEXES:
+            if name in existing:
+                conn.execute(text(f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {name}"))
+                summary["dropped"].append(name)
+
+        for name, table, ddl in MANAGED_INDEXES:
+            if name in existing:
+                summary["existing"].append(name)
+                continue
+            if concurrently and table not in partitioned:
+                ddl = ddl.replace("CREATE INDEX IF NOT EXISTS", "CREATE INDEX CONCURRENTLY IF NOT EXISTS", 1)
+            conn.execute(text(ddl))
+            summary["created"].append(name)
+
+    logger.info(f"🗂️ Indexes applied: {summary}")
+    return summary
+
+
+# ===== Captura das queries =====
+
+def prepare_state() -> Dict[str, Any]:
+    """
+    Bring up the rollup, the customer sketches and the in-memory cube the
+    way the API does at startup, so the workload issues the queries
+    production runs (rollup reads, sketch merges) instead of raw-sales
+    fallbacks
+    """
+    # Import tardio: customer_sketches -> partition_manager -> index_advisor
+    from .rollup_service import refresh_rollup_once
+    from .customer_sketches import refresh_sketches_once
+    from .sales_cube import refresh_cube_once
+
+    state = {}
+    if settings.ROLLUP_ENABLED:
+        state["rollup"] = refresh_rollup_once()
+        if settings.CUBE_ENABLED:
+            state["cube_days"] = refresh_cube_once(full=True)
+    if settings.HLL_ENABLED:
+        state["sketches"] = refresh_sketches_once()
+    logger.info(f"🗂️ Advisor state: {state}")
+    return state
+
+
+def default_workload(service) -> List[Tuple[str, Callable[[], Any]]]:
+    """
+    Every AnalyticsService method with the dashboard's default arguments,
+    plus filter combinations the cube can't answer (rollup slices) and one
+    that only raw sales can (categories)
+    """
+    product = service.db.execute(text("SELECT id FROM products ORDER BY id LIMIT 1")).first()
+    store = service.db.execute(text("SELECT id FROM stores ORDER BY id LIMIT 1")).first()
+    store_id = store.id if store else None
+
+    workload = [
+        ("overview", lambda: service.get_overview_metrics(None, None, None)),
+        ("overview (store)", lambda: service.get_overview_metrics(None, None, store_id)),
+        ("overview (ifood, evening)", lambda: service.get_overview_metrics(
+            None, None, None, filters={'channels': ['ifood'], 'time_of_day': ['evening']})),
+        ("overview (category, raw sales)", lambda: service.get_overview_metrics(
+            None, None, None, filters={'categories': ['bebidas']})),
+        ("overview (exact customers)", lambda: service.get_overview_metrics(None, None, None, exact=True)),
+        ("top_products", lambda: service.get_top_products(None, None, None, 10)),
+        ("channels", lambda: service.get_channels_performance(None, None)),
+        ("insights", lambda: service.get_business_insights(None)),
+        ("products_list", lambda: service.get_products_list(store_id)),
+        ("timeline compare", lambda: service.get_timeline_data(None, None, None, "day", compare=True)),
+    ]
+    for granularity in ("hour", "day", "week", "month"):
+        workload.append((f"timeline {granularity}",
+                         lambda g=granularity: service.get_timeline_data(None, None, store_id, g)))
+    if product:
+        workload.append(("product_timeline",
+                         lambda: service.get_product_timeline(product.id, None, None)))
+    return workload
+
+
+def capture_queries(workload) -> List[Dict[str, Any]]:
+    """Run the workload and record each SELECT with its driver parameters"""
+    captured = []
+    current = {"label": None}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            captured.append({"label": current["label"], "statement": statement, "parameters": parameters})
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        for label, run in workload:
+            current["label"] = label
+            run()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return captured
+
+
+def explain(conn, statement: str, parameters) -> Dict[str, Any]:
+    row = conn.exec_driver_sql(
+        "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters
+    ).first()
+    plan = row[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]
+
+
+# ===== Análise do plano =====
+
+def _walk(node: Dict[str, Any]):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def analyze_plan(plan: Dict[str, Any], min_rows: int = SEQ_SCAN_MIN_ROWS) -> Dict[str, Any]:
+    """
+    Summary of one EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) plan: timings,
+    buffers, and the sequential scans reading at least `min_rows` rows
+    """
+    root = plan["Plan"]
+    seq_scans = []
+    for node in _walk(root):
+        if node.get("Node Type") != "Seq Scan":
+            continue
+        loops = node.get("Actual Loops", 1) or 1
+        read = (node.get("Actual Rows", 0) + node.get("Rows Removed by Filter", 0)) * loops
+        if read < min_rows:
+            continue
+        seq_scans.append({
+            "relation": node.get("Relation Name"),
+            "rows_read": read,
+            "rows_returned": node.get("Actual Rows", 0) * loops,
+            "filter": node.get("Filter"),
+        })
+
+    return {
+        "execution_ms": plan.get("Execution Time"),
+        "planning_ms": plan.get("Planning Time"),
+        "shared_hit": root.get("Shared Hit Blocks", 0),
+        "shared_read": root.get("Shared Read Blocks", 0),
+        "seq_scans": seq_scans,
+    }
+
+
+def filtered_columns(filter_text: Optional[str], columns: List[str]) -> List[str]:
+    """Columns of the scanned table that appear in a plan's Filter, in order"""
+    if not filter_text:
+        return []
+    found = []
+    for token in re.findall(r"[a-z_][a-z0-9_]*", filter_text.lower()):
+        if token in columns and token not in found:
+            found.append(token)
+    return found
+
+
+def suggest_indexes(report: Dict[str, Any], table_columns: Dict[str, List[str]],
+                    leading_columns: Dict[str, set]) -> List[str]:
+    """Filtered columns of seq-scanned tables that lead no existing index"""
+    suggestions = []
+    for scan in report["seq_scans"]:
+        table = scan["relation"]
+        columns = filtered_columns(scan["filter"], table_columns.get(table, []))
+        missing = [c for c in columns if c not in leading_columns.get(table, set())]
+        if missing:
+            suggestions.append(f"CREATE INDEX ON {table}({', '.join(missing)})")
+    return suggestions
+
+
+def _catalog(conn) -> Tuple[Dict[str, List[str]], Dict[str, set]]:
+    table_columns: Dict[str, List[str]] = {}
+    for r in conn.execute(text("""
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = 'public'
+    """)):
+        table_columns.setdefault(r.table_name, []).append(r.column_name)
+
+    leading_columns: Dict[str, set] = {}
+    for r in conn.execute(text("""
+        SELECT t.relname AS table_name, a.attname AS column_name
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0]
+    """)):
+        leading_columns.setdefault(r.table_name, set()).add(r.column_name)
+    return table_columns, leading_columns
+
+
+def run_advisor() -> List[Dict[str, Any]]:
+    """EXPLAIN every query of the default workload and print a report"""
+    # Import tardio: analytics_service -> partition_manager -> index_advisor
+    from .analytics_service import AnalyticsService
+
+    prepare_state()
+    db = SessionLocal()
+    try:
+        queries = capture_queries(default_workload(AnalyticsService(db)))
+    finally:
+        db.close()
+
+    reports = []
+    with engine.connect() as conn:
+        table_columns, leading_columns = _catalog(conn)
+        for query in queries:
+            try:
+                report = analyze_plan(explain(conn, query["statement"], query["parameters"]))
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"EXPLAIN failed for {query['label']}: {e}")
+                continue
+            report["label"] = query["label"]
+            report["suggestions"] = suggest_indexes(report, table_columns, leading_columns)
+            reports.append(report)
+        conn.rollback()
+
+    for report in reports:
+        flag = "⚠️ " if report["seq_scans"] else "✅"
+        print(f"{flag} {report['label']}: {report['execution_ms']}ms "
+              f"(buffers hit={report['shared_hit']} read={report['shared_read']})")
+        for scan in report["seq_scans"]:
+            print(f"    Seq Scan on {scan['relation']}: {scan['rows_read']} rows read, "
+                  f"{scan['rows_returned']} kept, filter: {scan['filter']}")
+        for suggestion in report["suggestions"]:
+            print(f"    suggestion: {suggestion}")
+    return reports
+
+
+if __name__ == "__main__":
+    import sys
+
+    if "--apply" in sys.argv:
+        apply_indexes(concurrently="--blocking" not in sys.argv)
+    run_advisor()
@@ -0,0 +1,390 @@
+"""
+Business insights engine
+Runs on a schedule over the sales rollup and stores ready-made
+schemas.Insight lists in business_insights (one row per store, 0 = all
+stores), so /insights is a primary-key lookup.
+
+Detectors:
+- revenue / order anomalies: z-score of the last complete day against the
+  same weekday of the previous weeks (restaurant sales are strongly
+  weekly, so this removes the seasonal part before scoring)
+- channels whose weekly average ticket trends down
+- products whose units sold in the last week dropped well below their
+  usual daily rate
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from datetime import datetime, date, timedelta
+from typing import Optional, Dict, List, Any, Tuple
+import asyncio
+import json
+import logging
+
+import numpy as np
+
+from ..core.cache import cache
+from ..core.config import settings
+from ..core.database import SessionLocal
+from .partition_manager import partition_state
+from .rollup_service import pick_sales_source
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary constant used with pg_try_advisory_xact_lock so only one worker
+# recomputes the insights at a time
+INSIGHTS_LOCK_KEY = 720_410_003
+
+ALL_STORES = 0
+
+INSIGHTS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS business_insights (
+        store_id INTEGER PRIMARY KEY,
+        payload JSONB NOT NULL,
+        computed_at TIMESTAMP NOT NULL
+    )
+    """,
+]
+
+PRIORITY_ORDER = {"high": 0, "medium": 1, "low": 2}
+
+
+# ===== Detectores (funções puras) =====
+
+def weekday_zscore(values: List[float], weeks: int) -> Optional[Tuple[float, float]]:
+    """
+    (z, baseline mean) of the last value of a daily series against the
+    same weekday of the `weeks` previous weeks; None without enough history
+    or when the baseline doesn't vary
+    """
+    series = np.asarray(values, dtype=float)
+    baseline = series[-8::-7][:weeks]
+    if len(baseline) < 3:
+        return None
+    std = baseline.std(ddof=1)
+    if std == 0:
+        return None
+    mean = baseline.mean()
+    return float((series[-1] - mean) / std), float(mean)
+
+
+def ticket_trend(orders: List[float], revenue: List[float]) -> Optional[Tuple[float, float, float]]:
+    """
+    Weekly ticket trend: (relative change over the span of the fitted line,
+    first week ticket, last week ticket); None with fewer than 3 weeks with
+    orders
+    """
+    orders = np.asarray(orders, dtype=float)
+    revenue = np.asarray(revenue, dtype=float)
+    valid = orders > 0
+    if valid.sum() < 3:
+        return None
+    weeks = np.arange(len(orders))[valid]
+    tickets = revenue[valid] / orders[valid]
+    slope, intercept = np.polyfit(weeks, tickets, 1)
+    first = intercept + slope * weeks[0]
+    last = intercept + slope * weeks[-1]
+    if first <= 0:
+        return None
+    return float((last - first) / first), float(tickets[0]), float(tickets[-1])
+
+
+def product_drop(recent_units: float, baseline_units: float, recent_days: int,
+                 baseline_days: int) -> Optional[Tuple[float, float]]:
+    """
+    (relative change, z) of the units sold in the recent window against the
+    expected units at the baseline daily rate (Poisson z-score)
+    """
+    expected = baseline_units / baseline_days * recent_days
+    if expected <= 0:
+        return None
+    return (recent_units - expected) / expected, (recent_units - expected) / float(np.sqrt(expected))
+
+
+def _severity(z: float) -> str:
+    return "high" if abs(z) >= settings.INSIGHTS_Z_THRESHOLD + 1 else "medium"
+
+
+def series_insights(day: date, orders: List[float], revenue: List[float]) -> List[Dict[str, Any]]:
+    """Revenue and order anomalies for the last day of the series"""
+    insights = []
+    weeks = settings.INSIGHTS_BASELINE_WEEKS
+    for label, values in (("Faturamento", revenue), ("Pedidos", orders)):
+        scored = weekday_zscore(values, weeks)
+        if scored is None:
+            continue
+        z, mean = scored
+        if abs(z) < settings.INSIGHTS_Z_THRESHOLD:
+            continue
+        current = values[-1]
+        change = (current - mean) / mean * 100 if mean else 0.0
+        metric = {"current": round(float(current), 2), "previous": round(mean, 2)}
+        if label == "Pedidos":
+            metric["orders"] = int(current)
+        if z < 0:
+            insights.append({
+                "type": "warning", "priority": _severity(z),
+                "title": f"📉 {label} abaixo do normal em {day:%d/%m}",
+                "description": f"{label} {change:+.1f}% vs. média das últimas {weeks} semanas "
+                               f"no mesmo dia da semana (z={z:.1f})",
+                "metric": metric,
+                "action": "Verifique operação, estoque e canais nesse dia",
+            })
+        else:
+            insights.append({
+                "type": "success", "priority": _severity(z),
+                "title": f"📈 {label} acima do normal em {day:%d/%m}",
+                "description": f"{label} {change:+.1f}% vs. média das últimas {weeks} semanas "
+                               f"no mesmo dia da semana (z={z:.1f})",
+                "metric": metric,
+                "action": "Identifique o que funcionou e repita",
+            })
+    return insights
+
+
+def channel_insights(channels: Dict[str, Tuple[List[float], List[float]]]) -> List[Dict[str, Any]]:
+    """Channels whose weekly average ticket is falling"""
+    insights = []
+    for name, (orders, revenue) in sorted(channels.items()):
+        trend = ticket_trend(orders, revenue)
+        if trend is None:
+            continue
+        change, first, last = trend
+        if change > -settings.INSIGHTS_TICKET_DROP:
+            continue
+        insights.append({
+            "type": "warning",
+            "priority": "high" if change <= -2 * settings.INSIGHTS_TICKET_DROP else "medium",
+            "title": f"🎟️ Ticket médio caindo no {name}",
+            "description": f"Ticket médio {change * 100:+.1f}% nas últimas {len(orders)} semanas "
+                           f"(R$ {first:.2f} → R$ {last:.2f})",
+            "metric": {"current": round(last, 2), "previous": round(first, 2), "avg_ticket": round(last, 2),
+                       "orders": int(orders[-1])},
+            "action": "Revise combos, upsell e taxa de entrega do canal",
+        })
+    return insights
+
+
+def product_insights(products: List[Tuple[str, float, float]]) -> List[Dict[str, Any]]:
+    """Products that sold far below their usual rate in the recent window"""
+    recent_days = settings.INSIGHTS_PRODUCT_RECENT_DAYS
+    baseline_days = settings.INSIGHTS_PRODUCT_BASELINE_DAYS
+    drops = []
+    for name, recent, baseline in products:
+        scored = product_drop(recent, baseline, recent_days, baseline_days)
+        if scored is None:
+            continue
+        change, z = scored
+        if z <= -settings.INSIGHTS_Z_THRESHOLD and change <= -settings.INSIGHTS_PRODUCT_DROP:
+            drops.append((z, change, name, recent, baseline / baseline_days * recent_days))
+
+    insights = []
+    for z, change, name, recent, expected in sorted(drops)[:settings.INSIGHTS_MAX_PRODUCTS]:
+        insights.append({
+            "type": "warning", "priority": _severity(z),
+            "title": f"🍔 Queda nas vendas de {name}",
+            "description": f"{int(recent)} unidades nos últimos {recent_days} dias, "
+                           f"{change * 100:+.0f}% vs. o ritmo normal ({expected:.0f})",
+            "metric": {"current": float(recent), "previous": round(expected, 2)},
+            "action": "Confira disponibilidade, preço e exposição no cardápio",
+        })
+    return insights
+
+
+def rank(insights: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return sorted(insights, key=lambda i: PRIORITY_ORDER.get(i["priority"], 3))[:settings.INSIGHTS_MAX]
+
+
+# ===== Engine =====
+
+class InsightsEngine:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def ensure_schema(self):
+        for ddl in INSIGHTS_DDL:
+            self.db.execute(text(ddl))
+        self.db.commit()
+
+    def anchor_day(self) -> Optional[date]:
+        """Last complete day with sales (today is still partial)"""
+        source = pick_sales_source()
+        last = self.db.execute(text(f"SELECT MAX({source.time_column}) FROM {source.table}")).scalar()
+        if last is None:
+            return None
+        day = last.date()
+        return day - timedelta(days=1) if day >= date.today() else day
+
+    def compute(self) -> Dict[int, List[Dict[str, Any]]]:
+        """Insight list per store id (ALL_STORES = every store)"""
+        anchor = self.anchor_day()
+        if anchor is None:
+            return {ALL_STORES: []}
+
+        insights: Dict[int, List[Dict[str, Any]]] = {ALL_STORES: []}
+        for store_id, items in self._series(anchor).items():
+            insights.setdefault(store_id, []).extend(items)
+        for store_id, items in self._channels(anchor).items():
+            insights.setdefault(store_id, []).extend(items)
+        for store_id, items in self._products(anchor).items():
+            insights.setdefault(store_id, []).extend(items)
+        return {store_id: rank(items) for store_id, items in insights.items()}
+
+    def _daily(self, anchor: date, days: int):
+        source = pick_sales_source()
+        return self.db.execute(
+            text(f"""
+                SELECT DATE({source.time_column}) AS day, s.store_id, s.channel_id,
+                       {source.orders} AS orders, COALESCE({source.revenue}, 0) AS revenue
+                FROM {source.table}
+                WHERE {source.time_column} >= :start AND {source.time_column} < :end
+                GROUP BY 1, 2, 3
+            """),
+            {"start": anchor - timedelta(days=days - 1), "end": anchor + timedelta(days=1)}
+        ).fetchall()
+
+    def _series(self, anchor: date) -> Dict[int, List[Dict[str, Any]]]:
+        days = settings.INSIGHTS_BASELINE_WEEKS * 7 + 1
+        start = anchor - timedelta(days=days - 1)
+        orders: Dict[int, np.ndarray] = {}
+        revenue: Dict[int, np.ndarray] = {}
+        for r in self._daily(anchor, days):
+            index = (r.day - start).days
+            for store_id in (ALL_STORES, r.store_id):
+                orders.setdefault(store_id, np.zeros(days))[index] += float(r.orders or 0)
+                revenue.setdefault(store_id, np.zeros(days))[index] += float(r.revenue or 0)
+        return {
+            store_id: series_insights(anchor, list(orders[store_id]), list(revenue[store_id]))
+            for store_id in orders
+        }
+
+    def _channels(self, anchor: date) -> Dict[int, List[Dict[str, Any]]]:
+        weeks = settings.INSIGHTS_TICKET_WEEKS
+        start = anchor - timedelta(days=weeks * 7 - 1)
+        names = {r.id: r.name for r in self.db.execute(text("SELECT id, name FROM channels")).fetchall()}
+        # (loja, canal) -> pedidos/faturamento por semana terminando no anchor
+        weekly: Dict[Tuple[int, str], Tuple[np.ndarray, np.ndarray]] = {}
+        for r in self._daily(anchor, weeks * 7):
+            week = (r.day - start).days // 7
+            name = names.get(r.channel_id, str(r.channel_id))
+            for store_id in (ALL_STORES, r.store_id):
+                orders, revenue = weekly.setdefault((store_id, name), (np.zeros(weeks), np.zeros(weeks)))
+                orders[week] += float(r.orders or 0)
+                revenue[week] += float(r.revenue or 0)
+
+        by_store: Dict[int, Dict[str, Tuple[List[float], List[float]]]] = {}
+        for (store_id, name), (orders, revenue) in weekly.items():
+            by_store.setdefault(store_id, {})[name] = (list(orders), list(revenue))
+        return {store_id: channel_insights(channels) for store_id, channels in by_store.items()}
+
+    def _products(self, anchor: date) -> Dict[int, List[Dict[str, Any]]]:
+        recent_days = settings.INSIGHTS_PRODUCT_RECENT_DAYS
+        baseline_days = settings.INSIGHTS_PRODUCT_BASELINE_DAYS
+        end = anchor + timedelta(days=1)
+        split = end - timedelta(days=recent_days)
+        start = split - timedelta(days=baseline_days)
+        pruning = ""
+        if partition_state.product_sales:
+            pruning = "AND ps.sale_created_at >= :start AND ps.sale_created_at < :end"
+        rows = self.db.execute(
+            text(f"""
+                SELECT s.store_id, p.name,
+                       COALESCE(SUM(ps.quantity) FILTER (WHERE s.created_at >= :split), 0) AS recent,
+                       COALESCE(SUM(ps.quantity) FILTER (WHERE s.created_at < :split), 0) AS baseline
+                FROM product_sales ps
+                JOIN sales s ON s.id = ps.sale_id
+                JOIN products p ON p.id = ps.product_id
+                WHERE s.created_at >= :start AND s.created_at < :end
+                {pruning}
+                GROUP BY s.store_id, p.name
+            """),
+            {"start": start, "split": split, "end": end}
+        ).fetchall()
+
+        totals: Dict[int, Dict[str, List[float]]] = {}
+        for r in rows:
+            for store_id in (ALL_STORES, r.store_id):
+                counts = totals.setdefault(store_id, {}).setdefault(r.name, [0.0, 0.0])
+                counts[0] += float(r.recent)
+                counts[1] += float(r.baseline)
+        return {
+            store_id: product_insights([(name, recent, baseline) for name, (recent, baseline) in products.items()])
+            for store_id, products in totals.items()
+        }
+
+    def save(self, insights: Dict[int, List[Dict[str, Any]]]):
+        """Replace every stored list in one transaction"""
+        self.db.execute(text("DELETE FROM business_insights"))
+        computed_at = datetime.utcnow()
+        for store_id, items in insights.items():
+            self.db.execute(
+                text("""
+                    INSERT INTO business_insights (store_id, payload, computed_at)
+                    VALUES (:store_id, CAST(:payload AS JSONB), :computed_at)
+                """),
+                {"store_id": store_id, "payload": json.dumps(items), "computed_at": computed_at}
+            )
+
+    def run(self) -> Dict[str, Any]:
+        try:
+            locked = self.db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"),
+                {"key": INSIGHTS_LOCK_KEY}
+            ).scalar()
+            if not locked:
+                self.db.rollback()
+                return {"status": "skipped"}
+
+            insights = self.compute()
+            self.save(insights)
+            self.db.commit()
+            # Cached /insights responses are older than the new rows
+            cache.invalidate_tags(["endpoint:insights"])
+            total = sum(len(items) for items in insights.values())
+            logger.info(f"💡 Insights computed: {total} for {len(insights)} scopes")
+            return {"status": "ok", "scopes": len(insights), "insights": total}
+
+        except Exception:
+            self.db.rollback()
+            raise
+
+
+def load_insights(db: Session, store_id: Optional[int]) -> Optional[Dict[str, Any]]:
+    """Stored insights for one store (None = all stores); None if never computed"""
+    row = db.execute(
+        text("SELECT payload, computed_at FROM business_insights WHERE store_id = :store_id"),
+        {"store_id": store_id if store_id is not None else ALL_STORES}
+    ).first()
+    if row is None:
+        return None
+    payload = row.payload if isinstance(row.payload, list) else json.loads(row.payload)
+    return {"insights": payload, "computed_at": row.computed_at}
+
+
+def compute_insights_once() -> Dict[str, Any]:
+    """Run one engine pass with its own session"""
+    db = SessionLocal()
+    try:
+        engine = InsightsEngine(db)
+        engine.ensure_schema()
+        return engine.run()
+    except Exception as e:
+        logger.error(f"Insights engine error: {e}")
+        return {"status": "error"}
+    finally:
+        db.close()
+
+
+async def run_insights_engine():
+    """
+    Background loop started from the app lifespan
+    """
+    while True:
+        await asyncio.to_thread(compute_insights_once)
+        await asyncio.sleep(settings.INSIGHTS_INTERVAL)
+
+
+if __name__ == "__main__":
+    # python -m app.services.insights_engine
+    print(compute_insights_once())
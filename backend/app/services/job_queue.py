@@ -0,0 +1,361 @@
+"""
+Background jobs
+Long-running work (full-history exports, retention analysis, year-long
+hourly timelines) is submitted as a job instead of being answered inside
+the HTTP request.
+
+- JobStore: SQLite table holding the queue, status, progress and result
+  path; safe to share between the API worker and the pool processes
+- run_job_dispatcher: lifespan loop claiming queued jobs and running them
+  on a ProcessPoolExecutor of JOB_WORKERS processes
+- execute_job: runs inside a pool process with its own DB connections
+
+SQLite keeps the subsystem local with no extra service to deploy; each
+API worker only runs the jobs it claimed and renews a lease on them
+every poll, so the jobs of a crashed worker are re-queued by any other
+dispatcher once the lease (JOB_LEASE_SECONDS) runs out.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from typing import Optional, Dict, Any, Callable, Tuple
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import uuid
+
+from ..core.codecs import dumps_json
+from ..core.config import settings
+from ..core.database import SessionLocal
+from .analytics_service import AnalyticsService
+from .export_service import (
+    build_export_query, estimate_export_rows, export_progress, export_to_file, make_encoder
+)
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        job_type TEXT NOT NULL,
+        params TEXT NOT NULL,
+        status TEXT NOT NULL,
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        result_path TEXT,
+        result_format TEXT,
+        error TEXT,
+        owner TEXT,
+        heartbeat_at TEXT,
+        created_at TEXT NOT NULL,
+        started_at TEXT,
+        finished_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+"""
+
+
+class JobError(Exception):
+    """Job that can't be submitted with the given type/params"""
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="milliseconds")
+
+
+class JobStore:
+    """
+    Jobs table in a SQLite file. Every call opens its own short connection,
+    so the same store works from the event loop thread and the pool
+    processes (WAL lets readers poll while a job writes progress).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.JOBS_DB_PATH
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Stores created before the lease columns existed
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column in ("owner", "heartbeat_at"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _update(self, job_id: str, **fields):
+        columns = ", ".join(f"{name} = :{name}" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = :id", {**fields, "id": job_id})
+
+    # ===== API =====
+
+    def submit(self, job_type: str, params: Dict[str, Any]) -> str:
+        if job_type not in JOB_TYPES:
+            raise JobError(f"unknown job type: {job_type}")
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, job_type, params, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, job_type, json.dumps(params), QUEUED, _now())
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    # ===== Dispatcher =====
+
+    def claim(self, owner: str) -> Optional[Dict[str, Any]]:
+        """Oldest queued job, atomically marked as running under `owner`'s lease"""
+        now = _now()
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                UPDATE jobs SET status = ?, owner = ?, started_at = ?, heartbeat_at = ?
+                WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1)
+                  AND status = ?
+                RETURNING id
+                """,
+                (RUNNING, owner, now, now, QUEUED, QUEUED)
+            ).fetchone()
+        return self.get(row["id"]) if row else None
+
+    def heartbeat(self, owner: str) -> int:
+        """Renew the lease on every job `owner` is running"""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND owner = ?",
+                (_now(), RUNNING, owner)
+            ).rowcount
+
+    def requeue(self, job_id: str):
+        self._update(job_id, status=QUEUED, owner=None, heartbeat_at=None, progress=0, message=None)
+
+    def requeue_orphans(self, lease: Optional[timedelta] = None) -> int:
+        """
+        Put back running jobs whose owner stopped renewing its lease (a
+        dead dispatcher, whatever its PID looks like now)
+        """
+        lease = lease or timedelta(seconds=settings.JOB_LEASE_SECONDS)
+        cutoff = (datetime.utcnow() - lease).isoformat(timespec="milliseconds")
+        with self._connect() as conn:
+            return conn.execute(
+                """
+                UPDATE jobs SET status = ?, owner = NULL, heartbeat_at = NULL, progress = 0, message = NULL
+                WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+                """,
+                (QUEUED, RUNNING, cutoff)
+            ).rowcount
+
+    def purge(self, older_than: timedelta) -> int:
+        """Delete finished jobs (and their result files) older than `older_than`"""
+        cutoff = (datetime.utcnow() - older_than).isoformat(timespec="milliseconds")
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, result_path FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, cutoff)
+            ).fetchall()
+            for row in rows:
+                if row["result_path"] and os.path.exists(row["result_path"]):
+                    os.remove(row["result_path"])
+                conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+        return len(rows)
+
+    # ===== Pool process =====
+
+    def set_progress(self, job_id: str, progress: float, message: Optional[str] = None):
+        self._update(job_id, progress=round(min(max(progress, 0.0), 1.0), 4), message=message)
+
+    def finish(self, job_id: str, result_path: str, result_format: str):
+        self._update(job_id, status=DONE, progress=1.0, result_path=result_path,
+                     result_format=result_format, finished_at=_now())
+
+    def fail(self, job_id: str, error: str):
+        self._update(job_id, status=FAILED, error=error, finished_at=_now())
+
+
+_store: Optional[JobStore] = None
+
+
+def get_job_store() -> JobStore:
+    """Process-wide store on JOBS_DB_PATH, created on first use"""
+    global _store
+    if _store is None:
+        _store = JobStore()
+    return _store
+
+
+# ===== Tipos de job (rodam no processo do pool) =====
+
+def _as_date(value: Optional[str]) -> Optional[date]:
+    return date.fromisoformat(value) if value else None
+
+
+def run_export_job(job: Dict[str, Any], progress: Callable[[float, Optional[str]], None]) -> str:
+    params = job["params"]
+    filters = params.get("filters") or {}
+    filters = {**filters, "start_date": _as_date(filters.get("start_date")),
+               "end_date": _as_date(filters.get("end_date"))}
+    query, query_params = build_export_query(params["export_type"], filters, params.get("granularity", "day"))
+    path = result_path(job["id"], params.get("format", "csv"))
+    expected = estimate_export_rows(query, query_params)
+    try:
+        rows = export_to_file(
+            query, query_params, make_encoder(params.get("format", "csv")), path,
+            progress=lambda written: progress(export_progress(written, expected),
+                                              f"{written} of ~{expected} rows written")
+        )
+    except Exception:
+        # Partial file of a failed job: nothing would ever purge it
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    progress(1.0, f"{rows} rows written")
+    return path
+
+
+def run_timeline_job(job: Dict[str, Any], progress: Callable[[float, Optional[str]], None]) -> Any:
+    params = job["params"]
+    db = SessionLocal()
+    try:
+        return AnalyticsService(db).get_timeline_data(
+            _as_date(params.get("start_date")), _as_date(params.get("end_date")),
+            params.get("store_id"), params.get("granularity", "day"),
+            filters=params.get("filters"), compare=params.get("compare", False)
+        )
+    finally:
+        db.close()
+
+
+def run_retention_job(job: Dict[str, Any], progress: Callable[[float, Optional[str]], None]) -> Any:
+    # Import tardio: o processador NLP mora no módulo da API
+    from ..api.nlp_processor import NaturalLanguageProcessor
+
+    db = SessionLocal()
+    try:
+        query = job["params"].get("query") or "clientes inativos"
+        return NaturalLanguageProcessor(db).analyze_customer_retention(query, job["params"].get("store_id"))
+    finally:
+        db.close()
+
+
+# Tipo -> função; exports return the path they wrote, the others a JSON-able result
+JOB_TYPES: Dict[str, Callable] = {
+    "export": run_export_job,
+    "timeline": run_timeline_job,
+    "retention": run_retention_job,
+}
+
+
+def result_path(job_id: str, extension: str) -> str:
+    os.makedirs(settings.JOB_RESULT_DIR, exist_ok=True)
+    return os.path.join(settings.JOB_RESULT_DIR, f"{job_id}.{extension}")
+
+
+def execute_job(job_id: str, store_path: Optional[str] = None):
+    """Entry point inside the pool process; never raises"""
+    store = JobStore(store_path)
+    job = store.get(job_id)
+    if job is None:
+        return
+    try:
+        handler = JOB_TYPES[job["job_type"]]
+        result = handler(job, lambda value, message=None: store.set_progress(job_id, value, message))
+        if job["job_type"] == "export":
+            store.finish(job_id, result, job["params"].get("format", "csv"))
+        else:
+            path = result_path(job_id, "json")
+            with open(path, "wb") as out:
+                out.write(dumps_json(result))
+            store.finish(job_id, path, "json")
+        logger.info(f"🧵 Job {job_id} ({job['job_type']}) done")
+    except Exception as e:
+        logger.error(f"Job {job_id} ({job['job_type']}) failed: {e}")
+        store.fail(job_id, str(e))
+
+
+# ===== Dispatcher (processo da API) =====
+
+def make_pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    # spawn: the API process has threads (pub/sub listener) and open
+    # connection pools that must not be inherited by fork
+    return ProcessPoolExecutor(
+        max_workers=workers or settings.JOB_WORKERS,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+async def run_job_dispatcher(store: Optional[JobStore] = None):
+    """
+    Background loop started from the app lifespan: keeps at most
+    JOB_WORKERS jobs running on the process pool
+    """
+    store = store or get_job_store()
+    owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    loop = asyncio.get_running_loop()
+    pool = make_pool()
+    # Bumped on every rebuild: a broken future only rebuilds the pool it ran on
+    generation = 0
+    running: Dict[asyncio.Future, Tuple[str, int]] = {}
+    last_purge = datetime.min
+    try:
+        while True:
+            await asyncio.to_thread(store.heartbeat, owner)
+            requeued = await asyncio.to_thread(store.requeue_orphans)
+            if requeued:
+                logger.warning(f"🧵 {requeued} orphaned jobs re-queued")
+
+            for future, (job_id, job_generation) in list(running.items()):
+                if not future.done():
+                    continue
+                del running[future]
+                # Cancelled by the shutdown of a broken pool before it started
+                if future.cancelled():
+                    store.requeue(job_id)
+                    continue
+                # execute_job never raises: an exception here means the
+                # pool process died (OOM kill...), which breaks the pool
+                error = future.exception()
+                if error is not None:
+                    logger.error(f"Job {job_id} lost its worker process: {error!r}")
+                    store.fail(job_id, "worker process died")
+                    if isinstance(error, BrokenProcessPool) and job_generation == generation:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = make_pool()
+                        generation += 1
+
+            while len(running) < settings.JOB_WORKERS:
+                job = await asyncio.to_thread(store.claim, owner)
+                if job is None:
+                    break
+                logger.info(f"🧵 Job {job['id']} ({job['job_type']}) started")
+                running[loop.run_in_executor(pool, execute_job, job["id"], store.path)] = (job["id"], generation)
+
+            if datetime.utcnow() - last_purge > timedelta(hours=1):
+                await asyncio.to_thread(store.purge, timedelta(seconds=settings.JOB_RESULT_TTL))
+                last_purge = datetime.utcnow()
+
+            await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
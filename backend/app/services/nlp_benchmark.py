@@ -0,0 +1,283 @@
+"""
+NLP history-length benchmark
+Regression check that natural-query answers cost the same whatever the
+length of the sales history: the SQL behind each question runs over
+synthetic, time-ordered histories of growing length in DuckDB, and the
+rows each statement reads are counted from the profiler and compared with
+the sales rows inside the date window the statements ask for.
+
+Tables are stored in row groups of ROW_GROUP_ROWS, the granularity at
+which DuckDB skips data by min/max created_at, so a window-bounded query
+reads the window plus at most a partial group at each edge
+(scan_ratio <= MAX_SCAN_RATIO while the window holds 2 groups or more).
+
+- current: the dashboard panel behind the question (AnalyticsService over
+  sales.total_amount, bounded by the question's window)
+- legacy: the old per-question SQL, which aggregated the whole
+  product_sales table into per-sale totals before filtering
+
+Needs `pip install duckdb`.
+
+    python -m app.services.nlp_benchmark              # 90 / 365 / 1095 days
+    python -m app.services.nlp_benchmark 365 1825     # custom lengths
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Optional, Dict, List, Any, Iterable
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from ..api.nlp_processor import INTENT_HANDLERS, dashboard_params
+from .analytics_service import AnalyticsService
+from .columnar_engine import DuckDBSession, duckdb
+from .nlp_router import parse_query, resolve_intent
+from .panels import PANELS
+
+HISTORY_DAYS = (90, 365, 1095)
+ORDERS_PER_DAY = 200
+ITEMS_PER_ORDER = 2
+ROW_GROUP_ROWS = 2048
+MAX_SCAN_RATIO = 2.0
+
+QUESTIONS = (
+    "Quanto vendi nos últimos 30 dias?",
+    "Qual o melhor canal de vendas?",
+)
+
+# Consultas antigas de process_revenue_query / process_best_channel_query
+# (default: últimos 30 dias), mantidas só para comparação
+LEGACY_QUERIES = {
+    "Quanto vendi nos últimos 30 dias?": """
+        SELECT
+            COUNT(DISTINCT s.id) as total_sales,
+            COALESCE(SUM(ps.total_price), 0) as total_revenue,
+            COALESCE(AVG(sale_totals.sale_total), 0) as avg_ticket
+        FROM sales s
+        JOIN product_sales ps ON s.id = ps.sale_id
+        LEFT JOIN channels ch ON s.channel_id = ch.id
+        LEFT JOIN (
+            SELECT sale_id, SUM(total_price) as sale_total
+            FROM product_sales
+            GROUP BY sale_id
+        ) sale_totals ON s.id = sale_totals.sale_id
+        WHERE 1=1 AND s.created_at >= :start_date
+    """,
+    "Qual o melhor canal de vendas?": """
+        SELECT
+            ch.name as channel_name,
+            COUNT(DISTINCT s.id) as total_sales,
+            COALESCE(SUM(ps.total_price), 0) as revenue,
+            COALESCE(AVG(sale_totals.sale_total), 0) as avg_ticket
+        FROM sales s
+        JOIN channels ch ON s.channel_id = ch.id
+        JOIN product_sales ps ON s.id = ps.sale_id
+        LEFT JOIN (
+            SELECT sale_id, SUM(total_price) as sale_total
+            FROM product_sales
+            GROUP BY sale_id
+        ) sale_totals ON s.id = sale_totals.sale_id
+        WHERE s.created_at >= :start_date
+        GROUP BY ch.name
+        ORDER BY revenue DESC
+    """,
+}
+
+
+class HistorySession(DuckDBSession):
+    """
+    DuckDBSession over synthetic tables: `days` of history ending `today`,
+    ORDERS_PER_DAY sales per day inserted in time order (as the real
+    tables grow), ITEMS_PER_ORDER product_sales rows per sale, in a
+    temporary database file with ROW_GROUP_ROWS row groups. Every
+    statement is profiled; `rows_scanned` holds the rows read by the
+    last ones since reset() and `window_rows()` the sales rows between
+    the earliest and latest date they were given
+    """
+
+    def __init__(self, days: int, today: date, orders_per_day: int = ORDERS_PER_DAY):
+        if duckdb is None:
+            raise RuntimeError("duckdb is not installed")
+        # Row group size only applies to database files, not to :memory:
+        self.path = tempfile.mkdtemp(prefix="nlp_benchmark_")
+        self.conn = duckdb.connect()
+        self.conn.execute(
+            f"ATTACH '{os.path.join(self.path, 'history.duckdb')}' AS history (ROW_GROUP_SIZE {ROW_GROUP_ROWS})"
+        )
+        self.conn.execute("USE history")
+        self.reset()
+        first = datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+        step = 86400 // orders_per_day
+        total = days * orders_per_day
+
+        self.conn.execute("""
+            CREATE TABLE channels AS
+            SELECT * FROM (VALUES
+                (1, 'Presencial', 'P'), (2, 'iFood', 'D'), (3, 'Rappi', 'D'), (4, 'WhatsApp', 'D')
+            ) c(id, name, type)
+        """)
+        self.conn.execute("""
+            CREATE TABLE products AS
+            SELECT i AS id, 'Produto ' || i AS name FROM range(1, 41) r(i)
+        """)
+        self.conn.execute("""
+            CREATE TABLE sales AS
+            SELECT
+                i + 1 AS id,
+                i % 3 + 1 AS store_id,
+                i % 997 + 1 AS customer_id,
+                i % 4 + 1 AS channel_id,
+                $first + to_seconds((i // $per_day) * 86400 + (i % $per_day) * $step) AS created_at,
+                'Cliente ' || (i % 997) AS customer_name,
+                CASE WHEN i % 50 = 0 THEN 'CANCELLED' ELSE 'COMPLETED' END AS sale_status_desc,
+                (20 + i % 80)::DECIMAL(10, 2) AS total_amount,
+                600 + i % 900 AS production_seconds,
+                CASE WHEN i % 4 = 0 THEN NULL ELSE 1200 + i % 1800 END AS delivery_seconds
+            FROM range($total) r(i)
+            ORDER BY i
+        """, {'first': first, 'per_day': orders_per_day, 'step': step, 'total': total})
+        self.conn.execute("""
+            CREATE TABLE product_sales AS
+            SELECT
+                s.id * $items + k AS id,
+                s.id AS sale_id,
+                (s.id + k) % 40 + 1 AS product_id,
+                1.0 AS quantity,
+                s.total_amount::DOUBLE / $items AS base_price,
+                s.total_amount::DOUBLE / $items AS total_price,
+                s.created_at AS sale_created_at
+            FROM sales s, range($items) r(k)
+            ORDER BY s.id, k
+        """, {'items': ITEMS_PER_ORDER})
+
+        self.conn.execute("PRAGMA enable_profiling = 'no_output'")
+        self.conn.execute(
+            "SET custom_profiling_settings = '"
+            + json.dumps({"OPERATOR_ROWS_SCANNED": "true"}) + "'"
+        )
+
+    def execute(self, statement, params: Optional[Dict[str, Any]] = None):
+        result = super().execute(statement, params)
+        self.rows_scanned += _rows_scanned(json.loads(self.conn.get_profiling_information(format="json")))
+        self.statements += 1
+        bounds = [
+            v if isinstance(v, datetime) else datetime.combine(v, datetime.min.time())
+            for v in (params or {}).values() if isinstance(v, date)
+        ]
+        self.bounds.extend(bounds)
+        return result
+
+    def reset(self):
+        self.rows_scanned = 0
+        self.statements = 0
+        self.bounds: List[datetime] = []
+
+    def window_rows(self) -> int:
+        """
+        Sales rows the statements since reset() asked for: from their
+        earliest date parameter to their latest (open-ended when they
+        were given a single one, the whole table when none)
+        """
+        if not self.bounds:
+            return self.conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+        start, end = min(self.bounds), max(self.bounds)
+        if end == start:
+            return self.conn.execute("SELECT COUNT(*) FROM sales WHERE created_at >= $start",
+                                     {'start': start}).fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM sales WHERE created_at >= $start AND created_at < $end",
+                                 {'start': start, 'end': end}).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _rows_scanned(node: Dict[str, Any]) -> int:
+    return int(node.get("operator_rows_scanned") or 0) + sum(
+        _rows_scanned(child) for child in node.get("children", [])
+    )
+
+
+def run_current(session: HistorySession, question: str, today: date):
+    """The panel query the natural-query endpoint answers `question` from"""
+    intent = resolve_intent(parse_query(question), question, today=today)
+    call = PANELS[INTENT_HANDLERS[intent.intent].panel](dashboard_params(intent))
+    service = AnalyticsService(session)
+    service.use_rollup = False
+    return getattr(service, call.method)(*call.args, **call.kwargs)
+
+
+def run_legacy(session: HistorySession, question: str, today: date):
+    """The old per-question statement (see LEGACY_QUERIES)"""
+    return session.execute(LEGACY_QUERIES[question], {'start_date': today - timedelta(days=30)}).fetchall()
+
+
+def measure(session: HistorySession, run, question: str, today: date, rounds: int) -> Dict[str, Any]:
+    timings = []
+    for _ in range(rounds):
+        session.reset()
+        started = time.perf_counter()
+        run(session, question, today)
+        timings.append(time.perf_counter() - started)
+    window_rows = session.window_rows()
+    return {
+        'rows_scanned': session.rows_scanned,
+        'window_rows': window_rows,
+        'scan_ratio': round(session.rows_scanned / window_rows, 2) if window_rows else None,
+        'statements': session.statements,
+        'ms': round(statistics.median(timings) * 1000, 2),
+    }
+
+
+def benchmark(history_days: Iterable[int] = HISTORY_DAYS, questions: Iterable[str] = QUESTIONS,
+              orders_per_day: int = ORDERS_PER_DAY, rounds: int = 5,
+              today: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Rows scanned (absolute and per row in the question's window) and
+    median latency per question, history length and implementation, plus
+    the growth from the shortest to the longest history ('growth':
+    longest / shortest rows scanned)
+    """
+    today = today or date.today()
+    history_days = sorted(history_days)
+    questions = list(questions)
+    results: Dict[str, Dict[str, List[Dict[str, Any]]]] = {
+        question: {'current': [], 'legacy': []} for question in questions
+    }
+
+    for days in history_days:
+        session = HistorySession(days, today, orders_per_day)
+        try:
+            for question in questions:
+                for name, run in (('current', run_current), ('legacy', run_legacy)):
+                    results[question][name].append({'days': days, **measure(session, run, question, today, rounds)})
+        finally:
+            session.close()
+
+    for runs in results.values():
+        for name in ('current', 'legacy'):
+            first, last = runs[name][0], runs[name][-1]
+            runs[f'{name}_growth'] = round(last['rows_scanned'] / first['rows_scanned'], 2) if first['rows_scanned'] else None
+
+    return {
+        'history_days': history_days,
+        'orders_per_day': orders_per_day,
+        'questions': results,
+    }
+
+
+if __name__ == "__main__":
+    # python -m app.services.nlp_benchmark [days ...]
+    lengths = [int(arg) for arg in sys.argv[1:]] or HISTORY_DAYS
+    report = benchmark(lengths)
+    for question, runs in report['questions'].items():
+        print(f"\n{question}")
+        for name in ('current', 'legacy'):
+            for run in runs[name]:
+                print(f"  {name:8} {run['days']:>5} dias  {run['rows_scanned']:>10} linhas  "
+                      f"{run['window_rows']:>8} na janela  {run['scan_ratio']:>6}x  {run['ms']:>8} ms")
+            print(f"  {name:8} crescimento: {runs[f'{name}_growth']}x")
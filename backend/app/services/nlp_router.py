@@ -0,0 +1,307 @@
+"""
+NLP intent router
+Every keyword table the natural-query pipeline understands (weekdays, day
+periods, channels, time phrases, metric words and routing cues) is folded
+into one regex automaton compiled at import. A single finditer pass over
+the accent-folded text yields intent, time, channel, weekday and period.
+
+Values use the filter compiler vocabulary (DAY_CODES, TIME_WINDOWS,
+CHANNEL_GROUPS keys), so a parsed query maps straight onto dashboard
+filters.
+
+    python -m app.services.nlp_router     # queries/sec benchmark
+"""
+
+from datetime import date, timedelta
+from typing import Optional, Dict, Any, List, Tuple, NamedTuple, FrozenSet, Iterable
+import re
+import time
+
+from .nlp_utils import fold, pick_timerange
+
+# ===== Tabelas de palavras-chave (sem acento: o texto é normalizado antes) =====
+
+WEEKDAYS = {
+    'segunda': 'mon', 'segunda-feira': 'mon',
+    'terca': 'tue', 'terca-feira': 'tue',
+    'quarta': 'wed', 'quarta-feira': 'wed',
+    'quinta': 'thu', 'quinta-feira': 'thu',
+    'sexta': 'fri', 'sexta-feira': 'fri',
+    'sabado': 'sat',
+    'domingo': 'sun',
+}
+
+DAY_PERIODS = {
+    'manha': 'morning',
+    'tarde': 'afternoon',
+    'noite': 'evening',
+    'madrugada': 'night',
+}
+
+CHANNELS = {
+    'ifood': 'ifood',
+    'rappi': 'rappi',
+    'uber': 'uber',
+    'presencial': 'presencial',
+    'whatsapp': 'whatsapp',
+    'proprio': 'app',
+}
+
+# Nomes exibidos nas respostas (e usados no ILIKE sobre channels.name)
+CHANNEL_NAMES = {
+    'ifood': 'iFood',
+    'rappi': 'Rappi',
+    'uber': 'Uber Eats',
+    'presencial': 'Presencial',
+    'whatsapp': 'WhatsApp',
+    'app': 'App Próprio',
+}
+
+WEEKDAY_NAMES = {
+    'mon': 'segunda', 'tue': 'terça', 'wed': 'quarta', 'thu': 'quinta',
+    'fri': 'sexta', 'sat': 'sábado', 'sun': 'domingo',
+}
+
+PERIOD_NAMES = {'morning': 'manhã', 'afternoon': 'tarde', 'evening': 'noite', 'night': 'madrugada'}
+
+# Frases que nlp_utils.infer_timerange_from_text sabe resolver em datas
+TIME_PHRASES = {
+    'hoje': 'today', 'agora': 'today', 'today': 'today',
+    'ontem': 'yesterday', 'yesterday': 'yesterday',
+    'anteontem': 'day_before_yesterday',
+    'semana passada': 'last_week', 'ultima semana': 'last_week', 'last week': 'last_week',
+    'esta semana': 'this_week', 'semana atual': 'this_week', 'this week': 'this_week',
+    'mes passado': 'last_month', 'last month': 'last_month',
+    'mes atual': 'this_month', 'este mes': 'this_month', 'this month': 'this_month',
+    'ultimos 7 dias': 'last_7_days', 'last 7 days': 'last_7_days',
+    'ultimos 30 dias': 'last_30_days', 'last 30 days': 'last_30_days',
+}
+
+# Em ordem de prioridade: a primeira métrica encontrada vence
+METRIC_KEYWORDS = {
+    'revenue': ('vendi', 'vendeu', 'vendas', 'faturamento', 'receita', 'faturei', 'faturou', 'quanto'),
+    'avg_ticket': ('ticket', 'valor medio'),
+    'orders': ('pedidos', 'orders', 'quantos pedidos'),
+    'products': ('produto', 'item', 'prato', 'lanche'),
+    'customers': ('cliente', 'consumidor', 'comprador'),
+    'channel': ('canal', 'canais'),
+}
+
+CUES = (
+    'produto', 'ticket', 'medio', 'caindo', 'canal', 'canais', 'loja', 'entrega',
+    'pior', 'piorou', 'piorando', 'dia', 'horario', 'cliente', 'voltam',
+    'inativos', 'mais', 'vendido', 'melhor', 'venda', '30 dias',
+)
+
+INTENTS = (
+    'complex_product', 'ticket_trend', 'delivery', 'retention',
+    'ticket', 'products', 'channel', 'revenue', 'help',
+)
+
+# Janela padrão (dias até hoje) quando a pergunta não cita período;
+# None = intenção sem período (a consulta não filtra por data)
+DEFAULT_WINDOW_DAYS = 30
+INTENT_WINDOWS = {'ticket_trend': 7, 'retention': None, 'help': None}
+
+# Recortes que viram filtros do dashboard; intenções listadas aqui usam
+# só os indicados e o resto fica fora da chave canônica
+SLICES = ('channel', 'weekday', 'period')
+INTENT_SLICES = {'retention': (), 'help': ()}
+
+
+def _lexicon() -> Dict[str, Tuple[Tuple[str, str], ...]]:
+    tables = [
+        ('weekday', WEEKDAYS.items()),
+        ('period', DAY_PERIODS.items()),
+        ('channel', CHANNELS.items()),
+        ('time', TIME_PHRASES.items()),
+        ('metric', ((word, metric) for metric, words in METRIC_KEYWORDS.items() for word in words)),
+        ('cue', ((word, word) for word in CUES)),
+    ]
+    lexicon: Dict[str, List[Tuple[str, str]]] = {}
+    for kind, entries in tables:
+        for phrase, value in entries:
+            lexicon.setdefault(phrase, []).append((kind, value))
+    return {phrase: tuple(tags) for phrase, tags in lexicon.items()}
+
+
+LEXICON = _lexicon()
+
+# Longest phrase first, so 'segunda-feira' wins over 'segunda' and
+# 'ultimos 30 dias' over '30 dias'; plurals ride on the optional suffix.
+# Any other 'ultimos N dias' (resolved by nlp_utils too) falls through to
+# the last_n group and becomes the time key 'last_N_days'
+PATTERN = re.compile(
+    r'\b(?:(' + '|'.join(re.escape(p) for p in sorted(LEXICON, key=len, reverse=True)) + r')(?:e?s)?'
+    r'|(?:ultimos|last) (?P<last_n>\d+) (?:dias|days))\b'
+)
+
+METRIC_PRIORITY = {metric: i for i, metric in enumerate(METRIC_KEYWORDS)}
+
+
+class ParsedQuery(NamedTuple):
+    intent: str
+    metric: str
+    time: Optional[str]
+    weekday: Optional[str]
+    period: Optional[str]
+    channel: Optional[str]
+    cues: FrozenSet[str]
+
+    @property
+    def channel_name(self) -> Optional[str]:
+        return CHANNEL_NAMES.get(self.channel)
+
+
+def _intent(cues: FrozenSet[str], metric: str, time_key: Optional[str],
+            has_slice: bool) -> str:
+    if 'produto' in cues and has_slice:
+        return 'complex_product'
+    if 'ticket' in cues and cues & {'caindo', 'canal', 'canais', 'loja'}:
+        return 'ticket_trend'
+    if 'entrega' in cues and cues & {'pior', 'piorou', 'piorando', 'dia', 'horario'}:
+        return 'delivery'
+    if 'cliente' in cues and (cues & {'voltam', 'inativos', '30 dias'} or time_key == 'last_30_days'):
+        return 'retention'
+    if 'ticket' in cues and 'medio' in cues:
+        return 'ticket'
+    if 'produto' in cues:
+        return 'products'
+    if cues & {'canal', 'canais'} or {'melhor', 'venda'} <= cues:
+        return 'channel'
+    if metric in ('revenue', 'orders'):
+        return 'revenue'
+    return 'help'
+
+
+def parse_query(query: str) -> ParsedQuery:
+    """Intent and slice of a natural-language question, in one regex pass"""
+    found = {'weekday': None, 'period': None, 'channel': None, 'time': None}
+    cues = set()
+    metric = None
+    for match in PATTERN.finditer(fold(query)):
+        if match.group('last_n'):
+            if found['time'] is None:
+                found['time'] = f"last_{int(match.group('last_n'))}_days"
+            continue
+        for kind, value in LEXICON[match.group(1)]:
+            if kind == 'cue':
+                cues.add(value)
+            elif kind == 'metric':
+                if metric is None or METRIC_PRIORITY[value] < METRIC_PRIORITY[metric]:
+                    metric = value
+            elif found[kind] is None:
+                found[kind] = value
+
+    cues = frozenset(cues)
+    metric = metric or 'general'
+    has_slice = any(found[k] is not None for k in ('weekday', 'period', 'channel'))
+    return ParsedQuery(
+        intent=_intent(cues, metric, found['time'], has_slice),
+        metric=metric,
+        time=found['time'],
+        weekday=found['weekday'],
+        period=found['period'],
+        channel=found['channel'],
+        cues=cues,
+    )
+
+
+class NlpIntent(NamedTuple):
+    """
+    Canonical form of a question: intent, metric, resolved date range,
+    slices and store, everything its answer depends on. Questions worded
+    differently but meaning the same share one tuple (and so one cache
+    entry)
+    """
+    intent: str
+    start_date: Optional[date]
+    end_date: Optional[date]
+    channel: Optional[str] = None
+    weekday: Optional[str] = None
+    period: Optional[str] = None
+    store_id: Optional[int] = None
+    metric: Optional[str] = None
+
+    @property
+    def channel_name(self) -> Optional[str]:
+        return CHANNEL_NAMES.get(self.channel)
+
+    def filters(self) -> Optional[Dict[str, List[str]]]:
+        """Same filters dict the dashboard endpoints send (see filter_compiler)"""
+        filters = {}
+        if self.channel:
+            filters['channels'] = [self.channel]
+        if self.weekday:
+            filters['day_of_week'] = [self.weekday]
+        if self.period:
+            filters['time_of_day'] = [self.period]
+        return filters or None
+
+
+def resolve_intent(parsed: ParsedQuery, query: str, context: Optional[Dict[str, Any]] = None,
+                   today: Optional[date] = None) -> NlpIntent:
+    """
+    Canonical intent tuple: the parsed metric, dates resolved with
+    pick_timerange when the question (or the request context) names a
+    period, the intent's default window otherwise, the slices the intent
+    actually uses and the store from the request context
+    """
+    today = today or date.today()
+    context = context or {}
+    window = INTENT_WINDOWS.get(parsed.intent, DEFAULT_WINDOW_DAYS)
+    if window is None:
+        start_date = end_date = None
+    elif parsed.time or (context.get('start_date') and context.get('end_date')):
+        start_date, end_date = pick_timerange(query, context, today)
+    else:
+        start_date, end_date = today - timedelta(days=window - 1), today
+
+    slices = INTENT_SLICES.get(parsed.intent, SLICES)
+    store_id = context.get('store_id')
+    return NlpIntent(
+        intent=parsed.intent,
+        start_date=start_date,
+        end_date=end_date,
+        store_id=int(store_id) if store_id is not None else None,
+        metric=parsed.metric,
+        **{name: getattr(parsed, name) for name in slices}
+    )
+
+
+# ===== Benchmark =====
+
+SAMPLE_QUERIES = (
+    "Quanto vendi ontem no iFood?",
+    "Qual o produto mais vendido?",
+    "Mostre o ticket médio",
+    "Qual o melhor canal de vendas?",
+    "Qual produto vende mais na quinta à noite no iFood?",
+    "Meu ticket médio está caindo. É por canal ou por loja?",
+    "Meu tempo de entrega piorou. Em quais dias/horários?",
+    "Quais clientes compraram 3+ vezes mas não voltam há 30 dias?",
+    "Faturamento da semana passada no Rappi",
+    "Quantos pedidos tivemos hoje de manhã?",
+)
+
+
+def benchmark(queries: Iterable[str] = SAMPLE_QUERIES, rounds: int = 2000) -> Dict[str, float]:
+    """Queries per second of parse_query over `queries` repeated `rounds` times"""
+    queries = list(queries)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            parse_query(query)
+    elapsed = time.perf_counter() - started
+    total = rounds * len(queries)
+    return {
+        'queries': total,
+        'seconds': round(elapsed, 4),
+        'queries_per_second': round(total / elapsed) if elapsed else float('inf'),
+        'us_per_query': round(elapsed / total * 1e6, 2),
+    }
+
+
+if __name__ == "__main__":
+    # python -m app.services.nlp_router
+    print(benchmark())
@@ -3,28 +3,40 @@ import re
 from datetime import date, timedelta
 from typing import Optional, Tuple, Dict, Any
 
+_FOLD = str.maketrans('áàâãäéèêëíìîïóòôõöúùûüç', 'aaaaaeeeeiiiiooooouuuuc')
+_LAST_N_DAYS = re.compile(r"\b(?:ultimos|last) (\d+) (?:dias|days)\b")
+
+def fold(text: str) -> str:
+    """Lowercase without accents ('Manhã' -> 'manha')"""
+    return text.lower().translate(_FOLD)
+
 def infer_timerange_from_text(q: str, today: Optional[date] = None) -> Tuple[date, date]:
     today = today or date.today()
-    text = q.lower().strip()
+    text = fold(q).strip()
 
-    # Portuguese keywords
-    if "ontem" in text:
-        d = today - timedelta(days=1)
-        return d, d
+    # "últimos 7 dias" / "last 30 days": N days ending today
+    match = _LAST_N_DAYS.search(text)
+    if match and int(match.group(1)) > 0:
+        return today - timedelta(days=int(match.group(1)) - 1), today
+
+    # Portuguese keywords (sem acento: o texto é normalizado com fold)
     if "anteontem" in text:
         d = today - timedelta(days=2)
         return d, d
+    if "ontem" in text:
+        d = today - timedelta(days=1)
+        return d, d
     if "hoje" in text or "agora" in text:
         return today, today
     if "semana passada" in text:
         end = today - timedelta(days=today.weekday() + 1)
         start = end - timedelta(days=6)
         return start, end
-    if "última semana" in text:
+    if "ultima semana" in text:
         end = today - timedelta(days=today.weekday() + 1)
         start = end - timedelta(days=6)
         return start, end
-    if "mês passado" in text:
+    if "mes passado" in text:
         first_this_month = today.replace(day=1)
         last_month_end = first_this_month - timedelta(days=1)
         start = last_month_end.replace(day=1)
@@ -33,7 +45,7 @@ def infer_timerange_from_text(q: str, today: Optional[date] = None) -> Tuple[dat
         start = today - timedelta(days=today.weekday())
         end = start + timedelta(days=6)
         return start, end
-    if "mês atual" in text or "este mês" in text:
+    if "mes atual" in text or "este mes" in text:
         start = today.replace(day=1)
         return start, today
 
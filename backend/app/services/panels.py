@@ -0,0 +1,248 @@
+"""
+Dashboard panels
+Registry of the AnalyticsService calls behind each dashboard panel and the
+fan-out that loads them concurrently, each on its own pooled connection.
+Panel loads are counted per cache key so the cache warmer knows what to
+precompute.
+"""
+
+from datetime import date
+from typing import Optional, Dict, List, Any, Tuple, NamedTuple, Callable
+import asyncio
+import json
+import logging
+import time
+
+from ..core.cache import cache, cache_key_builder, cache_tags
+from ..core.config import settings
+from .analytics_service import call_analytics
+
+logger = logging.getLogger(__name__)
+
+
+class DashboardParams(NamedTuple):
+    """One filter set shared by every panel of the dashboard"""
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    store_id: Optional[int] = None
+    filters: Optional[Dict] = None
+    granularity: str = "day"
+    limit: int = 10
+    compare: bool = False
+    engine: Optional[str] = None  # postgres | duckdb; keyed only when not the default
+    exact: bool = False  # exact unique customers instead of the HLL estimate
+
+    def to_json(self) -> str:
+        data = self._asdict()
+        data['start_date'] = self.start_date.isoformat() if self.start_date else None
+        data['end_date'] = self.end_date.isoformat() if self.end_date else None
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw) -> "DashboardParams":
+        data = json.loads(raw)
+        for field in ('start_date', 'end_date'):
+            if data.get(field):
+                data[field] = date.fromisoformat(data[field])
+        return cls(**{k: v for k, v in data.items() if k in cls._fields})
+
+
+class PanelCall(NamedTuple):
+    """
+    How to load one panel: the AsyncAnalyticsService method with its
+    arguments, plus the cache key/TTLs used by the standalone endpoint
+    (cache_key None = not cached)
+    """
+    method: str
+    args: Tuple
+    kwargs: Dict[str, Any]
+    cache_key: Optional[str]
+    ttl: int = 0
+    stale_ttl: int = 0
+    tags: Tuple[str, ...] = ()
+    engine: Optional[str] = None
+
+
+def _dates(p: DashboardParams) -> Dict[str, Optional[str]]:
+    return {
+        'start_date': str(p.start_date) if p.start_date else None,
+        'end_date': str(p.end_date) if p.end_date else None,
+    }
+
+
+def _engine(p: DashboardParams) -> Optional[str]:
+    # Engines answer from different data (the DuckDB snapshot lags by up to
+    # one export interval), so a non-default engine gets its own entries
+    return p.engine if p.engine and p.engine != settings.ANALYTIC_ENGINE else None
+
+
+def _overview(p: DashboardParams) -> PanelCall:
+    return PanelCall(
+        'get_overview_metrics', (p.start_date, p.end_date, p.store_id), {'filters': p.filters, 'exact': p.exact},
+        cache_key_builder("overview", store_id=p.store_id, exact=p.exact or None, filters=p.filters,
+                          engine=_engine(p), **_dates(p)),
+        settings.CACHE_TTL_OVERVIEW, settings.CACHE_STALE_TTL_OVERVIEW,
+        tuple(cache_tags("overview", p.store_id, p.start_date, p.end_date, compare=True)),
+        p.engine,
+    )
+
+
+def _timeline(p: DashboardParams) -> PanelCall:
+    return PanelCall(
+        'get_timeline_data', (p.start_date, p.end_date, p.store_id, p.granularity),
+        {'filters': p.filters, 'compare': p.compare},
+        cache_key_builder("timeline", store_id=p.store_id, granularity=p.granularity,
+                          compare=p.compare or None, filters=p.filters, engine=_engine(p), **_dates(p)),
+        settings.CACHE_TTL_TIMELINE, settings.CACHE_STALE_TTL_TIMELINE,
+        tuple(cache_tags("timeline", p.store_id, p.start_date, p.end_date, compare=p.compare)),
+        p.engine,
+    )
+
+
+def _top_products(p: DashboardParams) -> PanelCall:
+    return PanelCall(
+        'get_top_products', (p.start_date, p.end_date, p.store_id, p.limit), {'filters': p.filters},
+        cache_key_builder("top_products", store_id=p.store_id, limit=p.limit,
+                          filters=p.filters, engine=_engine(p), **_dates(p)),
+        settings.CACHE_TTL_PRODUCTS, settings.CACHE_STALE_TTL_PRODUCTS,
+        tuple(cache_tags("top_products", p.store_id, p.start_date, p.end_date)),
+        p.engine,
+    )
+
+
+def _channels(p: DashboardParams) -> PanelCall:
+    return PanelCall(
+        'get_channels_performance', (p.start_date, p.end_date, p.store_id), {'filters': p.filters},
+        cache_key_builder("channels", store_id=p.store_id, filters=p.filters, engine=_engine(p), **_dates(p)),
+        settings.CACHE_TTL_CHANNELS, settings.CACHE_STALE_TTL_CHANNELS,
+        tuple(cache_tags("channels", p.store_id, p.start_date, p.end_date)),
+        p.engine,
+    )
+
+
+def _insights(p: DashboardParams) -> PanelCall:
+    return PanelCall(
+        'get_business_insights', (p.store_id,), {},
+        cache_key_builder("insights", store_id=p.store_id, engine=_engine(p)),
+        settings.CACHE_TTL_INSIGHTS, settings.CACHE_STALE_TTL_INSIGHTS,
+        tuple(cache_tags("insights", p.store_id, dated=False)),
+        p.engine,
+    )
+
+
+# Nome do painel -> builder da chamada
+PANELS: Dict[str, Callable[[DashboardParams], PanelCall]] = {
+    'overview': _overview,
+    'timeline': _timeline,
+    'top_products': _top_products,
+    'channels': _channels,
+    'insights': _insights,
+}
+
+
+# Frequência de acesso por chave (sorted set) e como recalcular cada chave (hash)
+ACCESS_KEY = "nola:warm:freq"
+RECIPES_KEY = "nola:warm:recipes"
+
+
+def record_access(name: str, params: DashboardParams, cache_key: str):
+    """Count one access to a cached panel and remember how to rebuild it"""
+    if not cache.client or not settings.WARMER_ENABLED:
+        return
+    try:
+        pipe = cache.client.pipeline(transaction=False)
+        pipe.zincrby(ACCESS_KEY, 1, cache_key)
+        pipe.hset(RECIPES_KEY, cache_key, json.dumps({'panel': name, 'params': params.to_json()}))
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Access tracking error: {e}")
+
+
+def compute_panel(call: PanelCall):
+    """Awaitable that recomputes a panel on its own session"""
+    return call_analytics(call.method, *call.args, engine=call.engine, **call.kwargs)
+
+
+async def get_panel(name: str, params: DashboardParams, track: bool = True) -> Tuple[Any, Optional[str]]:
+    """
+    (data, cache status) for one panel, going through the same cache entry
+    and single-flight recompute as the standalone endpoints
+    """
+    call = PANELS[name](params)
+    if not call.cache_key:
+        return await compute_panel(call), None
+
+    if track:
+        record_access(name, params, call.cache_key)
+    return await cache.get_or_compute(
+        call.cache_key,
+        lambda: compute_panel(call),
+        ttl=call.ttl,
+        stale_ttl=call.stale_ttl,
+        tags=call.tags,
+        with_status=True
+    )
+
+
+async def load_panel(name: str, params: DashboardParams) -> Dict[str, Any]:
+    """
+    Load one panel with its own AsyncSession (a separate pool checkout).
+    Never raises: errors are reported in the result.
+    """
+    started = time.perf_counter()
+    status = None
+    data = None
+    error = None
+
+    try:
+        data, status = await get_panel(name, params)
+    except Exception as e:
+        logger.error(f"Error loading panel {name}: {e}")
+        error = str(e)
+
+    return {
+        'name': name,
+        'data': data,
+        'error': error,
+        'cache': status,
+        'ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+async def load_dashboard(params: DashboardParams, panels: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Run every requested panel concurrently; total latency is bounded by
+    the slowest panel instead of the sum
+    """
+    started = time.perf_counter()
+    names = [name for name in (panels or PANELS) if name in PANELS]
+
+    results = await asyncio.gather(*(load_panel(name, params) for name in names))
+
+    response = {
+        'period': {
+            'start': str(params.start_date) if params.start_date else None,
+            'end': str(params.end_date) if params.end_date else None,
+        },
+        'panels': {},
+        'timings': {},
+        'errors': {},
+    }
+    for result in results:
+        response['panels'][result['name']] = result['data']
+        response['timings'][result['name']] = {
+            'ms': result['ms'],
+            'cached': result['cache'] in ('fresh', 'stale'),
+            'cache': result['cache'],
+        }
+        if result['error']:
+            response['errors'][result['name']] = result['error']
+
+    # Período efetivo vem do overview quando ele foi carregado
+    overview = response['panels'].get('overview')
+    if overview and overview.get('period'):
+        response['period'] = overview['period']
+
+    response['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"🧩 Dashboard loaded: {len(names)} panels in {response['total_ms']}ms")
+    return response
@@ -0,0 +1,284 @@
+"""
+Partition management
+Monthly range partitions for sales (by created_at) and product_sales
+(co-partitioned by sale_created_at, a copy of its sale's created_at).
+
+- migrate(): one-off conversion of the heap tables into partitioned ones
+- maintain(): creates the next months ahead and detaches months past the
+  retention window; run periodically from the app lifespan
+
+On a database that was never migrated every method is a no-op, so the
+default schema keeps working unchanged.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from datetime import date
+from typing import Optional, Dict, List, Tuple
+import asyncio
+import logging
+import re
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from .index_advisor import MANAGED_INDEXES
+
+logger = logging.getLogger(__name__)
+
+# Tabela -> coluna de particionamento
+PARTITIONED_TABLES = {
+    "sales": "created_at",
+    "product_sales": "sale_created_at",
+}
+
+_PARTITION_NAME = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})_(?P<month>\d{2})$")
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(day: date, months: int) -> date:
+    index = day.year * 12 + (day.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+def parse_partition_name(name: str) -> Optional[Tuple[str, date]]:
+    match = _PARTITION_NAME.match(name)
+    if not match:
+        return None
+    return match.group("table"), date(int(match.group("year")), int(match.group("month")), 1)
+
+
+class PartitionState:
+    """
+    Per-process view of the partitioning, read by AnalyticsService to add
+    the sale_created_at range that lets product_sales be pruned
+    """
+
+    def __init__(self):
+        self.sales = False
+        self.product_sales = False
+
+
+partition_state = PartitionState()
+
+
+class PartitionManager:
+    def __init__(self, db: Session):
+        self.db = db
+
+    # ===== Estado =====
+
+    def is_partitioned(self, table: str) -> bool:
+        return bool(self.db.execute(
+            text("""
+                SELECT 1 FROM pg_partitioned_table pt
+                JOIN pg_class c ON c.oid = pt.partrelid
+                WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace
+            """),
+            {"table": table}
+        ).first())
+
+    def list_partitions(self, table: str) -> List[Tuple[str, date]]:
+        """Monthly partitions of `table` as (name, month), oldest first"""
+        rows = self.db.execute(
+            text("""
+                SELECT child.relname AS name
+                FROM pg_inherits i
+                JOIN pg_class parent ON parent.oid = i.inhparent
+                JOIN pg_class child ON child.oid = i.inhrelid
+                WHERE parent.relname = :table
+            """),
+            {"table": table}
+        ).fetchall()
+        partitions = []
+        for row in rows:
+            parsed = parse_partition_name(row.name)
+            if parsed and parsed[0] == table:
+                partitions.append((row.name, parsed[1]))
+        return sorted(partitions, key=lambda p: p[1])
+
+    def refresh_state(self):
+        partition_state.sales = self.is_partitioned("sales")
+        partition_state.product_sales = self.is_partitioned("product_sales")
+
+    # ===== Manutenção =====
+
+    def create_partition(self, table: str, month: date) -> bool:
+        name = partition_name(table, month)
+        self.db.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table}
+            FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')
+        """))
+        return True
+
+    def maintain(self, months_ahead: Optional[int] = None,
+                 retention_months: Optional[int] = None) -> Dict[str, List[str]]:
+        """
+        Make sure partitions exist from the current month to `months_ahead`
+        months in the future, and detach the ones entirely older than
+        `retention_months` (0 keeps everything). Detached partitions stay
+        as standalone tables for archiving.
+        """
+        months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+        retention_months = settings.PARTITION_RETENTION_MONTHS if retention_months is None else retention_months
+        summary = {"created": [], "detached": []}
+
+        self.refresh_state()
+        current = month_start(date.today())
+
+        for table in PARTITIONED_TABLES:
+            if not self.is_partitioned(table):
+                continue
+
+            existing = {month for _, month in self.list_partitions(table)}
+            for offset in range(months_ahead + 1):
+                month = add_months(current, offset)
+                if month not in existing:
+                    self.create_partition(table, month)
+                    summary["created"].append(partition_name(table, month))
+
+            if retention_months > 0:
+                cutoff = add_months(current, -retention_months)
+                for name, month in self.list_partitions(table):
+                    if add_months(month, 1) <= cutoff:
+                        self.db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                        summary["detached"].append(name)
+
+        self.db.commit()
+        if summary["created"] or summary["detached"]:
+            logger.info(f"🗂️ Partitions created: {summary['created']} detached: {summary['detached']}")
+        return summary
+
+    # ===== Migração (uma vez) =====
+
+    def migrate(self, months_ahead: Optional[int] = None) -> Dict[str, int]:
+        """
+        Convert the sales / product_sales heap tables into monthly partitioned
+        tables in one transaction. The old tables are kept as <table>_heap.
+
+        Foreign keys pointing at sales(id) / product_sales(id) are dropped:
+        a partitioned table can only be referenced through a key that
+        includes the partition column.
+        """
+        months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+        copied = {}
+        try:
+            # product_sales precisa da data da venda para ser co-particionada
+            self.db.execute(text("ALTER TABLE product_sales ADD COLUMN IF NOT EXISTS sale_created_at TIMESTAMP"))
+            self.db.execute(text("""
+                UPDATE product_sales ps SET sale_created_at = s.created_at
+                FROM sales s
+                WHERE s.id = ps.sale_id AND ps.sale_created_at IS NULL
+            """))
+
+            bounds = self.db.execute(text("SELECT MIN(created_at), MAX(created_at) FROM sales")).first()
+            first = month_start(bounds[0].date()) if bounds[0] else month_start(date.today())
+            last = add_months(month_start(date.today()), months_ahead)
+            if bounds[1] and month_start(bounds[1].date()) > last:
+                last = month_start(bounds[1].date())
+
+            for table, column in PARTITIONED_TABLES.items():
+                if self.is_partitioned(table):
+                    logger.info(f"{table} is already partitioned")
+                    continue
+                copied[table] = self._convert(table, column, first, last)
+
+            self.db.commit()
+            self.refresh_state()
+            logger.info(f"🗂️ Partitioning migration done: {copied}")
+            return copied
+
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def _convert(self, table: str, column: str, first: date, last: date) -> int:
+        heap = f"{table}_heap"
+
+        # FKs que apontam para a tabela (ou saem dela) não sobrevivem à troca
+        for fk in self._foreign_keys_touching(table):
+            logger.warning(f"Dropping foreign key {fk['name']} on {fk['table']}")
+            self.db.execute(text(f'ALTER TABLE {fk["table"]} DROP CONSTRAINT {fk["name"]}'))
+
+        self.db.execute(text(f"ALTER TABLE {table} RENAME TO {heap}"))
+        self.db.execute(text(f"ALTER INDEX IF EXISTS {table}_pkey RENAME TO {heap}_pkey"))
+        self.db.execute(text(f"""
+            CREATE TABLE {table} (LIKE {heap} INCLUDING DEFAULTS)
+            PARTITION BY RANGE ({column})
+        """))
+        self.db.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL"))
+        self.db.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, {column})"))
+        # The SERIAL sequence keeps feeding the new table
+        self.db.execute(text(f"ALTER SEQUENCE IF EXISTS {table}_id_seq OWNED BY {table}.id"))
+
+        month = first
+        while month <= last:
+            self.create_partition(table, month)
+            month = add_months(month, 1)
+        self.db.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+        # Managed indexes go on the parent and propagate to every month
+        for index_name, index_table, ddl in MANAGED_INDEXES:
+            if index_table != table:
+                continue
+            # Index names are global: free them from the heap copy first
+            self.db.execute(text(f"ALTER INDEX IF EXISTS {index_name} RENAME TO {index_name}_heap"))
+            self.db.execute(text(ddl))
+
+        result = self.db.execute(text(f"INSERT INTO {table} SELECT * FROM {heap}"))
+        return result.rowcount
+
+    def _foreign_keys_touching(self, table: str) -> List[Dict[str, str]]:
+        rows = self.db.execute(
+            text("""
+                SELECT con.conname AS name, src.relname AS table_name
+                FROM pg_constraint con
+                JOIN pg_class src ON src.oid = con.conrelid
+                JOIN pg_class dst ON dst.oid = con.confrelid
+                WHERE con.contype = 'f' AND (dst.relname = :table OR src.relname = :table)
+            """),
+            {"table": table}
+        ).fetchall()
+        return [{"name": r.name, "table": r.table_name} for r in rows]
+
+
+def maintain_partitions_once() -> Dict:
+    """Run one maintenance pass with its own session"""
+    db = SessionLocal()
+    try:
+        return PartitionManager(db).maintain()
+    except Exception as e:
+        logger.error(f"Partition maintenance error: {e}")
+        db.rollback()
+        return {"created": [], "detached": []}
+    finally:
+        db.close()
+
+
+async def run_partition_maintenance():
+    """
+    Background loop started from the app lifespan
+    """
+    while True:
+        await asyncio.to_thread(maintain_partitions_once)
+        await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL)
+
+
+if __name__ == "__main__":
+    # python -m app.services.partition_manager [--migrate]
+    import sys
+
+    db = SessionLocal()
+    try:
+        manager = PartitionManager(db)
+        if "--migrate" in sys.argv:
+            print(manager.migrate())
+        print(manager.maintain())
+    finally:
+        db.close()
@@ -0,0 +1,101 @@
+"""
+Period comparison engine
+Computes current and previous windows in a single scan using conditional
+aggregation (FILTER (WHERE ...)) over the union of both ranges
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from datetime import timedelta
+from typing import Optional, Dict, List, Tuple, Any
+
+from ..core.filter_compiler import CompiledFilters
+
+
+def safe_change(current_val, previous_val) -> float:
+    """Percentage change, 0 when there is no previous value"""
+    current_val = float(current_val or 0)
+    previous_val = float(previous_val or 0)
+    if previous_val == 0:
+        return 0
+    return ((current_val - previous_val) / previous_val) * 100
+
+
+def metric_delta(current_val, previous_val, cast=float) -> Dict[str, Any]:
+    """{'value', 'previous', 'change'} as used by OverviewResponse"""
+    return {
+        'value': cast(current_val or 0),
+        'previous': cast(previous_val or 0),
+        'change': safe_change(current_val, previous_val),
+    }
+
+
+def ratio(numerator, denominator) -> float:
+    if not denominator:
+        return 0.0
+    return float(numerator or 0) / float(denominator)
+
+
+class PeriodComparison:
+    """
+    Current window plus the previous window of the same length.
+
+    `aggregates` maps a name to a bare aggregate call (e.g. "COUNT(s.id)",
+    "SUM(s.total_amount)"); each one is emitted twice, as cur_<name> and
+    prev_<name>, with a FILTER clause splitting the union range at the
+    current window start. `group_by` is a list of (alias, expression).
+    """
+
+    def __init__(self, current: CompiledFilters):
+        self.current = current
+        days = (current.end_date - current.start_date).days + 1
+        self.previous = current.with_dates(
+            current.start_date - timedelta(days=days),
+            current.start_date - timedelta(days=1)
+        )
+        # Both windows are contiguous, so the union compiles as one range
+        self.union = current.with_dates(self.previous.start_date, current.end_date)
+
+    def build(self, aggregates: Dict[str, str], table: str = "sales s",
+              time_column: str = "s.created_at", group_by: Optional[List[Tuple[str, str]]] = None,
+              extra_where: str = "", order_by: str = ""):
+        """Return (sql, params) for the single-scan comparison query"""
+        where, params = self.union.where(time_column, prefix='cmp')
+        params['cmp_split'] = self.current.start
+
+        columns = []
+        for name, aggregate in aggregates.items():
+            columns.append(f"{aggregate} FILTER (WHERE {time_column} >= :cmp_split) AS cur_{name}")
+            columns.append(f"{aggregate} FILTER (WHERE {time_column} < :cmp_split) AS prev_{name}")
+
+        group_columns = [f"{expr} AS {alias}" for alias, expr in (group_by or [])]
+        query = f"""
+            SELECT {', '.join(group_columns + columns)}
+            FROM {table}
+            WHERE {where} {extra_where}
+        """
+        if group_by:
+            query += f" GROUP BY {', '.join(alias for alias, _ in group_by)}"
+        if order_by:
+            query += f" ORDER BY {order_by}"
+        return query, params
+
+    def run(self, db: Session, aggregates: Dict[str, str], params: Optional[Dict] = None,
+            **kwargs) -> List[Dict[str, Any]]:
+        """
+        Execute the comparison and split each row into
+        {'group': {...}, 'current': {...}, 'previous': {...}}
+        """
+        query, query_params = self.build(aggregates, **kwargs)
+        query_params.update(params or {})
+        rows = db.execute(text(query), query_params).mappings().fetchall()
+
+        group_aliases = [alias for alias, _ in (kwargs.get('group_by') or [])]
+        results = []
+        for row in rows:
+            results.append({
+                'group': {alias: row[alias] for alias in group_aliases},
+                'current': {name: row[f'cur_{name}'] for name in aggregates},
+                'previous': {name: row[f'prev_{name}'] for name in aggregates},
+            })
+        return results
@@ -0,0 +1,471 @@
+"""
+Sales rollup management
+Maintains the sales_hourly_rollup table and decides when AnalyticsService
+can answer from it instead of scanning raw sales rows
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from datetime import datetime, date, timedelta
+from typing import Optional, Dict, List, NamedTuple, Set, Tuple
+import asyncio
+import logging
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = "sales_hourly_rollup"
+
+# Arbitrary constant used with pg_try_advisory_xact_lock so only one worker
+# refreshes the rollup at a time
+ROLLUP_LOCK_KEY = 720_410_001
+
+# Filters that can be evaluated on an hour bucket + channel_id.
+# Anything else (categories, customer_type, ...) forces the raw path.
+ROLLUP_FILTER_KEYS = {"channels", "day_of_week", "time_of_day"}
+
+# Delivery / production time histograms: DURATION_BINS bins of
+# DURATION_BIN_SECONDS, the last one open-ended (everything >= 115 min).
+# Histograms add up across buckets, so percentiles can be read from any
+# slice of the rollup.
+DURATION_BIN_SECONDS = 300
+DURATION_BINS = 24
+
+CANCELLED_STATUS = "CANCELLED"
+
+# Columns added after the first version of the table; a rollup without
+# them is rebuilt from scratch
+OPERATIONS_COLUMNS = [
+    ("cancelled", "INTEGER NOT NULL DEFAULT 0"),
+    ("delivery_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("delivery_seconds", "BIGINT NOT NULL DEFAULT 0"),
+    ("delivery_hist", "INTEGER[]"),
+    ("production_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("production_seconds", "BIGINT NOT NULL DEFAULT 0"),
+    ("production_hist", "INTEGER[]"),
+]
+
+ROLLUP_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS sales_hourly_rollup (
+        bucket TIMESTAMP NOT NULL,
+        store_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        sub_brand_id INTEGER NOT NULL DEFAULT 0,
+        orders INTEGER NOT NULL,
+        revenue DECIMAL(14,2) NOT NULL,
+        revenue_sq DECIMAL(20,4) NOT NULL,
+        PRIMARY KEY (bucket, store_id, channel_id, sub_brand_id)
+    )
+    """,
+    # Store-scoped dashboards read one store's buckets
+    "CREATE INDEX IF NOT EXISTS idx_rollup_store_bucket ON sales_hourly_rollup(store_id, bucket)",
+    """
+    CREATE TABLE IF NOT EXISTS rollup_watermarks (
+        name VARCHAR(100) PRIMARY KEY,
+        last_sale_id BIGINT NOT NULL DEFAULT 0,
+        refreshed_at TIMESTAMP
+    )
+    """,
+]
+
+
+def _bin_bounds(i: int) -> Tuple[int, Optional[int]]:
+    low = i * DURATION_BIN_SECONDS
+    return low, (low + DURATION_BIN_SECONDS if i < DURATION_BINS - 1 else None)
+
+
+def _bin_predicate(column: str, i: int) -> str:
+    low, high = _bin_bounds(i)
+    predicate = f"{column} >= {low}"
+    return predicate + (f" AND {column} < {high}" if high is not None else "")
+
+
+def _histogram(column: str) -> str:
+    """ARRAY of per-bin counts of a seconds column (aggregate expression)"""
+    bins = ", ".join(f"COUNT(*) FILTER (WHERE {_bin_predicate(column, i)})" for i in range(DURATION_BINS))
+    return f"ARRAY[{bins}]::INTEGER[]"
+
+
+# Aggregation shared by the full rebuild and the incremental refresh
+_ROLLUP_SELECT = f"""
+    SELECT
+        DATE_TRUNC('hour', s.created_at) AS bucket,
+        s.store_id,
+        s.channel_id,
+        COALESCE(s.sub_brand_id, 0) AS sub_brand_id,
+        COUNT(*) AS orders,
+        COALESCE(SUM(s.total_amount), 0) AS revenue,
+        COALESCE(SUM(s.total_amount * s.total_amount), 0) AS revenue_sq,
+        COUNT(*) FILTER (WHERE s.sale_status_desc = '{CANCELLED_STATUS}') AS cancelled,
+        COUNT(s.delivery_seconds) AS delivery_count,
+        COALESCE(SUM(s.delivery_seconds), 0) AS delivery_seconds,
+        {_histogram('s.delivery_seconds')} AS delivery_hist,
+        COUNT(s.production_seconds) AS production_count,
+        COALESCE(SUM(s.production_seconds), 0) AS production_seconds,
+        {_histogram('s.production_seconds')} AS production_hist
+"""
+
+_ROLLUP_GROUP_BY = """
+    GROUP BY DATE_TRUNC('hour', s.created_at), s.store_id, s.channel_id, COALESCE(s.sub_brand_id, 0)
+"""
+
+_ROLLUP_COLUMNS = (
+    "bucket, store_id, channel_id, sub_brand_id, orders, revenue, revenue_sq, "
+    "cancelled, delivery_count, delivery_seconds, delivery_hist, "
+    "production_count, production_seconds, production_hist"
+)
+
+
+class SalesSource(NamedTuple):
+    """
+    SQL fragments describing where sales aggregates are read from.
+    Both sources are aliased as `s` so filter predicates stay the same.
+    `orders` and `revenue` are bare aggregate calls (no COALESCE) so they
+    can take a FILTER clause.
+    """
+    table: str
+    time_column: str
+    orders: str
+    revenue: str
+    is_rollup: bool
+
+
+RAW_SALES = SalesSource(
+    table="sales s",
+    time_column="s.created_at",
+    orders="COUNT(s.id)",
+    revenue="SUM(s.total_amount)",
+    is_rollup=False,
+)
+
+ROLLUP_SALES = SalesSource(
+    table="sales_hourly_rollup s",
+    time_column="s.bucket",
+    orders="SUM(s.orders)",
+    revenue="SUM(s.revenue)",
+    is_rollup=True,
+)
+
+
+class RollupState:
+    """
+    Per-process view of the rollup: set by the refresher once the
+    watermark exists, read by AnalyticsService on every request
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.last_sale_id = 0
+        self.refreshed_at: Optional[datetime] = None
+
+
+rollup_state = RollupState()
+
+
+def pick_sales_source(filters: Optional[Dict] = None) -> SalesSource:
+    """
+    Return ROLLUP_SALES when the rollup is built and every active filter
+    can be answered from it, RAW_SALES otherwise
+    """
+    if not settings.ROLLUP_ENABLED or not rollup_state.ready:
+        return RAW_SALES
+
+    active = {key for key, value in (filters or {}).items() if value}
+    if active - ROLLUP_FILTER_KEYS:
+        return RAW_SALES
+
+    return ROLLUP_SALES
+
+
+def operations_columns(source: SalesSource) -> str:
+    """
+    SELECT fragment with cancellations, delivery / production time sums and
+    histogram bins (delivery_h0.., production_h0..) for one GROUP BY; same
+    columns from raw sales and from the rollup, read back by operations_metrics
+    """
+    columns = []
+    if source.is_rollup:
+        columns += [
+            "COALESCE(SUM(s.cancelled), 0) AS cancelled",
+            "COALESCE(SUM(s.delivery_count), 0) AS delivery_count",
+            "COALESCE(SUM(s.delivery_seconds), 0) AS delivery_seconds",
+            "COALESCE(SUM(s.production_count), 0) AS production_count",
+            "COALESCE(SUM(s.production_seconds), 0) AS production_seconds",
+        ]
+        for metric in ("delivery", "production"):
+            columns += [f"COALESCE(SUM(s.{metric}_hist[{i + 1}]), 0) AS {metric}_h{i}" for i in range(DURATION_BINS)]
+    else:
+        columns += [
+            f"COUNT(*) FILTER (WHERE s.sale_status_desc = '{CANCELLED_STATUS}') AS cancelled",
+            "COUNT(s.delivery_seconds) AS delivery_count",
+            "COALESCE(SUM(s.delivery_seconds), 0) AS delivery_seconds",
+            "COUNT(s.production_seconds) AS production_count",
+            "COALESCE(SUM(s.production_seconds), 0) AS production_seconds",
+        ]
+        for metric in ("delivery", "production"):
+            columns += [
+                f"COUNT(*) FILTER (WHERE {_bin_predicate(f's.{metric}_seconds', i)}) AS {metric}_h{i}"
+                for i in range(DURATION_BINS)
+            ]
+    return ",\n".join(columns)
+
+
+def histogram_percentile(counts: List[int], q: float) -> Optional[float]:
+    """
+    q-th quantile (0-1) in seconds from DURATION_BINS counts, interpolating
+    linearly inside the bin; the open last bin reports its lower bound
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+    target = q * total
+    seen = 0
+    for i, n in enumerate(counts):
+        if n and seen + n >= target:
+            low, high = _bin_bounds(i)
+            if high is None:
+                return float(low)
+            return low + (target - seen) / n * (high - low)
+        seen += n
+    return float(_bin_bounds(len(counts) - 1)[0])
+
+
+def operations_metrics(row) -> Dict[str, Optional[float]]:
+    """Row with operations_columns -> minutes / percentages for the API"""
+    def minutes(seconds):
+        return round(seconds / 60, 1) if seconds is not None else None
+
+    metrics = {}
+    for metric in ("delivery", "production"):
+        count = int(getattr(row, f"{metric}_count") or 0)
+        counts = [int(getattr(row, f"{metric}_h{i}") or 0) for i in range(DURATION_BINS)]
+        metrics[f"avg_{metric}_time"] = minutes(float(getattr(row, f"{metric}_seconds")) / count) if count else None
+        metrics[f"{metric}_time_p50"] = minutes(histogram_percentile(counts, 0.5))
+        metrics[f"{metric}_time_p90"] = minutes(histogram_percentile(counts, 0.9))
+
+    orders = int(row.orders or 0)
+    cancelled = int(row.cancelled or 0)
+    metrics["cancelled_orders"] = cancelled
+    metrics["cancellation_rate"] = round(cancelled / orders * 100, 2) if orders else 0.0
+    return metrics
+
+
+def invalidate_days(days: List[date]):
+    """Drop cached entries covering any of `days` (all stores) or no fixed day"""
+    cache.invalidate_tags(["day:any"], *([f"day:{d.isoformat()}"] for d in days))
+
+
+class SalesRollupRefresher:
+    """
+    Builds and incrementally refreshes sales_hourly_rollup.
+
+    The watermark is the highest sales.id already folded into the rollup.
+    Each refresh finds the hours touched by newer sales and recomputes
+    only those buckets from raw rows.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        # (store_id, day) pairs touched by the last incremental refresh
+        self.touched: Set[Tuple[int, date]] = set()
+        # Days recomputed by the last full rebuild (every store)
+        self.rebuilt_days: List[date] = []
+
+    def ensure_schema(self):
+        """Create rollup tables if they don't exist"""
+        for ddl in ROLLUP_DDL:
+            self.db.execute(text(ddl))
+
+        existing = {
+            r.column_name for r in self.db.execute(text("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_name = 'sales_hourly_rollup'
+            """)).fetchall()
+        }
+        missing = [(name, ddl) for name, ddl in OPERATIONS_COLUMNS if name not in existing]
+        for name, ddl in missing:
+            self.db.execute(text(f"ALTER TABLE sales_hourly_rollup ADD COLUMN IF NOT EXISTS {name} {ddl}"))
+        if missing:
+            # Old buckets have no operations data: force a full rebuild
+            logger.info(f"📦 Rollup gained {[name for name, _ in missing]}, rebuilding")
+            self.db.execute(text("UPDATE rollup_watermarks SET last_sale_id = 0 WHERE name = :name"),
+                            {"name": ROLLUP_NAME})
+        self.db.commit()
+
+    def get_watermark(self) -> Optional[int]:
+        row = self.db.execute(
+            text("SELECT last_sale_id FROM rollup_watermarks WHERE name = :name"),
+            {"name": ROLLUP_NAME}
+        ).first()
+        return int(row.last_sale_id) if row else None
+
+    def refresh(self) -> Dict:
+        """
+        Fold sales inserted since the last watermark into the rollup.
+        Returns a summary with the number of hour buckets reprocessed.
+        """
+        self.touched = set()
+        self.rebuilt_days = []
+        try:
+            locked = self.db.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"),
+                {"key": ROLLUP_LOCK_KEY}
+            ).scalar()
+            if not locked:
+                # Another worker is refreshing; just report what is there
+                self.db.rollback()
+                self._update_state(self.get_watermark())
+                return {"status": "skipped", "hours": 0}
+
+            watermark = self.get_watermark()
+            new_watermark = int(self.db.execute(
+                text("SELECT COALESCE(MAX(id), 0) FROM sales")
+            ).scalar() or 0)
+
+            if watermark is None or watermark == 0:
+                hours = self._rebuild_all()
+            elif new_watermark > watermark:
+                hours = self._refresh_since(watermark, new_watermark)
+            else:
+                hours = []
+
+            self._save_watermark(new_watermark)
+            self.db.commit()
+            self._update_state(new_watermark)
+            
+            # Only cached entries covering the touched store/days are dropped
+            for store_id, day in sorted(self.touched):
+                cache.invalidate_sales(store_id, day)
+            if self.rebuilt_days:
+                invalidate_days(self.rebuilt_days)
+
+            if hours:
+                logger.info(f"📦 Rollup refreshed: {len(hours)} hour buckets (watermark {new_watermark})")
+            return {"status": "ok", "hours": len(hours), "watermark": new_watermark}
+
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def rebuild_range(self, start: datetime, end: datetime) -> int:
+        """
+        Recompute every bucket in [start, end). Used after updates to
+        existing sales (status changes, corrections) that the id
+        watermark cannot see.
+        """
+        self.db.execute(
+            text("DELETE FROM sales_hourly_rollup WHERE bucket >= :start AND bucket < :end"),
+            {"start": start, "end": end}
+        )
+        result = self.db.execute(
+            text(f"""
+                INSERT INTO sales_hourly_rollup ({_ROLLUP_COLUMNS})
+                {_ROLLUP_SELECT}
+                FROM sales s
+                WHERE s.created_at >= :start AND s.created_at < :end
+                {_ROLLUP_GROUP_BY}
+            """),
+            {"start": start, "end": end}
+        )
+        self.db.commit()
+
+        day = start.date()
+        days = []
+        while day <= (end - timedelta(microseconds=1)).date():
+            days.append(day)
+            day += timedelta(days=1)
+        invalidate_days(days)
+        return result.rowcount
+
+    def _rebuild_all(self):
+        self.db.execute(text("TRUNCATE sales_hourly_rollup"))
+        self.db.execute(text(f"""
+            INSERT INTO sales_hourly_rollup ({_ROLLUP_COLUMNS})
+            {_ROLLUP_SELECT}
+            FROM sales s
+            {_ROLLUP_GROUP_BY}
+        """))
+        rows = self.db.execute(text("SELECT DISTINCT bucket FROM sales_hourly_rollup")).fetchall()
+        hours = [r.bucket for r in rows]
+        # Every store's buckets changed: invalidated per day once committed
+        self.rebuilt_days = sorted({bucket.date() for bucket in hours})
+        return hours
+
+    def _refresh_since(self, watermark: int, new_watermark: int):
+        touched = self.db.execute(
+            text("""
+                SELECT DISTINCT DATE_TRUNC('hour', created_at) AS bucket, store_id
+                FROM sales
+                WHERE id > :watermark AND id <= :new_watermark
+            """),
+            {"watermark": watermark, "new_watermark": new_watermark}
+        ).fetchall()
+        hours = sorted({r.bucket for r in touched})
+        self.touched = {(r.store_id, r.bucket.date()) for r in touched}
+        if not hours:
+            return []
+
+        self.db.execute(
+            text("DELETE FROM sales_hourly_rollup WHERE bucket = ANY(:hours)"),
+            {"hours": hours}
+        )
+        # Join against the touched hours so each bucket is an index range
+        # scan on sales.created_at instead of a function-wrapped predicate
+        self.db.execute(
+            text(f"""
+                INSERT INTO sales_hourly_rollup ({_ROLLUP_COLUMNS})
+                {_ROLLUP_SELECT}
+                FROM unnest(CAST(:hours AS timestamp[])) AS h(bucket)
+                JOIN sales s
+                  ON s.created_at >= h.bucket
+                 AND s.created_at < h.bucket + INTERVAL '1 hour'
+                {_ROLLUP_GROUP_BY}
+            """),
+            {"hours": hours}
+        )
+        return hours
+
+    def _save_watermark(self, last_sale_id: int):
+        self.db.execute(
+            text("""
+                INSERT INTO rollup_watermarks (name, last_sale_id, refreshed_at)
+                VALUES (:name, :last_sale_id, NOW())
+                ON CONFLICT (name) DO UPDATE
+                SET last_sale_id = EXCLUDED.last_sale_id,
+                    refreshed_at = EXCLUDED.refreshed_at
+            """),
+            {"name": ROLLUP_NAME, "last_sale_id": last_sale_id}
+        )
+
+    def _update_state(self, watermark: Optional[int]):
+        rollup_state.ready = bool(watermark)
+        rollup_state.last_sale_id = watermark or 0
+        rollup_state.refreshed_at = datetime.utcnow()
+
+
+def refresh_rollup_once() -> Dict:
+    """Run one refresh cycle with its own session"""
+    db = SessionLocal()
+    try:
+        refresher = SalesRollupRefresher(db)
+        refresher.ensure_schema()
+        return refresher.refresh()
+    except Exception as e:
+        logger.error(f"Rollup refresh error: {e}")
+        return {"status": "error", "hours": 0}
+    finally:
+        db.close()
+
+
+async def run_rollup_refresher():
+    """
+    Background loop started from the app lifespan.
+    The refresh itself is blocking, so it runs in a worker thread.
+    """
+    while True:
+        await asyncio.to_thread(refresh_rollup_once)
+        await asyncio.sleep(settings.ROLLUP_REFRESH_INTERVAL)
@@ -0,0 +1,324 @@
+"""
+Sales cube
+In-process NumPy arrays of orders and revenue by day x hour x store x
+channel, loaded from sales_hourly_rollup. Overview and timeline panels
+slice it with vectorized masks instead of running SQL whenever
+every active filter is one of channels / day_of_week / time_of_day.
+
+Each worker keeps its own copy and follows the rollup watermark: only
+the days touched by sales folded since the last refresh are reloaded.
+Memory is capped by CUBE_MAX_BYTES; when the history doesn't fit, the
+cube keeps the most recent days and older ranges go to SQL.
+"""
+
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from datetime import date, datetime, timedelta
+from typing import Optional, Dict, List, Tuple, Any
+import asyncio
+import logging
+import threading
+
+import numpy as np
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..core.filter_compiler import CompiledFilters
+from .rollup_service import ROLLUP_NAME, ROLLUP_FILTER_KEYS, rollup_state
+
+logger = logging.getLogger(__name__)
+
+# int32 orders + float64 revenue
+BYTES_PER_CELL = np.dtype(np.int32).itemsize + np.dtype(np.float64).itemsize
+
+
+class CubeData:
+    """
+    One loaded cube. Arrays are indexed [day, hour, store, channel]; day 0
+    is `first_day`.
+    """
+
+    def __init__(self, first_day: date, days: int, store_ids: List[int],
+                 channels: List[Tuple[int, str, str]]):
+        self.first_day = first_day
+        self.store_ids = store_ids
+        self.store_index = {store_id: i for i, store_id in enumerate(store_ids)}
+        self.channels = channels
+        self.channel_index = {channel[0]: i for i, channel in enumerate(channels)}
+        shape = (days, 24, len(store_ids), len(channels))
+        self.orders = np.zeros(shape, dtype=np.int32)
+        self.revenue = np.zeros(shape, dtype=np.float64)
+
+    @property
+    def days(self) -> int:
+        return self.orders.shape[0]
+
+    @property
+    def last_day(self) -> date:
+        return self.first_day + timedelta(days=self.days - 1)
+
+    @property
+    def nbytes(self) -> int:
+        return self.orders.nbytes + self.revenue.nbytes
+
+    def day_of(self, day: date) -> int:
+        return (day - self.first_day).days
+
+    def fill(self, rows):
+        """Add rollup rows (bucket, store_id, channel_id, orders, revenue) into the arrays"""
+        if not rows:
+            return
+        buckets = [r.bucket for r in rows]
+        d = np.fromiter(((b.date() - self.first_day).days for b in buckets), dtype=np.int64, count=len(rows))
+        h = np.fromiter((b.hour for b in buckets), dtype=np.int64, count=len(rows))
+        s = np.fromiter((self.store_index.get(r.store_id, -1) for r in rows), dtype=np.int64, count=len(rows))
+        c = np.fromiter((self.channel_index.get(r.channel_id, -1) for r in rows), dtype=np.int64, count=len(rows))
+        keep = (d >= 0) & (d < self.days) & (s >= 0) & (c >= 0)
+        index = (d[keep], h[keep], s[keep], c[keep])
+        np.add.at(self.orders, index, np.fromiter((r.orders for r in rows), dtype=np.int64, count=len(rows))[keep])
+        np.add.at(self.revenue, index, np.fromiter((float(r.revenue) for r in rows), dtype=np.float64, count=len(rows))[keep])
+
+
+class SalesCube:
+    def __init__(self):
+        self.data: Optional[CubeData] = None
+        self.watermark = 0
+        self.loaded_at: Optional[datetime] = None
+        self.lock = threading.Lock()
+        self.stats_counters = {'hits': 0, 'misses': 0, 'reloads': 0, 'refreshes': 0}
+
+    # ===== Carga =====
+
+    def load(self, db: Session) -> bool:
+        """Full load of the most recent days that fit in CUBE_MAX_BYTES"""
+        store_ids = [r.id for r in db.execute(text("SELECT id FROM stores ORDER BY id")).fetchall()]
+        channels = [(r.id, r.name, r.type) for r in
+                    db.execute(text("SELECT id, name, type FROM channels ORDER BY id")).fetchall()]
+        bounds = db.execute(text("SELECT MIN(bucket) AS first, MAX(bucket) AS last FROM sales_hourly_rollup")).first()
+        watermark = self._rollup_watermark(db)
+        if not store_ids or not channels or not bounds or bounds.first is None:
+            return False
+
+        last_day = max(bounds.last.date(), date.today())
+        bytes_per_day = 24 * len(store_ids) * len(channels) * BYTES_PER_CELL
+        max_days = settings.CUBE_MAX_BYTES // bytes_per_day
+        if max_days < 1:
+            logger.warning("Sales cube disabled: one day doesn't fit in CUBE_MAX_BYTES")
+            return False
+        first_day = max(bounds.first.date(), last_day - timedelta(days=max_days - 1))
+
+        data = CubeData(first_day, (last_day - first_day).days + 1, store_ids, channels)
+        data.fill(self._rollup_rows(db, datetime.combine(first_day, datetime.min.time())))
+
+        with self.lock:
+            self.data = data
+            self.watermark = watermark
+            self.loaded_at = datetime.now()
+            self.stats_counters['reloads'] += 1
+        logger.info(f"🧮 Sales cube loaded: {data.days} days from {first_day}, "
+                    f"{data.nbytes / 1024 / 1024:.1f} MB")
+        return True
+
+    def refresh(self, db: Session) -> int:
+        """
+        Reload only the days touched by sales the rollup folded in since
+        the cube's watermark. Returns the number of days reloaded.
+        """
+        data = self.data
+        if data is None:
+            return data_days(self.data) if self.load(db) else 0
+
+        watermark = self._rollup_watermark(db)
+        if watermark <= self.watermark:
+            return 0
+
+        rows = db.execute(
+            text("""
+                SELECT DISTINCT DATE_TRUNC('day', created_at) AS day, store_id, channel_id
+                FROM sales
+                WHERE id > :watermark AND id <= :new_watermark
+            """),
+            {"watermark": self.watermark, "new_watermark": watermark}
+        ).fetchall()
+
+        # Lojas/canais novos ou dias além do cubo: recarrega tudo
+        if any(r.store_id not in data.store_index or r.channel_id not in data.channel_index
+               or r.day.date() > data.last_day for r in rows):
+            self.load(db)
+            return data_days(self.data)
+
+        days = sorted({r.day.date() for r in rows if r.day.date() >= data.first_day})
+        for day in days:
+            start = datetime.combine(day, datetime.min.time())
+            partial = CubeData(day, 1, data.store_ids, data.channels)
+            partial.fill(self._rollup_rows(db, start, start + timedelta(days=1)))
+            i = data.day_of(day)
+            # Swap the whole day slice at once
+            data.orders[i] = partial.orders[0]
+            data.revenue[i] = partial.revenue[0]
+
+        with self.lock:
+            self.watermark = watermark
+            self.stats_counters['refreshes'] += 1
+        return len(days)
+
+    def _rollup_rows(self, db: Session, start: datetime, end: Optional[datetime] = None):
+        end_clause = "AND bucket < :end" if end else ""
+        return db.execute(
+            text(f"""
+                SELECT bucket, store_id, channel_id, SUM(orders) AS orders, SUM(revenue) AS revenue
+                FROM sales_hourly_rollup
+                WHERE bucket >= :start {end_clause}
+                GROUP BY bucket, store_id, channel_id
+            """),
+            {"start": start, "end": end}
+        ).fetchall()
+
+    def _rollup_watermark(self, db: Session) -> int:
+        value = db.execute(
+            text("SELECT last_sale_id FROM rollup_watermarks WHERE name = :name"),
+            {"name": ROLLUP_NAME}
+        ).scalar()
+        return int(value or 0)
+
+    # ===== Consultas =====
+
+    def can_answer(self, compiled: CompiledFilters, filters: Optional[Dict] = None) -> bool:
+        """
+        True when the cube is loaded, covers the range (and the previous
+        period used by comparisons) and every filter is a cube dimension
+        """
+        data = self.data
+        if not settings.CUBE_ENABLED or data is None or not rollup_state.ready:
+            return False
+        active = {key for key, value in (filters or {}).items() if value}
+        days = (compiled.end_date - compiled.start_date).days + 1
+        ok = not (active - ROLLUP_FILTER_KEYS) and \
+            compiled.start_date - timedelta(days=days) >= data.first_day
+        self.stats_counters['hits' if ok else 'misses'] += 1
+        return ok
+
+    def _masked(self, compiled: CompiledFilters, values: np.ndarray, data: CubeData,
+                keep_channels: bool = False) -> Tuple[np.ndarray, List[date]]:
+        """
+        Values for the compiled range reduced over store (and channel,
+        unless keep_channels) with the day/hour filters applied.
+        Returns ([day, hour(, channel)] array, list of days).
+        """
+        d0 = max(data.day_of(compiled.start_date), 0)
+        d1 = min(data.day_of(compiled.end_date) + 1, data.days)
+        days = [data.first_day + timedelta(days=i) for i in range(d0, max(d1, d0))]
+        block = values[d0:d1]
+
+        if compiled.store_id is not None:
+            s = data.store_index.get(compiled.store_id)
+            block = block[:, :, s:s + 1] if s is not None else block[:, :, :0]
+        if compiled.channel_ids:
+            c = [data.channel_index[i] for i in compiled.channel_ids if i in data.channel_index]
+            block = block[..., c]
+        block = block.sum(axis=2)
+        if not keep_channels:
+            block = block.sum(axis=-1)
+
+        mask = np.ones((len(days), 24), dtype=bool)
+        if compiled.days:
+            # date.weekday(): monday = 0 -> DOW: sunday = 0
+            dow = np.array([(d.weekday() + 1) % 7 for d in days], dtype=np.int64)
+            mask &= np.isin(dow, compiled.days)[:, None]
+        if compiled.hours:
+            mask &= np.isin(np.arange(24), compiled.hours)[None, :]
+        if keep_channels:
+            mask = mask[..., None]
+        return np.where(mask, block, 0), days
+
+    def totals(self, compiled: CompiledFilters) -> Tuple[int, float]:
+        data = self.data
+        orders, _ = self._masked(compiled, data.orders, data)
+        revenue, _ = self._masked(compiled, data.revenue, data)
+        return int(orders.sum()), float(revenue.sum())
+
+    def series(self, compiled: CompiledFilters, granularity: str) -> List[Dict[str, Any]]:
+        """
+        (period, orders, revenue) per bucket with sales, labelled like
+        TO_CHAR(DATE_TRUNC(granularity, ...)) in AnalyticsService
+        """
+        data = self.data
+        orders, days = self._masked(compiled, data.orders, data)
+        revenue, _ = self._masked(compiled, data.revenue, data)
+        if not days:
+            return []
+
+        if granularity == 'hour':
+            labels = [f"{d.isoformat()} {h:02d}:00" for d in days for h in range(24)]
+            orders, revenue = orders.reshape(-1), revenue.reshape(-1)
+        else:
+            orders, revenue = orders.sum(axis=1), revenue.sum(axis=1)
+            if granularity in ('week', 'month'):
+                if granularity == 'week':
+                    starts = [i for i, d in enumerate(days) if i == 0 or d.weekday() == 0]
+                    labels = [(days[i] - timedelta(days=days[i].weekday())).isoformat() for i in starts]
+                else:
+                    starts = [i for i, d in enumerate(days) if i == 0 or d.day == 1]
+                    labels = [days[i].strftime('%Y-%m') for i in starts]
+                orders = np.add.reduceat(orders, starts)
+                revenue = np.add.reduceat(revenue, starts)
+            else:
+                labels = [d.isoformat() for d in days]
+
+        return [
+            {'period': label, 'orders': int(o), 'revenue': float(r)}
+            for label, o, r in zip(labels, orders, revenue) if o > 0
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        data = self.data
+        return {
+            'loaded': data is not None,
+            'first_day': str(data.first_day) if data else None,
+            'last_day': str(data.last_day) if data else None,
+            'days': data.days if data else 0,
+            'stores': len(data.store_ids) if data else 0,
+            'channels': len(data.channels) if data else 0,
+            'bytes': data.nbytes if data else 0,
+            'max_bytes': settings.CUBE_MAX_BYTES,
+            'watermark': self.watermark,
+            'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None,
+            **self.stats_counters,
+        }
+
+
+def data_days(data: Optional[CubeData]) -> int:
+    return data.days if data else 0
+
+
+sales_cube = SalesCube()
+
+
+def refresh_cube_once(full: bool = False) -> int:
+    """Load or refresh the cube with its own session"""
+    db = SessionLocal()
+    try:
+        if full or sales_cube.data is None:
+            return data_days(sales_cube.data) if sales_cube.load(db) else 0
+        return sales_cube.refresh(db)
+    except Exception as e:
+        logger.error(f"Sales cube refresh error: {e}")
+        return 0
+    finally:
+        db.close()
+
+
+async def run_cube_refresher():
+    """
+    Background loop started from the app lifespan: load, then follow the
+    rollup watermark; full reload every CUBE_FULL_RELOAD_INTERVAL (catches
+    rollup rebuilds the watermark can't see)
+    """
+    last_full = None
+    while True:
+        now = datetime.now()
+        full = last_full is None or (now - last_full).total_seconds() >= settings.CUBE_FULL_RELOAD_INTERVAL
+        await asyncio.to_thread(refresh_cube_once, full)
+        if full:
+            last_full = now
+        await asyncio.sleep(settings.CUBE_REFRESH_INTERVAL)
@@ -153,6 +153,38 @@ class TestAnalyticsAPI:
             assert "revenue" in channel
             assert "avg_ticket" in channel
     
+    def test_dashboard_endpoint(self):
+        """Test composite dashboard endpoint returns every panel with timings"""
+        response = client.get("/api/v1/analytics/dashboard?channels=ifood")
+        assert response.status_code == 200
+        data = response.json()
+
+        assert "panels" in data
+        assert "timings" in data
+        assert "total_ms" in data
+        for panel in ["overview", "timeline", "top_products", "channels", "insights"]:
+            assert panel in data["panels"]
+            assert panel in data["timings"]
+            assert "ms" in data["timings"][panel]
+
+    def test_dashboard_panel_selection(self):
+        """Test dashboard only loads the requested panels"""
+        response = client.get("/api/v1/analytics/dashboard?panels=overview,insights")
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data["timings"]) == {"overview", "insights"}
+        assert data["panels"]["timeline"] is None
+
+    def test_export_rejects_unknown_format(self):
+        """Test export validates type and format before streaming"""
+        response = client.post("/api/v1/analytics/export", json={"export_type": "sales", "format": "xlsx"})
+        assert response.status_code == 422
+
+    def test_unknown_job_returns_404(self):
+        """Test job status for an id that was never submitted"""
+        response = client.get("/api/v1/analytics/jobs/does-not-exist")
+        assert response.status_code == 404
+
     def test_natural_query_endpoint(self):
         """Test natural language query endpoint"""
         queries = [
@@ -174,6 +206,28 @@ class TestAnalyticsAPI:
             assert "answer" in data
             assert "confidence" in data
     
+    def test_natural_query_batch_endpoint(self):
+        """Test batch natural language queries: one answer per question, in order"""
+        queries = [
+            "Quanto vendi nos últimos 30 dias?",
+            "Qual o melhor canal de vendas?",
+            "Quais clientes compraram 3+ vezes mas não voltam há 30 dias?",
+        ]
+        response = client.post("/api/v1/analytics/natural-query/batch", json={"queries": queries})
+        assert response.status_code == 200
+        data = response.json()
+        
+        assert [answer["query"] for answer in data["answers"]] == queries
+        for answer in data["answers"]:
+            assert "answer" in answer
+            assert answer["timing"]["ms"] >= 0
+        # The first two share one scan, retention is answered alone
+        assert data["scans"][0]["queries"] == [0, 1]
+        assert data["answers"][2]["timing"]["scan"] is None
+        
+        response = client.post("/api/v1/analytics/natural-query/batch", json={"queries": ["faturamento"] * 50})
+        assert response.status_code == 400
+    
     def test_cache_performance(self):
         """Test that caching improves performance"""
         endpoint = "/api/v1/analytics/overview"
@@ -137,7 +137,10 @@ CREATE TABLE product_sales (
     quantity FLOAT NOT NULL,
     base_price FLOAT NOT NULL,
     total_price FLOAT NOT NULL,
-    observations VARCHAR(300)
+    observations VARCHAR(300),
+    -- Copy of sales.created_at: lets product_sales be range-partitioned
+    -- alongside sales (backend/app/services/partition_manager.py)
+    sale_created_at TIMESTAMP
 );
 
 -- Items added to products (e.g., "Hamburguer + Bacon + Queijo extra")
@@ -233,4 +236,63 @@ CREATE TABLE coupon_sales (
     value FLOAT,
     target VARCHAR(100),
     sponsorship VARCHAR(100)
-);
\ No newline at end of file
+);
+
+-- Pre-aggregated sales per hour (maintained incrementally by the backend)
+CREATE TABLE sales_hourly_rollup (
+    bucket TIMESTAMP NOT NULL,
+    store_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    sub_brand_id INTEGER NOT NULL DEFAULT 0,
+    orders INTEGER NOT NULL,
+    revenue DECIMAL(14,2) NOT NULL,
+    revenue_sq DECIMAL(20,4) NOT NULL,
+    -- Operations; *_hist = counts per 5-minute bin, last bin open-ended
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    delivery_count INTEGER NOT NULL DEFAULT 0,
+    delivery_seconds BIGINT NOT NULL DEFAULT 0,
+    delivery_hist INTEGER[],
+    production_count INTEGER NOT NULL DEFAULT 0,
+    production_seconds BIGINT NOT NULL DEFAULT 0,
+    production_hist INTEGER[],
+    PRIMARY KEY (bucket, store_id, channel_id, sub_brand_id)
+);
+
+CREATE INDEX idx_rollup_store_bucket ON sales_hourly_rollup(store_id, bucket);
+
+CREATE TABLE rollup_watermarks (
+    name VARCHAR(100) PRIMARY KEY,
+    last_sale_id BIGINT NOT NULL DEFAULT 0,
+    refreshed_at TIMESTAMP
+);
+
+-- HyperLogLog sketches of customer_id (backend/app/services/customer_sketches.py)
+-- grain D = day, M = month; store_id / channel_id 0 = all
+CREATE TABLE customer_sketches (
+    grain CHAR(1) NOT NULL,
+    period DATE NOT NULL,
+    store_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    sketch BYTEA NOT NULL,
+    PRIMARY KEY (grain, period, store_id, channel_id)
+);
+
+-- Precomputed /insights payloads (backend/app/services/insights_engine.py); store_id 0 = all stores
+CREATE TABLE business_insights (
+    store_id INTEGER PRIMARY KEY,
+    payload JSONB NOT NULL,
+    computed_at TIMESTAMP NOT NULL
+);
+
+-- Analytics indexes (kept in sync with backend/app/services/index_advisor.py)
+-- Every query filters sales by a half-open created_at range; the INCLUDE
+-- columns let the aggregates run as index-only scans
+CREATE INDEX idx_sales_created_covering ON sales(created_at)
+    INCLUDE (total_amount, channel_id, store_id, customer_id);
+CREATE INDEX idx_sales_created_brin ON sales USING BRIN (created_at) WITH (pages_per_range = 32);
+-- Store-first index: a single-store dashboard reads only that store's rows
+CREATE INDEX idx_sales_store_created_covering ON sales(store_id, created_at)
+    INCLUDE (total_amount, channel_id, customer_id);
+CREATE INDEX idx_product_sales_sale_covering ON product_sales(sale_id)
+    INCLUDE (product_id, quantity, total_price, base_price);
+CREATE INDEX idx_product_sales_product_sale ON product_sales(product_id, sale_id);
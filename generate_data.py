@@ -573,12 +573,13 @@ def insert_sales_batch(cursor, sales_batch, items, option_groups):
         for prod_data in sale['products']:
             cursor.execute("""
                 INSERT INTO product_sales (
-                    sale_id, product_id, quantity, base_price, total_price
-                ) VALUES (%s,%s,%s,%s,%s) RETURNING id
+                    sale_id, product_id, quantity, base_price, total_price,
+                    sale_created_at
+                ) VALUES (%s,%s,%s,%s,%s,%s) RETURNING id
             """, (
                 sale_id, prod_data['product_id'],
                 prod_data['quantity'], prod_data['base_price'],
-                prod_data['total_price']
+                prod_data['total_price'], sale['created_at']
             ))
             product_sale_id = cursor.fetchone()[0]
             
@@ -646,9 +647,18 @@ def create_indexes(conn):
     print("Creating indexes...")
     cursor = conn.cursor()
     
-    # Additional indexes
+    # Additional indexes (same set as backend/app/services/index_advisor.py)
     indexes = [
-        "CREATE INDEX IF NOT EXISTS idx_sales_date_status ON sales(DATE(created_at), sale_status_desc)",
+        "DROP INDEX IF EXISTS idx_sales_date_status",
+        "DROP INDEX IF EXISTS idx_sales_store_created",
+        "CREATE INDEX IF NOT EXISTS idx_sales_created_covering ON sales(created_at) "
+        "INCLUDE (total_amount, channel_id, store_id, customer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_created_brin ON sales USING BRIN (created_at) "
+        "WITH (pages_per_range = 32)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_store_created_covering ON sales(store_id, created_at) "
+        "INCLUDE (total_amount, channel_id, customer_id)",
+        "CREATE INDEX IF NOT EXISTS idx_product_sales_sale_covering ON product_sales(sale_id) "
+        "INCLUDE (product_id, quantity, total_price, base_price)",
         "CREATE INDEX IF NOT EXISTS idx_product_sales_product_sale ON product_sales(product_id, sale_id)",
     ]
     